@@ -5,6 +5,7 @@ from entry_exit_mouse_box.results_table import ResultsTable
 from entry_exit_mouse_box.video_mean_processor import QtWorkerVMP
 from entry_exit_mouse_box.mask_from_video import QtWorkerMFV
 from entry_exit_mouse_box.measures import QtWorkerMVP
+from entry_exit_mouse_box.mask_and_measures import QtWorkerMAM
 from entry_exit_mouse_box.utils import setup_logger
 
 from ._reader import napari_get_reader
@@ -17,6 +18,7 @@ __all__ = (
     "QtWorkerVMP",
     "QtWorkerMFV",
     "QtWorkerMVP",
+    "QtWorkerMAM",
     "setup_logger",
     "napari_get_reader",
     "MouseInOutWidget",
@@ -6,13 +6,17 @@ from qtpy.QtWidgets import (
     QHBoxLayout,
     QPushButton, 
     QFileDialog, 
-    QLabel
+    QLabel,
+    QComboBox,
+    QCheckBox
 )
 from qtpy.QtCore import QThread
 import napari
 from napari.utils import progress
 from napari.utils.notifications import show_info
-from entry_exit_mouse_box.convert_format import QtWorkerC2A
+from entry_exit_mouse_box.convert_format import QtWorkerC2A, INTERMEDIATE_FORMATS
+from entry_exit_mouse_box.video_mean_processor import background_params
+from entry_exit_mouse_box.artifact_cache import ArtifactCache
 
 
 class VideoConverterWidget(QWidget):
@@ -23,6 +27,7 @@ class VideoConverterWidget(QWidget):
         self.viewer = napari_viewer
         self.current = 0
         self.files = None
+        self.bg_cache = ArtifactCache()
         self.init_ui()
 
     def init_ui(self):
@@ -31,6 +36,9 @@ class VideoConverterWidget(QWidget):
         self.extension_field = QLineEdit(self)
         self.btn_start_conversion = QPushButton("Launch", self)
         self.btn_start_conversion.setEnabled(False)
+        self.intermediate_format = QComboBox(self)
+        self.intermediate_format.addItems(INTERMEDIATE_FORMATS.keys())
+        self.proxy_checkbox = QCheckBox("Proxy", self)
 
         layout = QVBoxLayout()
         layout.addWidget(self.btn_select_folder)
@@ -38,6 +46,11 @@ class VideoConverterWidget(QWidget):
         h_layout.addWidget(QLabel("Extension:"))
         h_layout.addWidget(self.extension_field)
         layout.addLayout(h_layout)
+        f_layout = QHBoxLayout()
+        f_layout.addWidget(QLabel("Format:"))
+        f_layout.addWidget(self.intermediate_format)
+        f_layout.addWidget(self.proxy_checkbox)
+        layout.addLayout(f_layout)
 
         layout.addSpacing(20)
 
@@ -78,14 +91,25 @@ class VideoConverterWidget(QWidget):
         self.pbr.set_description("Converting video...")
 
         self.thread = QThread()
-        self.c2a = QtWorkerC2A(file_path, os.path.join(output_folder, os.path.basename(file_path)))
+        intermediate, compression = INTERMEDIATE_FORMATS[self.intermediate_format.currentText()]
+        self.c2a = QtWorkerC2A(
+            file_path, 
+            os.path.join(output_folder, os.path.basename(file_path)), 
+            background=True, 
+            intermediate=intermediate, 
+            compression=compression, 
+            proxy=self.proxy_checkbox.isChecked()
+        )
         self.c2a.moveToThread(self.thread)
         self.c2a.file_ready.connect(self.done_a_file)
         self.thread.started.connect(self.c2a.run)
         self.thread.start()
     
-    def done_a_file(self, _):
+    def done_a_file(self, file_path, ref):
         print(f"Finished file {str(self.current+1).zfill(2)}/{str(len(self.files)).zfill(2)}")
+        # The background computed during the conversion will be found by the main widget.
+        if ref is not None:
+            self.bg_cache.put(self.bg_cache.make_key(file_path, background_params("conversion")), ref)
         self.pbr.close()
         self.thread.quit()
         self.thread.wait()
@@ -101,4 +125,6 @@ class VideoConverterWidget(QWidget):
     def set_active_ui(self, active):
         self.btn_select_folder.setEnabled(active)
         self.extension_field.setEnabled(active)
+        self.intermediate_format.setEnabled(active)
+        self.proxy_checkbox.setEnabled(active)
         self.btn_start_conversion.setEnabled(active)
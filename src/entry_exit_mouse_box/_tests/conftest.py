@@ -0,0 +1,38 @@
+import cv2
+import pytest
+
+from entry_exit_mouse_box import frame_index
+from entry_exit_mouse_box.raw_video import RawVideoWriter
+
+
+@pytest.fixture(autouse=True)
+def index_dir(tmp_path, monkeypatch):
+    # The frame indexes of the test videos are kept out of the user's cache.
+    monkeypatch.setattr(frame_index, "INDEX_DIR", str(tmp_path / "indexes"))
+    return tmp_path / "indexes"
+
+
+@pytest.fixture
+def tmp_video(tmp_path):
+    """
+    Factory writing a synthetic video in 'tmp_path' and returning its path.
+
+    The factory takes the frames (uint8, BGR or single channel) and optionally:
+        name  : File name, a '.gray' extension writes a raw video (extra keyword arguments go to 'RawVideoWriter').
+        fourcc: Codec of the OpenCV videos (single channel frames are written with 'isColor=False').
+        fps   : Frame rate.
+    """
+    def write(frames, name="video.avi", fourcc="MJPG", fps=10, **kwargs):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        frames = list(frames)
+        h, w = frames[0].shape[:2]
+        if path.suffix == ".gray":
+            writer = RawVideoWriter(str(path), fps, (w, h), **kwargs)
+        else:
+            writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*fourcc), fps, (w, h), isColor=(frames[0].ndim == 3))
+        for frame in frames:
+            writer.write(frame)
+        writer.release()
+        return str(path)
+    return write
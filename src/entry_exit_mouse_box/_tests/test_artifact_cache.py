@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pytest
+
+from entry_exit_mouse_box.artifact_cache import ArtifactCache, fingerprint_file
+
+
+# tmp_path is a pytest fixture
+def test_fingerprint_file(tmp_path):
+    path = tmp_path / "data.bin"
+    content = np.random.default_rng(0).integers(0, 256, 5 * 1024**2, dtype=np.uint8)
+    path.write_bytes(content.tobytes())
+    fingerprint = fingerprint_file(str(path))
+    assert fingerprint == fingerprint_file(str(path))
+
+    # Same content written again: same fingerprint.
+    path.write_bytes(content.tobytes())
+    assert fingerprint == fingerprint_file(str(path))
+
+    # Change in a sampled chunk (the first one starts at 0).
+    content[0] ^= 1
+    path.write_bytes(content.tobytes())
+    assert fingerprint != fingerprint_file(str(path))
+
+
+def test_cache_lru_eviction(tmp_path):
+    source = tmp_path / "video.avi"
+    source.write_bytes(b"some video")
+    array = np.zeros((100, 100), np.uint8)
+    cache = ArtifactCache(str(tmp_path / "cache"), max_bytes=2 * array.nbytes + 500)
+
+    keys = [cache.make_key(str(source), {'mode': m}) for m in ("a", "b", "c")]
+    assert len(set(keys)) == 3
+    assert cache.get(keys[0]) is None
+
+    cache.put(keys[0], array)
+    cache.put(keys[1], array + 1)
+    os.utime(cache.entry_path(keys[0]), (0, 0))
+    os.utime(cache.entry_path(keys[1]), (1, 1))
+    # Reading the first entry makes it the most recent one.
+    np.testing.assert_array_equal(cache.get(keys[0]), array)
+    cache.put(keys[2], array + 2)
+
+    assert cache.get(keys[1]) is None
+    np.testing.assert_array_equal(cache.get(keys[0]), array)
+    np.testing.assert_array_equal(cache.get(keys[2]), array + 2)
+
+
+def test_cache_directory_created_lazily(tmp_path):
+    source = tmp_path / "video.avi"
+    source.write_bytes(b"some video")
+    cache = ArtifactCache(str(tmp_path / "cache"))
+    assert not os.path.exists(cache.root)
+    key = cache.make_key(str(source), {})
+    assert cache.get(key) is None
+    cache.clear()
+    assert not os.path.exists(cache.root)
+    cache.put(key, np.ones(3))
+    np.testing.assert_array_equal(cache.get(key), np.ones(3))
+
+
+def test_cache_disabled_if_directory_fails(tmp_path):
+    source = tmp_path / "video.avi"
+    source.write_bytes(b"some video")
+    # A file is in the way of the directory.
+    blocker = tmp_path / "blocker"
+    blocker.write_bytes(b"")
+    cache = ArtifactCache(str(blocker / "cache"))
+    key = cache.make_key(str(source), {})
+    with pytest.warns(UserWarning, match="caching is disabled"):
+        cache.put(key, np.ones(3))
+    assert not cache.enabled
+    assert cache.get(key) is None
+    cache.put(key, np.ones(3)) # No other warning.
@@ -0,0 +1,152 @@
+from fractions import Fraction
+import cv2
+import numpy as np
+import pytest
+
+from entry_exit_mouse_box import frame_index
+from entry_exit_mouse_box.frame_index import FrameIndex, build_frame_index, get_frame_index, load_frame_index, save_frame_index
+from entry_exit_mouse_box.frame_source import open_reader
+from entry_exit_mouse_box.mask_from_video import MaskFromBackground
+from entry_exit_mouse_box.mask_store import MaskStore
+from entry_exit_mouse_box.measures import MiceVisibilityProcessor
+
+from entry_exit_mouse_box._tests.test_mask_from_video import make_frames
+
+
+def test_frame_index_lookups():
+    index = FrameIndex(10, [0, 4, 8], [0, 10, 20, 30, 40, 55, 60, 70, 80, 90], (1, 100))
+    assert [index.keyframe_before(i) for i in (0, 3, 4, 7, 9)] == [0, 0, 4, 4, 8]
+    assert index.frame_at(54) == 4 and index.frame_at(55) == 5 and index.frame_at(1000) == 9
+    assert index.seconds(5) == pytest.approx(0.55)
+    assert not index.is_regular()
+    assert FrameIndex(5, "all").keyframe_before(3) == 3
+    assert FrameIndex(5).is_regular() and not FrameIndex(5).has_keyframes()
+
+
+def test_index_roundtrip(tmp_path, index_dir):
+    (tmp_path / "videos").mkdir()
+    path = tmp_path / "videos" / "video.avi"
+    path.write_bytes(b"\1" * 1000)
+    assert load_frame_index(str(path)) is None
+    save_frame_index(str(path), FrameIndex(3, [0, 2], [0, 1, 3], (1, 30)))
+    index = load_frame_index(str(path))
+    assert index.n_frames == 3 and index.keyframes.tolist() == [0, 2] and index.pts.tolist() == [0, 1, 3]
+    # Nothing is written next to the video.
+    assert [p.name for p in (tmp_path / "videos").iterdir()] == ["video.avi"]
+    assert len(list(index_dir.iterdir())) == 1
+    # The index of another content is ignored.
+    path.write_bytes(b"\2" * 1000)
+    assert load_frame_index(str(path)) is None
+
+
+def test_index_loaded_once(tmp_path, index_dir):
+    path = tmp_path / "video.avi"
+    path.write_bytes(b"\1" * 1000)
+    save_frame_index(str(path), FrameIndex(3, "all"))
+    index = get_frame_index(str(path))
+    assert index.intra and get_frame_index(str(path)) is index
+    # Same content at another path: the index file is shared but the memory is by path.
+    other = tmp_path / "copy.avi"
+    other.write_bytes(b"\1" * 1000)
+    assert get_frame_index(str(other)).n_frames == 3
+    # A modified video is fingerprinted again, its former index is not used.
+    path.write_bytes(b"\3" * 1000)
+    assert get_frame_index(str(path)) is None
+
+
+def test_readers_only_index_on_demand(tmp_path, tmp_video, index_dir, monkeypatch, capsys):
+    path = tmp_video(np.full((24, 32, 3), 10 * i, np.uint8) for i in range(6))
+    reader = open_reader(path)
+    assert reader.get(cv2.CAP_PROP_FRAME_COUNT) == 6
+    reader.release()
+    assert get_frame_index(path) is None and not index_dir.exists()
+
+    pytest.importorskip("av")
+    monkeypatch.setattr(frame_index, "AUTO_INDEX", True)
+    reader = open_reader(path)
+    reader.release()
+    assert get_frame_index(path).n_frames == 6 and len(list(index_dir.iterdir())) == 1
+    # A file that can't be demuxed is not indexed.
+    damaged = tmp_path / "damaged.avi"
+    damaged.write_bytes(b"\0" * 1000)
+    assert get_frame_index(str(damaged)) is None
+    assert "couldn't be built" in capsys.readouterr().out
+
+
+def make_vfr_video(path, n_frames=90, shape=(48, 128)):
+    """
+    MPEG-4 video with irregular timestamps and a group of pictures of 12 frames. The i first columns of the frame i are white.
+    """
+    av = pytest.importorskip("av")
+    timestamps = np.cumsum(np.where(np.arange(n_frames) % 7 == 0, 3, 1)) - 1
+    with av.open(path, "w") as container:
+        stream = container.add_stream("mpeg4", rate=30)
+        stream.width, stream.height = shape[1], shape[0]
+        stream.pix_fmt = "yuv420p"
+        stream.time_base = Fraction(1, 30)
+        stream.codec_context.gop_size = 12
+        stream.codec_context.qmax = 2
+        for i, timestamp in enumerate(timestamps):
+            image = np.zeros(shape + (3,), np.uint8)
+            image[:, :i] = 255
+            frame = av.VideoFrame.from_ndarray(image, format="rgb24")
+            frame.pts = int(timestamp)
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    return path
+
+
+@pytest.mark.parametrize("backend", ["opencv", "pyav"])
+def test_exact_seek_in_vfr_video(tmp_path, backend):
+    path = make_vfr_video(str(tmp_path / "vfr.mp4"))
+    index = build_frame_index(path)
+    assert index.n_frames == 90 and not index.is_regular()
+    assert index.keyframes.tolist() == list(range(0, 90, 12))
+
+    reader = open_reader(path, backend, gray=True)
+    assert reader.get(cv2.CAP_PROP_FRAME_COUNT) == 90
+    for i in (50, 3, 89, 13, 14, 0, 61):
+        reader.set(cv2.CAP_PROP_POS_FRAMES, i)
+        ret, frame = reader.read()
+        assert ret
+        assert np.count_nonzero(frame[frame.shape[0] // 2] > 128) == i
+    reader.release()
+
+
+# tmp_video is a pytest fixture (see conftest.py)
+@pytest.mark.parametrize("backend", ["opencv", "pyav"])
+def test_indexed_count_overrides_the_metadata(tmp_path, tmp_video, backend):
+    if backend == "pyav":
+        pytest.importorskip("av")
+    reference, frames = make_frames(n_frames=20)
+    path = tmp_video(frames)
+    # A truncated file: the header still announces 20 frames.
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) // 2)
+    video = cv2.VideoCapture(path)
+    assert video.get(cv2.CAP_PROP_FRAME_COUNT) == 20
+    video.release()
+    n_frames = build_frame_index(path).n_frames
+    assert 0 < n_frames < 20
+
+    reader = open_reader(path, backend, gray=True)
+    assert reader.get(cv2.CAP_PROP_FRAME_COUNT) == n_frames
+    n_read = 0
+    while reader.read()[0]:
+        n_read += 1
+    assert n_read == n_frames
+    reader.release()
+
+    regions = np.ones(reference.shape, np.uint8)
+    mask_path = str(tmp_path / "mask.bin")
+    mfb = MaskFromBackground(path, mask_path, reference, 40, {1: 0}, regions, frame_count=4, method="opencv")
+    assert mfb.ttl_frames == n_frames
+    mfb.start_processing(num_workers=2)
+    mfb.release_resources()
+    assert MaskStore(mask_path).n_frames == n_frames
+    mvp = MiceVisibilityProcessor(mask_path, regions, 5, {1: 0}, n_frames)
+    assert mvp.n_frames == n_frames
+    mvp.start_processing(2)
+    assert mvp.instant_visibility.shape == (1, n_frames)
@@ -0,0 +1,173 @@
+import importlib.util
+import cv2
+import numpy as np
+import pytest
+
+from entry_exit_mouse_box import frame_source
+from entry_exit_mouse_box.frame_source import OpenCVReader, luma_range, open_reader, open_writer, to_gray
+
+
+def rolled_frames(n_frames=10, shape=(40, 50)):
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 256, shape + (3,), dtype=np.uint8), (9, 9), 3)
+    return [np.roll(base, i, axis=1) for i in range(n_frames)]
+
+
+def test_to_gray():
+    frame = np.random.default_rng(0).integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    gray = to_gray(frame)
+    np.testing.assert_array_equal(gray, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    assert to_gray(gray) is gray
+    dst = np.empty_like(gray)
+    assert to_gray(gray, dst) is dst
+    np.testing.assert_array_equal(dst, gray)
+
+
+# tmp_path and tmp_video are pytest fixtures (see conftest.py)
+@pytest.mark.parametrize("fourcc", ["MJPG", "FFV1"])
+def test_luma_capture_matches_bgr_decode(tmp_video, fourcc):
+    path = tmp_video(rolled_frames(), fourcc=fourcc)
+    reference = OpenCVReader(path, gray=True, luma_plane=False)
+    luma = OpenCVReader(path, gray=True)
+    # The Y plane can't be used with FFV1, the BGR decode is used instead.
+    assert luma.luma_plane == (fourcc == "MJPG")
+
+    for _ in range(10):
+        ret_r, frame_r = reference.read()
+        ret_l, frame_l = luma.read()
+        assert ret_r and ret_l
+        assert frame_l.shape == frame_r.shape == (40, 50)
+        # The JPEG luma is computed with the same weights as cv2.COLOR_BGR2GRAY.
+        assert np.abs(frame_l.astype(int) - frame_r).max() <= 1
+    assert not luma.read()[0]
+
+    luma.set(cv2.CAP_PROP_POS_FRAMES, 3)
+    reference.set(cv2.CAP_PROP_POS_FRAMES, 3)
+    assert np.abs(luma.read()[1].astype(int) - reference.read()[1]).max() <= 1
+    luma.release()
+    reference.release()
+
+
+def test_limited_range_luma_is_expanded(tmp_video, capfd):
+    # MPEG-4 part 2 streams are limited range (Y in 16-235), MJPEG streams are full range.
+    gradient = np.tile(np.linspace(0, 255, 64).astype(np.uint8), (48, 1))
+    path = tmp_video((cv2.cvtColor(np.roll(gradient, 3 * i, axis=1), cv2.COLOR_GRAY2BGR) for i in range(10)), fourcc='XVID')
+
+    reference = OpenCVReader(path, gray=True, luma_plane=False)
+    luma = OpenCVReader(path, gray=True)
+    assert luma.luma_plane and (luma.luma_lut is not None)
+    raw = cv2.VideoCapture(path)
+    raw.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    for _ in range(10):
+        frame_r = reference.read()[1].astype(int)
+        frame_l = luma.read()[1].astype(int)
+        # Same values as cv2.COLOR_BGR2GRAY, up to the rounding of the BGR decode (about 1.5 levels below).
+        assert np.abs(frame_l - frame_r).mean() <= 2
+        assert np.abs(frame_l - frame_r).max() <= 4
+        # The raw Y plane would be off by up to 16 levels.
+        assert np.abs(raw.read()[1].astype(int) - frame_r).max() > 10
+    raw.release()
+    luma.release()
+    reference.release()
+    # The "unsupported picture format" warning of OpenCV isn't printed at each frame.
+    assert "treated as 8UC1" not in capfd.readouterr().err
+
+
+def test_luma_range():
+    gray = np.tile(np.arange(0, 256, 4, dtype=np.uint8), (8, 1))
+    assert luma_range(gray, gray) == "full"
+    limited = np.rint(16 + gray.astype(float) * 219 / 255).astype(np.uint8)
+    assert luma_range(limited, gray) == "limited"
+    # A uniform frame can't tell, another frame doesn't match.
+    assert luma_range(np.full((8, 64), 128, np.uint8), np.full((8, 64), 128, np.uint8)) is None
+    assert luma_range(gray[:, ::-1], gray) is None
+
+
+def available_backends():
+    backends = ["opencv"]
+    if importlib.util.find_spec("av") is not None:
+        backends.append("pyav")
+    if frame_source.FFMPEG is not None:
+        backends.append("ffmpeg")
+    return backends
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_backends_decode_the_same_frames(tmp_path, backend):
+    path = str(tmp_path / f"video-{backend}.avi")
+    writer = open_writer(path, 'MJPG', 10, (50, 40), backend=backend)
+    frames = np.random.default_rng(0).integers(0, 256, (12, 40, 50, 3), dtype=np.uint8)
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+
+    expected = []
+    video = cv2.VideoCapture(path)
+    while True:
+        ret, frame = video.read()
+        if not ret:
+            break
+        expected.append(frame)
+    video.release()
+    assert len(expected) == 12
+
+    reader = open_reader(path, backend, threads=2)
+    assert int(reader.get(cv2.CAP_PROP_FRAME_COUNT)) == 12
+    for frame in expected:
+        np.testing.assert_array_equal(reader.read()[1], frame)
+    assert not reader.read()[0]
+
+    for index in (7, 2, 11):
+        reader.set(cv2.CAP_PROP_POS_FRAMES, index)
+        np.testing.assert_array_equal(reader.read()[1], expected[index])
+        assert int(reader.get(cv2.CAP_PROP_POS_FRAMES)) == index + 1
+    reader.release()
+
+
+def test_passthrough_args(monkeypatch):
+    monkeypatch.setattr(frame_source, "ffmpeg_version", lambda: (4, 4))
+    assert frame_source.passthrough_args() == ["-vsync", "passthrough"]
+    monkeypatch.setattr(frame_source, "ffmpeg_version", lambda: (5, 1))
+    assert frame_source.passthrough_args() == ["-fps_mode", "passthrough"]
+    monkeypatch.setattr(frame_source, "ffmpeg_version", lambda: None)
+    assert frame_source.passthrough_args() == ["-fps_mode", "passthrough"]
+
+
+@pytest.mark.skipif(frame_source.FFMPEG is None, reason="ffmpeg is not installed")
+def test_ffmpeg_reader_reports_errors(tmp_video, capsys):
+    path = tmp_video(rolled_frames())
+    reader = frame_source.FFmpegReader(path, gray=True)
+    assert reader.read()[0] and reader.error is None
+    # The file is damaged before the next seek restarts ffmpeg.
+    with open(path, "wb") as f:
+        f.write(b"\0" * 1024)
+    reader.set(cv2.CAP_PROP_POS_FRAMES, 2)
+    assert not reader.read()[0]
+    assert not reader.read()[0]
+    assert "return code" in reader.error
+    assert capsys.readouterr().out.count("ERROR: ffmpeg stopped at frame 2/10") == 1
+    reader.release()
+
+
+@pytest.mark.skipif(frame_source.FFMPEG is None, reason="ffmpeg is not installed")
+def test_ffmpeg_writer_reports_errors(tmp_path):
+    writer = frame_source.FFmpegWriter(str(tmp_path / "missing" / "video.avi"), 'MJPG', 10, (50, 40))
+    with pytest.raises(IOError, match="return code") as error:
+        for frame in rolled_frames():
+            writer.write(frame)
+        writer.release()
+    # The end of the error output of ffmpeg is in the message.
+    assert "missing" in str(error.value).split("return code")[1]
+    assert not writer.isOpened()
+
+
+def test_benchmark_reports_the_backend_used(tmp_video, monkeypatch):
+    from entry_exit_mouse_box import benchmark_backends
+    path = tmp_video(rolled_frames())
+    def unavailable(*args):
+        raise IOError("not available")
+    monkeypatch.setitem(frame_source.READERS, "ffmpeg", unavailable)
+    result = benchmark_backends.benchmark_reader(path, "ffmpeg", n_seeks=2)
+    assert result['requested'] == "ffmpeg" and result['backend'] == "opencv"
+    result = benchmark_backends.benchmark_reader(path, "opencv", n_seeks=2)
+    assert result['requested'] == result['backend'] == "opencv"
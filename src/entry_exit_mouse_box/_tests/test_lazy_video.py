@@ -0,0 +1,121 @@
+import logging
+import numpy as np
+import pytest
+from napari.components import ViewerModel
+
+from entry_exit_mouse_box.lazy_video import VideoArray
+from entry_exit_mouse_box.media_manager import MediaManager, FrameCache, open_capture
+
+
+def ramp(n_frames):
+    """Raw video frames whose value is their index."""
+    return (np.full((8, 16), i, np.uint8) for i in range(n_frames))
+
+
+# tmp_video is a pytest fixture (see conftest.py)
+def test_video_array_reads_by_chunks(tmp_video):
+    path = tmp_video(ramp(20), "video.gray")
+
+    calls = []
+    def process(frame):
+        calls.append(int(frame[0, 0]))
+        return frame.copy()
+
+    array = VideoArray(open_capture(path), "media", FrameCache(), process, chunk_frames=8)
+    assert array.shape == (20, 8, 16) and array.ndim == 3 and array.dtype == np.uint8
+    assert calls == list(range(8))
+    assert int(array[10][0, 0]) == 10
+    assert calls == list(range(16))
+    assert array[-1, 2:4, 0].tolist() == [19, 19]
+    assert array[3:6, 0, 0].tolist() == [3, 4, 5]
+    assert array[..., 0].shape == (20, 8)
+    assert sorted(calls) == list(range(20)) # Each frame was processed once.
+    # The whole video is never decoded at once.
+    with pytest.raises(TypeError):
+        np.asarray(array)
+    array.release()
+
+
+def test_lazy_layers_follow_dims(tmp_video):
+    path = tmp_video(ramp(20), "video.gray")
+
+    mm = MediaManager(ViewerModel(), lazy=True)
+    mm.set_logger(logging.getLogger("test"))
+    mm.add_source(path, "media", "image")
+    layer = mm.viewer.layers["media"]
+    assert layer.data.shape == (20, 8, 16)
+    assert mm.viewer.dims.current_step[0] == 0
+    mm.set_frame(12)
+    assert mm.viewer.dims.current_step[0] == 12
+    assert int(mm.get_frame("media")[0, 0]) == 12
+    # The user moves napari's slider.
+    mm.viewer.dims.set_current_step(0, 5)
+    assert mm.current_frame == 5
+    assert int(mm.get_frame("media")[0, 0]) == 5
+    mm.release()
+
+
+def open_in_widget(qtbot, widget, path):
+    widget.launch_convert(path)
+    qtbot.waitUntil(lambda: widget.mm.get_n_sources() > 0, timeout=30000)
+
+
+# qtbot is a pytest-qt fixture. The widget runs on a ViewerModel: the layers and the dims are the ones of a napari viewer, without the OpenGL canvas.
+def test_widget_lazy_layers_toggle(tmp_video, qtbot):
+    from entry_exit_mouse_box._widget import MouseInOutWidget, MEDIA_LAYER
+    path = tmp_video(np.full((24, 32, 3), 10 * i, np.uint8) for i in range(15))
+
+    widget = MouseInOutWidget(ViewerModel())
+    qtbot.addWidget(widget)
+    widget.lazy_checkbox.setChecked(True)
+    open_in_widget(qtbot, widget, path)
+    layer = widget.viewer.layers[MEDIA_LAYER]
+    assert widget.mm.lazy and layer.data.shape == (15, 24, 32)
+    widget.set_frame(9)
+    assert widget.viewer.dims.current_step[0] == 9
+    # napari's slider drives the widget.
+    widget.viewer.dims.set_current_step(0, 4)
+    assert widget.slider.value() == 5 and widget.mm.current_frame == 4
+    assert abs(int(widget.mm.get_frame(MEDIA_LAYER)[0, 0]) - 40) <= 2
+
+    # The next video is displayed in a 2D layer.
+    widget.clear_state()
+    widget.lazy_checkbox.setChecked(False)
+    open_in_widget(qtbot, widget, path)
+    assert (not widget.mm.lazy) and widget.viewer.layers[MEDIA_LAYER].data.shape == (24, 32)
+    widget.set_frame(9)
+    assert abs(int(widget.mm.get_frame(MEDIA_LAYER)[0, 0]) - 90) <= 2
+    widget.clear_state()
+
+
+def test_widget_playback(tmp_video, qtbot):
+    from entry_exit_mouse_box._widget import MouseInOutWidget
+    path = tmp_video((np.full((24, 32, 3), 8 * i, np.uint8) for i in range(30)), fps=30)
+    widget = MouseInOutWidget(ViewerModel())
+    qtbot.addWidget(widget)
+    open_in_widget(qtbot, widget, path)
+    assert widget.mm.current_frame == 0
+
+    widget.play_button.click()
+    assert widget.play_timer.isActive()
+    qtbot.wait(200)
+    playing = widget.mm.current_frame
+    assert playing > 0
+    qtbot.waitUntil(lambda: widget.mm.current_frame > playing, timeout=2000)
+
+    # Pause: the frame doesn't move anymore.
+    widget.play_button.click()
+    assert not widget.play_timer.isActive()
+    paused = widget.mm.current_frame
+    qtbot.wait(200)
+    assert widget.mm.current_frame == paused and widget.slider.value() == paused + 1
+
+    # Play again: it goes on from there and stops by itself on the last frame.
+    widget.play_button.click()
+    qtbot.waitUntil(lambda: not widget.play_timer.isActive(), timeout=5000)
+    assert widget.mm.current_frame == 29 and widget.slider.value() == 30
+    # From the last frame, the playback starts over.
+    widget.play_button.click()
+    assert widget.play_timer.isActive() and widget.mm.current_frame < paused
+    widget.play_button.click()
+    widget.clear_state()
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from entry_exit_mouse_box.mask_from_video import MaskFromBackground
+from entry_exit_mouse_box.mask_and_measures import MaskAndMeasures
+from entry_exit_mouse_box.mask_store import MaskStore
+from entry_exit_mouse_box.measures import MiceVisibilityProcessor
+
+from entry_exit_mouse_box._tests.test_mask_from_video import make_frames
+
+
+def make_regions(shape):
+    regions = np.zeros(shape, np.uint8)
+    regions[0:30, 0:40]  = 1
+    regions[8:48, 35:64]  = 2 # Crossed by the dark blob.
+    return regions
+
+
+def two_pass(video_path, mask_path, reference, regions, start, duration, roi):
+    mfb = MaskFromBackground(video_path, mask_path, reference, 40, start, regions, frame_count=8, roi=roi, method="opencv")
+    mfb.start_processing(num_workers=4)
+    mfb.release_resources()
+    mvp = MiceVisibilityProcessor(mask_path, regions, 5, start, duration, roi=roi)
+    mvp.start_processing(2)
+    return mvp
+
+
+def assert_same_measures(fused, separate):
+    np.testing.assert_array_equal(fused.instant_visibility, separate.instant_visibility)
+    np.testing.assert_array_equal(fused.instant_centroids, separate.instant_centroids)
+    assert fused.all_sessions == separate.all_sessions
+    for box, runs in separate.visibility_runs.items():
+        for a, b in zip(fused.visibility_runs[box], runs):
+            np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize("roi", [False, True])
+def test_fused_pass_matches_two_passes(tmp_path, tmp_video, roi):
+    n_frames  = 40
+    duration  = 30 # The tracks end before the video, so that their sessions are closed.
+    reference, frames = make_frames(n_frames=n_frames)
+    video_path = tmp_video(frames)
+    regions   = make_regions(reference.shape)
+    start     = {1: 0, 2: 5}
+
+    separate = two_pass(video_path, str(tmp_path / "mask.bin"), reference, regions, start, duration, roi=False)
+    assert (separate.instant_visibility == 1).any(axis=1).all() and len(separate.all_sessions) == 2
+
+    mask_path = str(tmp_path / "fused.bin")
+    mam = MaskAndMeasures(video_path, reference, 40, start, regions, 5, duration, mask_path, frame_count=8, roi=roi, method="opencv")
+    mam.start_processing(num_workers=4)
+    mam.release_resources()
+    assert_same_measures(mam.measures, separate)
+    # The masks written along the way are the same as the ones of the first pass.
+    np.testing.assert_array_equal(MaskStore(mask_path).read(0, n_frames), MaskStore(str(tmp_path / "mask.bin")).read(0, n_frames))
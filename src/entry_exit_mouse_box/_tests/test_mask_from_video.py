@@ -0,0 +1,128 @@
+import cv2
+import numpy as np
+import pytest
+
+from entry_exit_mouse_box.mask_from_video import MaskFromBackground, MEMORY_BUDGET
+from entry_exit_mouse_box.mask_store import MaskStore
+
+
+def make_frames(n_frames=12, shape=(48, 64)):
+    """Noisy BGR frames with bright and dark blobs, some of them touching the borders, and their background."""
+    rng = np.random.default_rng(0)
+    background = rng.integers(60, 200, shape, dtype=np.uint8)
+    frames = []
+    for i in range(n_frames):
+        frame = background.copy()
+        frame[rng.random(shape) < 0.05] = 0
+        frame[(i * 3) % shape[0]:(i * 3) % shape[0] + 6, 0:9] = 255
+        frame[10:16, (i * 5) % shape[1]:(i * 5) % shape[1] + 7] = 10
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    return background, frames
+
+
+# tmp_path and tmp_video are pytest fixtures (see conftest.py)
+@pytest.mark.parametrize("roi", [False, True])
+def test_opencv_path_matches_skimage_path(tmp_path, tmp_video, roi):
+    reference, frames = make_frames()
+    video_path = tmp_video(frames)
+    regions = np.zeros(reference.shape, np.uint8)
+    regions[0:30, 0:40] = 1
+    regions[20:48, 35:64] = 2
+    start = {1: 0, 2: 5}
+
+    masks = []
+    for method in ("skimage", "opencv"):
+        out_path = str(tmp_path / f"mask-{method}.bin")
+        mfb = MaskFromBackground(video_path, out_path, reference, 40, start, regions, roi=roi, method=method)
+        mfb.start_processing(num_workers=4)
+        mfb.release_resources()
+        store = MaskStore(out_path)
+        masks.append(store.read(0, store.n_frames))
+
+    assert masks[0].any()
+    np.testing.assert_array_equal(masks[0], masks[1])
+
+
+def test_opencv_detection_matches_skimage_detection(tmp_video):
+    reference, frames = make_frames(n_frames=1)
+    video_path = tmp_video(frames)
+    rng = np.random.default_rng(1)
+    mfb_sk = MaskFromBackground(video_path, None, reference, 30, method="skimage")
+    mfb_cv = MaskFromBackground(video_path, None, reference, 30, method="opencv")
+
+    for _ in range(20):
+        frame = rng.integers(0, 256, reference.shape + (3,), dtype=np.uint8)
+        expected = mfb_sk.detect_mice(frame)
+        np.testing.assert_array_equal(expected, mfb_cv.detect_mice(frame) > 0)
+        expected = mfb_sk.detect_mice(frame, 5, 30, 0, 20)
+        np.testing.assert_array_equal(expected, mfb_cv.detect_mice(frame, 5, 30, 0, 20) > 0)
+
+    mfb_sk.release_resources()
+    mfb_cv.release_resources()
+
+
+@pytest.mark.parametrize("max_in_flight", [1, 2])
+def test_bounded_in_flight_batches(tmp_path, tmp_video, max_in_flight):
+    reference, frames = make_frames(n_frames=20)
+    video_path = tmp_video(frames)
+    regions = np.ones(reference.shape, np.uint8)
+
+    masks = []
+    for bound in (None, max_in_flight):
+        out_path = str(tmp_path / f"mask-{bound}.bin")
+        mfb = MaskFromBackground(video_path, out_path, reference, 40, {1: 0}, regions, frame_count=3, method="opencv", max_in_flight=bound)
+        mfb.start_processing(num_workers=4)
+        mfb.release_resources()
+        assert mfb.expected_index == mfb.total
+        masks.append(MaskStore(out_path).read(0, 20))
+
+    assert mfb.peak_buffered <= max_in_flight
+    assert masks[0].any()
+    np.testing.assert_array_equal(masks[0], masks[1])
+
+
+def test_memory_budget_counts_luma_frames(tmp_video):
+    reference, frames = make_frames(n_frames=10)
+    video_path = tmp_video(frames)
+    # A batch holds 4 single channel frames and 4 boolean masks.
+    batch_bytes = 4 * reference.size * 2
+    mfb = MaskFromBackground(video_path, None, reference, 40, frame_count=4, method="opencv", memory_budget=3 * batch_bytes)
+    assert mfb.max_in_flight == 3
+    # The first frame, read to measure the frames, is still processed.
+    batch, frames = mfb.read_frames()
+    assert batch == (0, 4) and len(frames) == 4 and frames[0].shape == reference.shape
+    mfb.release_resources()
+
+
+# qtbot is a pytest-qt fixture.
+def test_widget_memory_budget(qtbot):
+    from napari.components import ViewerModel
+    from entry_exit_mouse_box._widget import MouseInOutWidget
+    widget = MouseInOutWidget(ViewerModel())
+    qtbot.addWidget(widget)
+    assert widget.get_memory_budget() == MEMORY_BUDGET
+    widget.memory_budget.setValue(256)
+    assert widget.get_memory_budget() == 256 * 1024**2
+
+
+def test_visual_export(tmp_path, tmp_video):
+    reference, frames = make_frames(n_frames=20)
+    video_path = tmp_video(frames)
+    regions = np.ones(reference.shape, np.uint8)
+    out_path, export_path = str(tmp_path / "mask.bin"), str(tmp_path / "mask-export.avi")
+    mfb = MaskFromBackground(video_path, out_path, reference, 40, {1: 0}, regions, frame_count=3, export_path=export_path, method="opencv")
+    mfb.start_processing(num_workers=4)
+    mfb.release_resources()
+
+    masks = MaskStore(out_path).read(0, 20)
+    exported = []
+    video = cv2.VideoCapture(export_path)
+    while True:
+        ret, frame = video.read()
+        if not ret:
+            break
+        exported.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) > 127)
+    video.release()
+    # The batches are exported in order, the compression only blurs the edges of the masks.
+    assert len(exported) == 20
+    assert (np.array(exported) != masks).mean() < 0.02
@@ -0,0 +1,63 @@
+import os
+import cv2
+import numpy as np
+import tifffile
+
+from entry_exit_mouse_box.mask_store import MaskStore, MaskCapture, is_mask_store, import_legacy_mask, HEADER_SIZE
+
+
+def test_mask_store_round_trip(tmp_path):
+    path = str(tmp_path / "mask.bin")
+    rng = np.random.default_rng(0)
+    masks = rng.random((5, 7, 13)) > 0.5 # The rows are padded to 2 bytes.
+    store = MaskStore(path, 'w', 6, (7, 13), 29.97)
+    store.write(0, masks[:3])
+    store.write(3, masks[3])
+    store.write(4, np.concatenate([masks[4:], masks[4:]])) # The second frame of the batch is the last one of the store.
+    store.write(6, masks[:2]) # Beyond the end: ignored.
+    store.release()
+
+    assert os.path.getsize(path) == HEADER_SIZE + 6 * 7 * 2
+    assert is_mask_store(path) and not is_mask_store(str(tmp_path / "missing.bin"))
+    store = MaskStore(path)
+    assert (store.n_frames, store.shape, store.fps) == (6, (7, 13), 29.97)
+    np.testing.assert_array_equal(store.read(0, 5), masks)
+    np.testing.assert_array_equal(store.read(5), masks[4])
+    assert store.read(4, 10).shape == (2, 7, 13) # Partial read at the end.
+    store.release()
+
+    # Frames that were never written are empty.
+    store = MaskStore(path, 'w', 3, (7, 13), 10)
+    store.write(1, masks[0])
+    store.release()
+    store = MaskStore(path, 'r+')
+    assert not store.read(0).any() and not store.read(2).any()
+    store.write(2, masks[1])
+    store.release()
+    np.testing.assert_array_equal(MaskStore(path).read(2), masks[1])
+
+    capture = MaskCapture(path)
+    assert capture.get(cv2.CAP_PROP_FRAME_WIDTH) == 13
+    capture.set(cv2.CAP_PROP_POS_FRAMES, 1)
+    ret, frame = capture.read()
+    assert ret and frame.dtype == np.uint8
+    np.testing.assert_array_equal(frame, masks[0] * 255)
+    capture.release()
+
+
+def test_import_legacy_mask(tmp_path, tmp_video):
+    masks = np.zeros((4, 32, 48), bool)
+    for i in range(4):
+        masks[i, 8:24, 8*i:8*i+16] = True
+    tif_path = str(tmp_path / "mask.tif")
+    tifffile.imwrite(tif_path, masks.astype(np.uint8) * 255)
+    # The masks are written by batches, the last one is incomplete.
+    store_path = import_legacy_mask(tif_path, batch_size=3)
+    assert store_path == str(tmp_path / "mask.bin")
+    np.testing.assert_array_equal(MaskStore(store_path).read(0, 4), masks)
+
+    avi_path = tmp_video(masks.astype(np.uint8) * 255, "legacy.avi", fps=25)
+    store = MaskStore(import_legacy_mask(avi_path))
+    assert store.n_frames == 4 and store.fps == 25
+    # The compression only blurs the edges of the masks.
+    assert (store.read(0, 4) != masks).mean() < 0.01
@@ -0,0 +1,229 @@
+import numpy as np
+from skimage.measure import regionprops
+
+from entry_exit_mouse_box.measures import labels_centroids, MiceVisibilityProcessor, run_length_encode
+from entry_exit_mouse_box.utils import label_rois
+
+
+def regionprops_centroids(masks, labels, n_labels):
+    # Reference: the per-frame 'regionprops' loop that 'labels_centroids' replaced.
+    visibility = np.zeros((len(masks), n_labels), bool)
+    centroids  = np.full((len(masks), n_labels, 2), -1.0)
+    for i, mask in enumerate(masks):
+        for p in regionprops((mask * labels).astype(np.uint8)):
+            visibility[i, p.label-1] = True
+            centroids[i, p.label-1]  = p.centroid
+    return visibility, centroids
+
+
+def make_labels():
+    labels = np.zeros((40, 60), np.uint8)
+    labels[2:18, 3:25]  = 1
+    labels[20:38, 5:30] = 2
+    labels[5:35, 35:58] = 3
+    return labels
+
+
+def test_labels_centroids_matches_regionprops():
+    rng    = np.random.default_rng(0)
+    labels = make_labels()
+    masks  = rng.random((12, 40, 60)) > 0.97
+    masks[3] = False # Empty frame.
+    masks[5, labels == 2] = False # One box without foreground.
+    visibility, centroids = labels_centroids(masks, labels, 3)
+    ref_visibility, ref_centroids = regionprops_centroids(masks, labels, 3)
+    np.testing.assert_array_equal(visibility, ref_visibility)
+    np.testing.assert_allclose(centroids, ref_centroids, atol=1e-9)
+    assert not visibility[3].any() and not visibility[5, 1]
+    assert (centroids[3] == -1).all()
+
+
+def test_labels_centroids_without_labels():
+    masks = np.ones((4, 10, 10), bool)
+    # No box at all.
+    visibility, centroids = labels_centroids(masks, np.zeros((10, 10), np.uint8), 0)
+    assert visibility.shape == (4, 0) and centroids.shape == (4, 0, 2)
+    # A box label that is absent from the areas.
+    labels = np.zeros((10, 10), np.uint8)
+    labels[2:4, 2:4] = 1
+    visibility, centroids = labels_centroids(masks[0], labels, 2)
+    assert visibility.tolist() == [[True, False]]
+    assert centroids[0, 0].tolist() == [2.5, 2.5] and centroids[0, 1].tolist() == [-1, -1]
+    # A label above 'n_labels' is ignored.
+    labels[6:8, 6:8] = 3
+    visibility, centroids = labels_centroids(masks[0], labels, 2)
+    assert visibility.tolist() == [[True, False]] and centroids[0, 0].tolist() == [2.5, 2.5]
+
+
+def test_labels_centroids_roi_matches_full_frame():
+    rng    = np.random.default_rng(3)
+    labels = make_labels()
+    labels[0, 0] = 3 # A label in two pieces: its bounding rectangle covers the other labels.
+    masks  = rng.random((12, 40, 60)) > 0.97
+    masks[3] = False
+    for margin in (0, 4):
+        rois = label_rois(labels, margin)
+        visibility, centroids = labels_centroids(masks, labels, 3, rois)
+        ref_visibility, ref_centroids = labels_centroids(masks, labels, 3)
+        np.testing.assert_array_equal(visibility, ref_visibility)
+        np.testing.assert_allclose(centroids, ref_centroids, atol=1e-9)
+    # A single frame, and a ROI of a label that is not counted.
+    visibility, centroids = labels_centroids(masks[0], labels, 2, label_rois(labels))
+    ref_visibility, ref_centroids = labels_centroids(masks[0], labels, 2)
+    np.testing.assert_array_equal(visibility, ref_visibility)
+    np.testing.assert_allclose(centroids, ref_centroids, atol=1e-9)
+
+
+def make_processor(n_frames, n_boxes=1, start=None, duration=None):
+    areas = np.zeros((8, 8), np.uint8)
+    for box in range(n_boxes):
+        areas[box, 0] = box + 1
+    if start is None:
+        start = {box+1: 0 for box in range(n_boxes)}
+    return MiceVisibilityProcessor(None, areas, 10, start, n_frames if duration is None else duration, n_frames=n_frames, fps=25)
+
+
+def loop_session_length(centroids, i1, i2):
+    # Reference: the loop that the prefix sums replaced.
+    if i1 == i2:
+        return 0.0
+    points = centroids[i1:i2]
+    distance = 0.0
+    for i in range(len(points)-1):
+        distance += np.linalg.norm(points[i+1] - points[i])
+    return distance
+
+
+def test_session_length_matches_loop():
+    rng = np.random.default_rng(1)
+    n_frames = 30
+    mvp = make_processor(n_frames)
+    centroids = rng.random((n_frames, 1, 2)) * 100
+    centroids[4:7]   = -1.0   # Frames without mouse.
+    centroids[12:15] = np.nan # A run of undefined centroids.
+    centroids[20]    = np.nan
+    mvp.instant_centroids = centroids
+    mvp.compute_path_lengths()
+    for i1 in range(-2, n_frames + 2):
+        for i2 in range(-2, n_frames + 2):
+            expected = loop_session_length(centroids[:, 0], i1, i2)
+            result   = mvp.get_session_length(0, i1, i2)
+            if np.isnan(expected):
+                assert np.isnan(result), (i1, i2)
+            else:
+                assert abs(result - expected) < 1e-9, (i1, i2)
+
+
+def test_session_length_all_nan():
+    mvp = make_processor(10)
+    mvp.instant_centroids = np.full((10, 1, 2), np.nan)
+    assert np.isnan(mvp.get_session_length(0, 0, 10))
+    assert mvp.get_session_length(0, 3, 4) == 0.0
+
+
+def loop_filter_visibility(mvp):
+    # Reference: the per-frame loop that the run-length encoded version replaced.
+    for box_rank in range(len(mvp.box_ids)):
+        swaps = []
+        first_frame = mvp.starting_frames[box_rank+1] - 1
+        last_frame_idx = min(first_frame + mvp.track_duration, mvp.n_frames)
+        for f in range(mvp.n_frames-1):
+            if f < first_frame:
+                mvp.instant_visibility[box_rank, f] = -1
+                mvp.instant_centroids[f, box_rank] = (-1.0, -1.0)
+                continue
+            if f >= last_frame_idx:
+                mvp.instant_visibility[box_rank, f] = -2
+                mvp.instant_centroids[f, box_rank] = (-1.0, -1.0)
+                continue
+            if (mvp.instant_visibility[box_rank, f] != mvp.instant_visibility[box_rank, f+1]) or (f == last_frame_idx-1):
+                if len(swaps) == 0:
+                    swaps.append(f+1)
+                    continue
+                if (loop_session_length(mvp.instant_centroids[:, box_rank], swaps[-1], f) < mvp.min_trk_length):
+                    swaps.append(f+1)
+                else:
+                    for i in range(swaps[0], swaps[-1]):
+                        mvp.instant_visibility[box_rank, i] = 0
+                        mvp.instant_centroids[i, box_rank] = (-1.0, -1.0)
+                    swaps = [f+1]
+
+
+def loop_sessions(mvp):
+    # Reference: the per-frame loop of 'process_sessions'.
+    all_sessions = {}
+    for box in range(len(mvp.box_ids)):
+        sessions, count, start = [], 0, 0
+        for f in range(mvp.n_frames-1):
+            state = (mvp.instant_visibility[box, f], mvp.instant_visibility[box, f+1])
+            if (state[0] == state[1]):
+                continue
+            if state[0] == -1:
+                start = f+2
+            else:
+                count += 1
+                sessions.append({
+                    'start'    : start,
+                    'end'      : f + 1,
+                    'duration' : f - start + 1,
+                    'distance' : float(loop_session_length(mvp.instant_centroids[:, box], start-1, f+1)),
+                    'status'   : int(state[0])
+                })
+                start = f + 2
+            if state[1] == -2:
+                all_sessions[box] = {'sessions': sessions, 'count': count}
+                break
+    return all_sessions
+
+
+def test_run_length_encode():
+    starts, lengths, states = run_length_encode([0, 0, 1, 1, 1, 0, -2])
+    assert starts.tolist() == [0, 2, 5, 6]
+    assert lengths.tolist() == [2, 3, 1, 1]
+    assert states.tolist() == [0, 1, 0, -2]
+    starts, lengths, states = run_length_encode(np.zeros(0, np.int8))
+    assert len(starts) == len(lengths) == len(states) == 0
+    starts, lengths, states = run_length_encode([1])
+    assert starts.tolist() == [0] and lengths.tolist() == [1] and states.tolist() == [1]
+
+
+def test_filter_visibility_and_sessions_match_loops():
+    rng = np.random.default_rng(2)
+    n_frames, n_boxes = 200, 3
+    for _ in range(20):
+        start    = {box+1: int(rng.integers(0, 60)) for box in range(n_boxes)}
+        duration = int(rng.integers(20, 260)) # Some tracks end after the video.
+        # Runs of random lengths, so that some sessions are long enough and some are not.
+        visibility = np.zeros((n_boxes, n_frames), np.int8)
+        for box in range(n_boxes):
+            runs = np.repeat(rng.integers(0, 2, 100), rng.integers(1, 12, 100))[:n_frames]
+            visibility[box, :len(runs)] = runs
+        centroids = np.where(
+            visibility.T[..., np.newaxis] == 1, 
+            np.cumsum(rng.random((n_frames, n_boxes, 2)) * 4, axis=0), 
+            -1.0
+        )
+        results = []
+        for filter_visibility, sessions in ((loop_filter_visibility, loop_sessions), (None, None)):
+            mvp = make_processor(n_frames, n_boxes, start, duration)
+            mvp.min_trk_length     = 15
+            mvp.instant_visibility = visibility.copy()
+            mvp.instant_centroids  = centroids.copy()
+            if filter_visibility is None:
+                mvp.filter_visibility()
+                mvp.process_sessions()
+                all_sessions = mvp.all_sessions
+            else:
+                filter_visibility(mvp)
+                all_sessions = sessions(mvp)
+            results.append((mvp.instant_visibility, mvp.instant_centroids, all_sessions))
+        (ref_vis, ref_cen, ref_ses), (vis, cen, ses) = results
+        np.testing.assert_array_equal(vis, ref_vis)
+        np.testing.assert_array_equal(cen, ref_cen)
+        assert ses.keys() == ref_ses.keys()
+        for box in ses:
+            assert ses[box]['count'] == ref_ses[box]['count']
+            for a, b in zip(ses[box]['sessions'], ref_ses[box]['sessions']):
+                assert a.keys() == b.keys()
+                assert all(a[k] == b[k] for k in a if k != 'distance')
+                assert abs(a['distance'] - b['distance']) < 1e-9
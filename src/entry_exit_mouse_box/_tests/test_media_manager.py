@@ -0,0 +1,165 @@
+import time
+import threading
+import logging
+import numpy as np
+from napari.components import ViewerModel
+
+from entry_exit_mouse_box.media_manager import MediaManager, FrameCache
+from entry_exit_mouse_box.raw_video import RawVideo
+from entry_exit_mouse_box.convert_format import QtWorkerC2A, get_proxy_path, PROXY_FACTOR
+
+from entry_exit_mouse_box._tests.test_lazy_video import ramp
+
+
+def test_frame_cache_budget():
+    cache = FrameCache(max_bytes=3 * 100)
+    for i in range(4):
+        cache.put(("media", i), np.zeros(100, np.uint8))
+    assert ("media", 0) not in cache
+    cache.get(("media", 1)) # Most recently used, so it's kept.
+    cache.put(("labels", 0), np.zeros(100, np.uint8))
+    assert ("media", 1) in cache and ("media", 2) not in cache
+    assert cache.n_bytes == 300
+    cache.discard("media")
+    assert cache.n_bytes == 100 and ("labels", 0) in cache
+
+
+def test_frame_cache_drops_stale_frames():
+    cache = FrameCache()
+    generation = cache.generation
+    cache.discard("media")
+    # Decoded before the discard, so processed by an outdated state.
+    assert not cache.put(("media", 0), np.zeros(10, np.uint8), generation)
+    assert ("media", 0) not in cache and cache.n_bytes == 0
+    assert cache.put(("media", 0), np.zeros(10, np.uint8), cache.generation)
+
+
+# tmp_path and tmp_video are pytest fixtures (see conftest.py)
+def test_prefetch_processes_each_frame_once(tmp_video):
+    path = tmp_video(ramp(100), "video.gray")
+
+    calls = {}
+    def process(frame):
+        calls[int(frame[0, 0])] = calls.get(int(frame[0, 0]), 0) + 1
+        return frame.copy()
+
+    mm = MediaManager(ViewerModel())
+    mm.set_logger(logging.getLogger("test"))
+    mm.add_source(path, "media", "image", process)
+    for target in [50, 49, 48, 60, 49]:
+        mm.set_frame(target)
+        assert int(mm.viewer.layers["media"].data[0, 0]) == target
+        time.sleep(0.05)
+    # Backward from 49: the block before the frame and the previous one.
+    deadline = time.time() + 5
+    while (("media", 24) not in mm.cache) and (time.time() < deadline):
+        time.sleep(0.01)
+    assert ("media", 24) in mm.cache and ("media", 48) in mm.cache
+    assert max(calls.values()) == 1
+    mm.release()
+    assert mm.cache.n_bytes == 0
+
+
+def test_sequential_frames_are_read_without_seeking(tmp_video):
+    path = tmp_video(ramp(20), "video.gray")
+
+    mm = MediaManager(ViewerModel(), prefetch=False)
+    mm.set_logger(logging.getLogger("test"))
+    mm.add_source(path, "media", "image")
+    capture = mm.sources[0][1]
+    seeks = []
+    original_set = capture.set
+    capture.set = lambda prop, value: seeks.append(value) or original_set(prop, value)
+    for target in [1, 2, 3, 10, 11, 5]:
+        mm.set_frame(target)
+        assert int(mm.viewer.layers["media"].data[0, 0]) == target
+    assert seeks == [10, 5]
+    mm.release()
+
+
+def test_proxy_is_shown_while_scrubbing(tmp_path, tmp_video):
+    source = tmp_video((np.full((16, 32, 3), 20 * i, np.uint8) for i in range(10)), "source.avi", fps=30)
+
+    worker = QtWorkerC2A(source, str(tmp_path / "converted.avi"), intermediate="raw", proxy=True)
+    worker.convert_to_avi()
+    proxy_path = get_proxy_path(worker.out_path)
+    assert RawVideo(proxy_path).shape == (16 // PROXY_FACTOR, 32 // PROXY_FACTOR)
+
+    mm = MediaManager(ViewerModel(), prefetch=False)
+    mm.set_logger(logging.getLogger("test"))
+    mm.add_source(worker.out_path, "media", "image", proxy_path=proxy_path)
+    layer = mm.viewer.layers["media"]
+    mm.set_frame(5, preview=True)
+    assert layer.data.shape == (8, 16)
+    assert tuple(layer.scale) == (PROXY_FACTOR, PROXY_FACTOR)
+    assert tuple(layer.translate) == (0.5, 0.5)
+    mm.set_frame(5)
+    assert layer.data.shape == (16, 32)
+    assert tuple(layer.scale) == (1, 1) and tuple(layer.translate) == (0, 0)
+    assert abs(int(layer.data[8, 16]) - 100) <= 2
+    mm.release()
+
+
+def test_sources_are_fetched_in_parallel(tmp_video):
+    paths = [tmp_video(ramp(10), name) for name in ("video.gray", "mask.gray")]
+
+    def slow(frame):
+        time.sleep(0.1)
+        return frame.copy()
+
+    mm = MediaManager(ViewerModel(), prefetch=False)
+    mm.set_logger(logging.getLogger("test"))
+    mm.add_source(paths[0], "media", "image", slow)
+    mm.add_source(paths[1], "labels", "labels", slow)
+    start = time.perf_counter()
+    mm.set_frame(5)
+    assert time.perf_counter() - start < 0.18
+    assert int(mm.viewer.layers["media"].data[0, 0]) == 5
+    assert int(mm.viewer.layers["labels"].data[0, 0]) == 5
+    timings = mm.get_timings()
+    assert set(timings.keys()) == {"media", "labels"}
+    assert all(t['count'] == 1 and t['last'] >= 100 for t in timings.values())
+    mm.release()
+
+
+def test_prefetch_in_flight_is_dropped_on_invalidation(tmp_video):
+    path = tmp_video(ramp(60), "video.gray")
+    state = {'offset': 0}
+    in_prefetcher, resume = threading.Event(), threading.Event()
+    def process(frame):
+        result = frame + state['offset']
+        if threading.current_thread() is not threading.main_thread():
+            # The prefetcher is held with a frame processed by the former state.
+            in_prefetcher.set()
+            resume.wait(5)
+        return result
+
+    mm = MediaManager(ViewerModel())
+    mm.set_logger(logging.getLogger("test"))
+    mm.add_source(path, "media", "image", process)
+    assert in_prefetcher.wait(5)
+    state['offset'] = 100
+    mm.invalidate_cache("media")
+    resume.set()
+    mm.set_frame(1)
+    assert int(mm.viewer.layers["media"].data[0, 0]) == 101
+    deadline = time.time() + 5
+    while mm.prefetcher.pending and (time.time() < deadline):
+        time.sleep(0.01)
+    with mm.cache.lock:
+        cached = {key[1]: int(frame[0, 0]) for key, frame in mm.cache.frames.items()}
+    assert len(cached) > 1
+    assert all(value == index + 100 for index, value in cached.items())
+    mm.release()
+
+
+def test_set_process(tmp_video):
+    mm = MediaManager(ViewerModel(), prefetch=False)
+    mm.set_logger(logging.getLogger("test"))
+    mm.add_source(tmp_video(ramp(10), "video.gray"), "media", "image")
+    mm.set_frame(3)
+    mm.set_process("media", lambda frame: frame + 100)
+    assert ("media", 3) not in mm.cache
+    mm.set_frame(4)
+    assert int(mm.viewer.layers["media"].data[0, 0]) == 104
+    mm.release()
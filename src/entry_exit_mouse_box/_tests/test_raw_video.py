@@ -0,0 +1,60 @@
+import cv2
+import numpy as np
+import pytest
+
+from entry_exit_mouse_box.raw_video import RawVideoWriter, RawVideo, RawCapture, is_raw_video, sidecar_path
+from entry_exit_mouse_box.frame_source import open_luma
+
+
+@pytest.mark.parametrize("compression", [None, "zlib"])
+def test_raw_video_roundtrip(tmp_path, compression):
+    path = str(tmp_path / "video.gray")
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (37, 12, 20), dtype=np.uint8)
+
+    writer = RawVideoWriter(path, 25, (20, 12), compression, chunk_frames=8)
+    assert not is_raw_video(path)
+    for frame in frames:
+        writer.write(frame)
+    writer.release()
+    assert is_raw_video(path)
+
+    video = RawVideo(path)
+    assert len(video) == 37 and video.shape == (12, 20) and video.fps == 25
+    np.testing.assert_array_equal(video.read(0, 37), frames)
+    # Random access, across the chunks.
+    for index in (36, 3, 15, 16, 0):
+        np.testing.assert_array_equal(video.read(index), frames[index])
+    np.testing.assert_array_equal(video.read(5, 20), frames[5:25])
+    assert len(video.read(30, 100)) == 7
+    video.release()
+
+
+# tmp_video is a pytest fixture (see conftest.py)
+def test_raw_capture(tmp_video):
+    rng = np.random.default_rng(1)
+    frames = rng.integers(0, 256, (10, 8, 6, 3), dtype=np.uint8)
+    path = tmp_video(frames, "video.gray")
+
+    capture = open_luma(path)
+    assert isinstance(capture, RawCapture)
+    assert capture.get(cv2.CAP_PROP_FRAME_COUNT) == 10
+    assert (capture.get(cv2.CAP_PROP_FRAME_WIDTH), capture.get(cv2.CAP_PROP_FRAME_HEIGHT)) == (6, 8)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, 7)
+    ret, frame = capture.read()
+    assert ret
+    np.testing.assert_array_equal(frame, cv2.cvtColor(frames[7], cv2.COLOR_BGR2GRAY))
+    assert capture.grab() and capture.grab()
+    assert capture.read() == (False, None)
+    capture.release()
+
+
+def test_not_a_raw_video(tmp_path):
+    path = tmp_path / "video.gray"
+    path.write_bytes(b"\0" * 100)
+    assert not is_raw_video(str(path))
+    with pytest.raises(IOError):
+        RawVideo(str(path))
+    (tmp_path / "video.gray.json").write_text("{}")
+    assert sidecar_path(str(path)).endswith(".gray.json")
+    assert not is_raw_video(str(path))
@@ -0,0 +1,74 @@
+import numpy as np
+
+from entry_exit_mouse_box.utils import masked_moving_average, smooth_path_2d
+from entry_exit_mouse_box.measures import MiceVisibilityProcessor
+
+
+def loop_smooth_path_2d(points, window_size):
+    # Reference: the per-point loop that 'smooth_path_2d' replaced.
+    if window_size < 2:
+        return points
+    if window_size % 2 == 0:
+        window_size += 1
+    pad_width = window_size // 2
+    padded_points = np.pad(points, ((pad_width, pad_width), (0, 0)), mode='edge')
+    smoothed_points = np.zeros_like(points)
+    for i in range(len(points)):
+        smoothed_points[i] = np.mean(padded_points[i:i+window_size], axis=0)
+    return smoothed_points
+
+
+def loop_smooth_centroids(centroids, window_size):
+    # Reference: the per-box, per-frame loop of 'MiceVisibilityProcessor.smooth_centroids'.
+    smoothed = np.full_like(centroids, np.nan, dtype=np.float32)
+    n = centroids.shape[0]
+    half_w = window_size // 2
+    for box_rank in range(centroids.shape[1]):
+        for i in range(n):
+            window = centroids[max(0, i - half_w):min(n, i + half_w + 1), box_rank]
+            valid = (window >= 0).all(axis=1)
+            if valid.any():
+                smoothed[i, box_rank] = window[valid].mean(axis=0)
+            else:
+                smoothed[i, box_rank] = centroids[i, box_rank]
+    return smoothed
+
+
+def test_smooth_path_2d_matches_loop():
+    rng = np.random.default_rng(3)
+    points = rng.random((10, 2)) * 1000
+    for window_size in (1, 2, 3, 4, 5, 9, 25): # 25 is longer than the path.
+        # The windows are read from cumulative sums: only the rounding differs from the loop.
+        np.testing.assert_allclose(smooth_path_2d(points, window_size), loop_smooth_path_2d(points, window_size), rtol=1e-9, atol=1e-9)
+    points = rng.integers(0, 500, (10, 2))
+    np.testing.assert_array_equal(smooth_path_2d(points, 5), loop_smooth_path_2d(points, 5))
+
+
+def test_masked_moving_average():
+    values = np.array([1.0, 2.0, 3.0, 4.0])
+    averages, counts = masked_moving_average(values, 3, np.array([True, False, True, True]))
+    np.testing.assert_allclose(averages, [1.0, 2.0, 3.5, 3.5])
+    assert counts.tolist() == [1, 2, 2, 2]
+    # A window longer than the series covers all of it.
+    averages, counts = masked_moving_average(values, 11)
+    np.testing.assert_allclose(averages, [2.5] * 4)
+    assert counts.tolist() == [4] * 4
+    # No valid value at all.
+    averages, counts = masked_moving_average(values, 3, np.zeros(4, bool))
+    assert np.isnan(averages).all() and (counts == 0).all()
+
+
+def test_smooth_centroids_matches_loop():
+    rng = np.random.default_rng(4)
+    n_frames = 40
+    centroids = rng.random((n_frames, 2, 2)) * 200
+    centroids[rng.random((n_frames, 2)) < 0.3] = -1.0
+    centroids[10:25, 1] = -1.0 # A run without any valid neighbor.
+    areas = np.zeros((4, 4), np.uint8)
+    areas[0, 0], areas[1, 0] = 1, 2
+    for window_size in (1, 5, 99):
+        mvp = MiceVisibilityProcessor(None, areas, 10, {1: 0, 2: 0}, n_frames, n_frames=n_frames, fps=25)
+        mvp.instant_centroids = centroids.copy()
+        mvp.smooth_centroids(window_size)
+        assert mvp.instant_centroids.dtype == np.float32
+        np.testing.assert_allclose(mvp.instant_centroids, loop_smooth_centroids(centroids, window_size), rtol=1e-6)
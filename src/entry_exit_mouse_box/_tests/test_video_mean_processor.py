@@ -0,0 +1,106 @@
+import cv2
+import numpy as np
+
+from entry_exit_mouse_box.utils import split_frame_ranges
+from entry_exit_mouse_box.video_mean_processor import VideoMeanProcessor, background_params
+from entry_exit_mouse_box.convert_format import QtWorkerC2A
+
+
+def test_split_frame_ranges():
+    assert split_frame_ranges(10, 3) == [(0, 4), (4, 7), (7, 10)]
+    assert split_frame_ranges(100, 3, 32) == [(0, 64), (64, 96), (96, 100)]
+    assert split_frame_ranges(5, 3, 32) == [(0, 5), (5, 5), (5, 5)]
+    assert split_frame_ranges(7, 0) == [(0, 7)]
+
+
+def test_background_params():
+    assert background_params("shared") == background_params("segments")
+    # The frame range only matters to the sampled modes.
+    assert background_params("segments", frame_range=(10, 20)) == background_params("segments")
+    assert background_params("sampled", 50, (10, 20))['frame_range'] == [10, 20]
+    assert background_params("median", 50, (10, 20)) != background_params("median", 50)
+    # The mean accumulated during a conversion is not the full scan of the converted file.
+    assert background_params("conversion") != background_params("segments")
+
+
+# tmp_path and tmp_video are pytest fixtures (see conftest.py)
+def test_segments_mode_matches_shared_mode(tmp_video):
+    shape = (48, 64)
+    rng = np.random.default_rng(0)
+    video_path = tmp_video(rng.integers(0, 256, (150,) + shape + (3,), dtype=np.uint8))
+
+    vmp = VideoMeanProcessor(video_path, shape)
+    shared = vmp.start_processing(4)
+    assert vmp.n_read == 150
+    for n_workers in (1, 3, 8):
+        vmp = VideoMeanProcessor(video_path, shape, "segments")
+        segments = vmp.start_processing(n_workers)
+        # The sums are exact, so the order of the additions doesn't matter.
+        np.testing.assert_array_equal(segments, shared)
+        assert vmp.n_read == 150
+
+
+def test_sampled_mode(tmp_video):
+    shape = (24, 32)
+    video_path = tmp_video(np.full(shape + (3,), 50 if i < 20 else 150, np.uint8) for i in range(40))
+
+    vmp = VideoMeanProcessor(video_path, shape, "sampled", n_samples=10)
+    ref = vmp.start_processing(3)
+    assert vmp.n_read == 10
+    assert ref.dtype == np.uint8 and ref.shape == shape
+    assert abs(int(np.median(ref)) - 100) <= 2
+
+    ref = VideoMeanProcessor(video_path, shape, "sampled", n_samples=5, frame_range=(20, 40)).start_processing(2)
+    assert abs(int(np.median(ref)) - 150) <= 2
+
+
+def test_median_mode(tmp_video):
+    shape = (24, 32)
+    # A "mouse" sitting still in the first third of the video.
+    frames = np.full((30,) + shape + (3,), 120, np.uint8)
+    frames[:10, 4:12, 4:12] = 0
+    video_path = tmp_video(frames)
+
+    ref = VideoMeanProcessor(video_path, shape, "median", n_samples=30).start_processing(3)
+    assert abs(int(ref[8, 8]) - 120) <= 2
+
+    # The reservoir only has room for 5 frames.
+    vmp = VideoMeanProcessor(video_path, shape, "median", n_samples=30, memory_budget=shape[0] * shape[1] * 7)
+    ref = vmp.start_processing(3)
+    assert vmp.n_read == 30
+    assert ref.dtype == np.uint8 and ref.shape == shape
+    assert vmp.reservoir is None
+
+
+def test_conversion_accumulates_background(tmp_path, tmp_video):
+    shape = (48, 64)
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 256, shape + (3,), dtype=np.uint8), (9, 9), 3)
+    frames = []
+    for i in range(100):
+        frame = background.copy()
+        cv2.circle(frame, (i % shape[1], shape[0] // 2), 5, (0, 0, 0), -1)
+        frames.append(frame)
+    in_path = tmp_video(frames)
+
+    out_path = str(tmp_path / "out" / "video.avi")
+    (tmp_path / "out").mkdir()
+    results = []
+    c2a = QtWorkerC2A(in_path, out_path, background=True)
+    c2a.file_ready.connect(lambda path, ref: results.append((path, ref)))
+    c2a.run()
+    assert results[0][0] == out_path
+    ref = results[0][1]
+    assert ref.dtype == np.uint8 and ref.shape == shape
+
+    # The converted file is encoded again, so its full scan is only close to the accumulated mean.
+    vmp = VideoMeanProcessor(out_path, shape, "segments")
+    expected = vmp.start_processing(2)
+    assert np.abs(ref.astype(int) - expected.astype(int)).max() <= 4
+
+    # Nothing is computed if the file was already converted.
+    results.clear()
+    c2a = QtWorkerC2A(in_path, out_path, background=True)
+    c2a.file_ready.connect(lambda path, ref: results.append(ref))
+    c2a.run()
+    assert results == [None]
@@ -1,5 +1,5 @@
 import os
-import cv2
+import time
 import tifffile
 import json
 import numpy as np
@@ -39,16 +39,21 @@ from qtpy.QtGui import (
 )
 from qtpy.QtCore import (
     QThread, 
+    QTimer,
     Qt, 
     Signal,
     Slot
 )
 from entry_exit_mouse_box.media_manager import MediaManager
-from entry_exit_mouse_box.video_mean_processor import QtWorkerVMP
-from entry_exit_mouse_box.mask_from_video import QtWorkerMFV
-from entry_exit_mouse_box.convert_format import QtWorkerC2A
+from entry_exit_mouse_box.video_mean_processor import QtWorkerVMP, SAMPLES_BUDGET, background_params
+from entry_exit_mouse_box.mask_from_video import QtWorkerMFV, MEMORY_BUDGET
+from entry_exit_mouse_box.convert_format import QtWorkerC2A, INTERMEDIATE_FORMATS, get_proxy_path
+from entry_exit_mouse_box.raw_video import is_raw_video
 from entry_exit_mouse_box.measures import QtWorkerMVP
+from entry_exit_mouse_box.mask_and_measures import QtWorkerMAM
 from entry_exit_mouse_box.utils import setup_logger, apply_lut
+from entry_exit_mouse_box.frame_source import to_gray
+from entry_exit_mouse_box.artifact_cache import ArtifactCache
 from entry_exit_mouse_box.results_table import SessionsResultsTable, FrameWiseResultsTable
 
 
@@ -61,6 +66,19 @@ CENTOIDS_LAYER    = "centroids"
 PATH_LAYER        = "path"
 FONT              = QFont()
 FONT.setFamily("Arial Unicode MS, Segoe UI Emoji, Apple Color Emoji, Noto Color Emoji")
+# Background estimation methods displayed in the UI, and the corresponding modes of 'VideoMeanProcessor'.
+# The mean computed while converting a video is not recomputed: it is only found in the cache.
+BG_METHODS        = {
+    "Mean (full scan)"      : "segments",
+    "Mean (sampled)"        : "sampled",
+    "Median (sampled)"      : "median",
+    "Mean (from conversion)": "conversion"
+}
+# Default of the 'Lazy layers' checkbox: display the media and the labels as (T, Y, X) layers read on demand by napari (see 'MediaManager'),
+# rather than as 2D layers updated at each frame. Lazy layers seek faster on long jumps, 2D layers have the prefetcher and the proxy for scrubbing.
+LAZY_LAYERS       = False
+# Default of the 'Memory' spin box: amount of memory (in MB) that the batches in flight of the tracking are allowed to use (see 'MaskFromBackground').
+MEMORY_BUDGET_MB  = MEMORY_BUDGET // 1024**2
 
 
 class MouseInOutWidget(QWidget):
@@ -76,7 +94,8 @@ class MouseInOutWidget(QWidget):
         # Instance of Napari viewer
         self.viewer = napari_viewer
         # Object managing the media sources (reading and synchronizing the frames, the masks, the labels, ...)
-        self.mm     = MediaManager(self.viewer)
+        self.mm     = MediaManager(self.viewer, lazy=LAZY_LAYERS)
+        self.viewer.dims.events.current_step.connect(self.on_dims_change)
         # Dictionary containing the frame at which we start the measures for each box.
         # The key is the index of the row in the table, the value is the frame index.
         self.start  = {}
@@ -106,6 +125,14 @@ class MouseInOutWidget(QWidget):
         self.calibration = None
         # Length of a mouse in pixels
         self.mouse_length_pxl = 0
+        # Cache of the background references, shared between sessions.
+        self.bg_cache = ArtifactCache()
+        # Key of the background reference being extracted.
+        self.bg_key = None
+        # Playback: (time, frame) at which it started, last frame it showed, and number of frames shown.
+        self.play_origin = (0.0, 0)
+        self.play_last   = -1
+        self.play_shown  = 0
         self.create_temp_dir()
 
         self.switch_log_file(os.path.join(self.temp_dir, datetime.now().strftime("%Y-%m-%dT%H%M")+".log"))
@@ -140,7 +167,24 @@ class MouseInOutWidget(QWidget):
         self.file_button = QPushButton("📁 Select File", self)
         self.file_button.setFont(FONT)
         self.file_button.clicked.connect(self.select_file)
-        layout.addWidget(self.file_button)
+
+        # Format in which the selected video is converted before being processed.
+        self.intermediate_format = QComboBox(self)
+        self.intermediate_format.addItems(INTERMEDIATE_FORMATS.keys())
+
+        # Also write a downscaled copy of the video, displayed while the slider is dragged.
+        self.proxy_checkbox = QCheckBox("Proxy", self)
+
+        # Display the video as a (T, Y, X) layer, also driven by napari's slider. Used for the next opened video.
+        self.lazy_checkbox = QCheckBox("Lazy layers", self)
+        self.lazy_checkbox.setChecked(LAZY_LAYERS)
+
+        file_layout = QHBoxLayout()
+        file_layout.addWidget(self.file_button)
+        file_layout.addWidget(self.intermediate_format)
+        file_layout.addWidget(self.proxy_checkbox)
+        file_layout.addWidget(self.lazy_checkbox)
+        layout.addLayout(file_layout)
 
         # Buttons 'backward' and 'forward'
         self.backward_button = QPushButton("⏮️ Backward", self)
@@ -151,8 +195,17 @@ class MouseInOutWidget(QWidget):
         self.forward_button.setFont(FONT)
         self.forward_button.clicked.connect(self.jump_forward)
         
+        # Playback at the native frame rate.
+        self.play_button = QPushButton("▶️ Play", self)
+        self.play_button.setFont(FONT)
+        self.play_button.clicked.connect(self.toggle_playback)
+        self.play_timer = QTimer(self)
+        self.play_timer.setTimerType(Qt.PreciseTimer)
+        self.play_timer.timeout.connect(self.play_step)
+        
         nav_layout_2 = QHBoxLayout()
         nav_layout_2.addWidget(self.backward_button)
+        nav_layout_2.addWidget(self.play_button)
         nav_layout_2.addWidget(self.forward_button)
         layout.addLayout(nav_layout_2)
 
@@ -160,6 +213,7 @@ class MouseInOutWidget(QWidget):
         self.slider = QSlider(self)
         self.slider.setValue(-1)
         self.slider.valueChanged.connect(self.on_slider_change)
+        self.slider.sliderReleased.connect(self.on_slider_released)
         self.slider.setOrientation(Qt.Horizontal)
         layout.addWidget(self.slider)
 
@@ -277,8 +331,10 @@ class MouseInOutWidget(QWidget):
         if self.calibration is None:
             return
         pixelSize, unit = self.calibration
+        if self.mm.get_n_sources() > 0:
+            self.mm.show_full_resolution()
         for layer in self.viewer.layers:
-            layer.scale = (pixelSize, pixelSize)
+            layer.scale = (1,) * (layer.ndim - 2) + (pixelSize, pixelSize)
         self.viewer.scale_bar.unit = unit
         self.viewer.scale_bar.visible = True
 
@@ -364,6 +420,41 @@ class MouseInOutWidget(QWidget):
         self.extract_button.clicked.connect(self.start_extract_background)
         layout.addWidget(self.extract_button)
 
+        # How the background is estimated: by scanning the whole video or from a budget of sampled frames.
+        bg_layout = QHBoxLayout()
+        self.bg_method = QComboBox(self)
+        self.bg_method.addItems(BG_METHODS.keys())
+        bg_layout.addWidget(self.bg_method)
+
+        self.bg_samples = QSpinBox(self)
+        self.bg_samples.setMinimum(1)
+        self.bg_samples.setMaximum(100000)
+        self.bg_samples.setValue(SAMPLES_BUDGET)
+        self.bg_samples.setSuffix(" frames")
+        bg_layout.addWidget(self.bg_samples)
+
+        layout.addLayout(bg_layout)
+
+        # Range of frames (1-based, inclusive) in which the sampled methods pick their frames.
+        range_layout = QHBoxLayout()
+        range_layout.addWidget(QLabel("Frames:", self))
+
+        self.bg_start = QSpinBox(self)
+        self.bg_start.setMinimum(1)
+        self.bg_start.setMaximum(1)
+        range_layout.addWidget(self.bg_start)
+
+        range_layout.addWidget(QLabel("to", self))
+
+        self.bg_end = QSpinBox(self)
+        self.bg_end.setMinimum(1)
+        self.bg_end.setMaximum(1)
+        range_layout.addWidget(self.bg_end)
+
+        layout.addLayout(range_layout)
+        self.bg_method.currentTextChanged.connect(self.on_bg_method_change)
+        self.on_bg_method_change()
+
         track_layout = QHBoxLayout()
 
         self.track_button = QPushButton("🐀 Launch tracking", self)
@@ -377,6 +468,19 @@ class MouseInOutWidget(QWidget):
         self.threshold.valueChanged.connect(self.on_threshold_update)
         track_layout.addWidget(self.threshold)
 
+        # Checkbox to build the masks and the measures in a single pass.
+        self.single_pass_checkbox = QCheckBox("Single pass", self)
+        track_layout.addWidget(self.single_pass_checkbox)
+
+        # Memory given to the frames and the masks being processed by the tracking.
+        self.memory_budget = QSpinBox(self)
+        self.memory_budget.setMinimum(64)
+        self.memory_budget.setMaximum(1024**2)
+        self.memory_budget.setValue(MEMORY_BUDGET_MB)
+        self.memory_budget.setSuffix(" MB")
+        self.memory_budget.setToolTip("Memory used by the batches of frames in flight during the tracking.")
+        track_layout.addWidget(self.memory_budget)
+
         layout.addLayout(track_layout)
 
         measure_layout = QHBoxLayout()
@@ -485,7 +589,7 @@ class MouseInOutWidget(QWidget):
 
         # The active layer must be the shape layer, containing a polygon around the head of a mouse.
         active_layer = self.viewer.layers.selection.active
-        active_layer.scale = self.viewer.layers[MEDIA_LAYER].scale
+        active_layer.scale = (1,) * (active_layer.ndim - 2) + tuple(self.viewer.layers[MEDIA_LAYER].scale[-2:])
 
         # Checking that the active layer is a shape layer.
         if 'add_lines' not in dir(active_layer):
@@ -505,7 +609,7 @@ class MouseInOutWidget(QWidget):
             self.logger.error("A line shape is expected.")
             return
         
-        line = active_layer.data[0]
+        line = active_layer.data[0][:, -2:] # Without the time axis if the layer has one.
         length_pxl = int(np.sqrt((line[0][0]-line[1][0])**2 + (line[0][1]-line[1][1])**2)) # in pixels
         self.mouse_length.setValue(length_pxl)
 
@@ -535,7 +639,7 @@ class MouseInOutWidget(QWidget):
             return
         
         bg_ref = self.viewer.layers[BG_REF_LAYER].data
-        img    = self.viewer.layers[MEDIA_LAYER].data
+        img    = self.mm.get_frame(MEDIA_LAYER)
         diff   = np.abs(img.astype(np.float32) - bg_ref) > value
 
         if TS_PREVIEW_LAYER in self.viewer.layers:
@@ -556,7 +660,13 @@ class MouseInOutWidget(QWidget):
             t: bool - True to enable the inputs, False to disable them.
         """
         self.file_button.setEnabled(t)
+        self.intermediate_format.setEnabled(t)
+        self.proxy_checkbox.setEnabled(t)
+        self.lazy_checkbox.setEnabled(t)
+        if not t:
+            self.stop_playback()
         self.backward_button.setEnabled(t)
+        self.play_button.setEnabled(t)
         self.forward_button.setEnabled(t)
         self.slider.setEnabled(t)
         self.frame_input.setEnabled(t)
@@ -576,12 +686,18 @@ class MouseInOutWidget(QWidget):
         self.extract_measures_button.setEnabled(t)
         self.track_button.setEnabled(t)
         self.extract_button.setEnabled(t)
+        self.bg_method.setEnabled(t)
+        self.bg_samples.setEnabled(t)
+        self.bg_start.setEnabled(t and self.bg_uses_range())
+        self.bg_end.setEnabled(t and self.bg_uses_range())
         self.threshold.setEnabled(t)
         self.set_mouse_length_button.setEnabled(t)
         self.mouse_length.setEnabled(t)
         self.mouse_length_label.setEnabled(t)
         self.min_track_length_factor.setEnabled(t)
         self.no_path_checkbox.setEnabled(t)
+        self.single_pass_checkbox.setEnabled(t)
+        self.memory_budget.setEnabled(t)
         self.export_button.setEnabled(t)
         self.calibInput.setEnabled(t)
         self.calibInput.setEnabled(t)
@@ -707,7 +823,7 @@ class MouseInOutWidget(QWidget):
         ma = self.get_min_track_length_pxl()
         start = self.start
 
-        self.mvp = QtWorkerMVP(mask_path, areas, ma, start, self.duration_to_frames())
+        self.mvp = QtWorkerMVP(mask_path, areas, ma, start, self.duration_to_frames(), roi=True)
         self.mvp.moveToThread(self.thread)
         self.mvp.measures_ready.connect(self.terminate_measures)
         self.thread.started.connect(self.mvp.run)
@@ -789,7 +905,7 @@ class MouseInOutWidget(QWidget):
             return sessions
         
         # Get the size of a pixel.
-        pixel_size = float(self.viewer.layers[MEDIA_LAYER].scale[0])
+        pixel_size = float(self.viewer.layers[MEDIA_LAYER].scale[-1])
         show_info(f"Calibration found: XY={pixel_size} {self.viewer.scale_bar.unit}")
         for box in range(len(self.boxes)):
             for session in sessions[box]['sessions']:
@@ -820,7 +936,7 @@ class MouseInOutWidget(QWidget):
             return
         for item in os.listdir(self.temp_dir):
             full_path = os.path.join(self.temp_dir, item)
-            if item.endswith((".npy", ".tif", ".csv", "mask.avi")):
+            if item.endswith((".npy", ".tif", ".csv", "mask.avi", "mask.bin")):
                 os.remove(full_path)
         self.clear_state()
         self.logger.info("Temporary files deleted.")
@@ -915,6 +1031,7 @@ class MouseInOutWidget(QWidget):
         """
         Resets the state of the widget to its initial state.
         """
+        self.stop_playback()
         self.mm.release()
         self.viewer.layers.clear()
         self.boxes = []
@@ -924,6 +1041,8 @@ class MouseInOutWidget(QWidget):
         self.frame_input.setMinimum(-1)
         self.frame_input.setValue(-1)
         self.frame_input.setMaximum(-1)
+        self.bg_start.setMaximum(1)
+        self.bg_end.setMaximum(1)
         self.video_name.setText(f"<b>---</b>")
         
         self.table.setRowCount(0)
@@ -946,6 +1065,7 @@ class MouseInOutWidget(QWidget):
         self.pbr = None
         self.mvp = None
         self.mfv = None
+        self.mam = None
         self.vmp = None
 
         self.logger.info("Widget cleared.")
@@ -968,23 +1088,44 @@ class MouseInOutWidget(QWidget):
         self.pbr = progress(total=0)
         self.pbr.set_description("Converting video...")
         self.thread = QThread()
-        self.c2a = QtWorkerC2A(file_path, os.path.join(self.temp_dir, os.path.basename(file_path)))
+        intermediate, compression = INTERMEDIATE_FORMATS[self.intermediate_format.currentText()]
+        self.c2a = QtWorkerC2A(
+            file_path, 
+            os.path.join(self.temp_dir, os.path.basename(file_path)), 
+            background=True, 
+            intermediate=intermediate, 
+            compression=compression, 
+            proxy=self.proxy_checkbox.isChecked()
+        )
         self.c2a.moveToThread(self.thread)
         self.c2a.file_ready.connect(self.set_media)
         self.thread.started.connect(self.c2a.run)
         self.thread.start()
 
-    def set_media(self, file_path):
+    def set_media(self, file_path, ref=None):
         self.pbr.close()
         self.thread.quit()
         self.thread.wait()
         self.thread.deleteLater()
         self.set_active_ui(True)
 
+        # Background accumulated during the conversion, close to a full scan of the converted file (which is encoded again).
+        if ref is not None:
+            self.bg_cache.put(self.bg_cache.make_key(file_path, background_params("conversion")), ref)
+
         def bgr2rgb(frame):
-            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            return to_gray(frame)
         
-        properties = self.mm.add_source(file_path, MEDIA_LAYER, "image", bgr2rgb)
+        if self.mm.get_n_sources() == 0:
+            self.mm.set_lazy(self.lazy_checkbox.isChecked())
+        proxy_path = get_proxy_path(file_path)
+        properties = self.mm.add_source(
+            file_path, 
+            MEDIA_LAYER, 
+            "image", 
+            bgr2rgb, 
+            proxy_path if is_raw_video(proxy_path) else None
+        )
 
         if properties is None:
             print("Failed to open the file: " + file_path)
@@ -994,6 +1135,10 @@ class MouseInOutWidget(QWidget):
         self.frame_input.setMinimum(1)
         self.slider.setMaximum(properties['total_frames'])
         self.frame_input.setMaximum(properties['total_frames'])
+        self.bg_start.setMaximum(properties['total_frames'])
+        self.bg_end.setMaximum(properties['total_frames'])
+        self.bg_start.setValue(1)
+        self.bg_end.setValue(properties['total_frames'])
         self.set_frame(0)
         self.update_playback_info()
         self.video_name.setText(f"<b>{os.path.basename(file_path)}</b>")
@@ -1014,15 +1159,63 @@ class MouseInOutWidget(QWidget):
         self.info_label.setText(f"{round(t, 2)} sec")
         self.properties_display.setText(f"{w}x{h} ({round(fps, 4)} FPS) ↦ {round(d, 4)}s")
     
-    def set_frame(self, n):
+    def set_frame(self, n, preview=False):
         if not self.mm.active:
             return
-        self.mm.set_frame(n)
+        self.mm.set_frame(n, preview)
         self.slider.setValue(n+1)
         self.frame_input.setValue(n+1)
         self.update_playback_info()
         self.update_boxes()
 
+    def toggle_playback(self):
+        if self.play_timer.isActive():
+            self.stop_playback()
+        else:
+            self.start_playback()
+
+    def start_playback(self):
+        """
+        Plays the video from the current frame at its native frame rate.
+        The frame to show is given by the time elapsed since the start, so frames are dropped when the decoding can't keep up.
+        """
+        if (not self.mm.active) or (self.mm.get_n_sources() == 0):
+            return
+        if self.mm.current_frame >= self.mm.get_n_frames() - 1:
+            self.set_frame(0)
+        fps = max(1, self.mm.get_fps())
+        self.play_origin = (time.perf_counter(), self.mm.current_frame)
+        self.play_last   = self.mm.current_frame
+        self.play_shown  = 0
+        self.play_timer.start(max(1, int(1000 / fps)))
+        self.play_button.setText("⏸️ Pause")
+
+    def stop_playback(self):
+        if not self.play_timer.isActive():
+            return
+        self.play_timer.stop()
+        self.play_button.setText("▶️ Play")
+        elapsed = time.perf_counter() - self.play_origin[0]
+        if elapsed > 0:
+            self.logger.info(f"Playback: {self.play_shown} frames shown in {elapsed:.1f} s ({self.play_shown / elapsed:.1f} FPS).")
+        timings = ", ".join(f"{name}: {t['mean']:.1f} ms" for name, t in self.mm.get_timings().items())
+        self.logger.info(f"Mean time to fetch a frame, per source: {timings}.")
+
+    def play_step(self):
+        # The user moved to another frame during the playback: it goes on from there.
+        if self.mm.current_frame != self.play_last:
+            self.play_origin = (time.perf_counter(), self.mm.current_frame)
+            self.play_last   = self.mm.current_frame
+        start_time, start_frame = self.play_origin
+        target = start_frame + int((time.perf_counter() - start_time) * self.mm.get_fps())
+        last = self.mm.get_n_frames() - 1
+        if target != self.mm.current_frame:
+            self.set_frame(min(target, last))
+            self.play_last = self.mm.current_frame
+            self.play_shown += 1
+        if target >= last:
+            self.stop_playback()
+
     def jump_backward(self):
         f = self.mm.current_frame-25
         self.set_frame(f)
@@ -1033,15 +1226,71 @@ class MouseInOutWidget(QWidget):
 
     def on_slider_change(self, value):
         if int(self.frame_input.value()) != int(value):
-            self.set_frame(int(value)-1)
+            # While the slider is dragged, the proxy is shown if the full resolution frame is not ready.
+            self.set_frame(int(value)-1, self.slider.isSliderDown())
+
+    def on_dims_change(self, event=None):
+        # With lazy layers, napari's own slider also moves through the video.
+        if (not self.mm.lazy) or (self.mm.get_n_sources() == 0) or (self.viewer.dims.ndim < 3):
+            return
+        n = int(self.viewer.dims.current_step[0])
+        if int(self.slider.value()) != n + 1:
+            self.set_frame(n)
+
+    def on_slider_released(self):
+        if self.mm.active and (self.mm.get_n_sources() > 0):
+            self.mm.show_full_resolution()
 
     def on_spinbox_change(self, value):
         if int(self.slider.value()) != int(value):
             self.set_frame(int(value)-1)
 
+    def bg_uses_range(self):
+        return BG_METHODS[self.bg_method.currentText()] in ("sampled", "median")
+
+    def on_bg_method_change(self, text=None):
+        # The full scan always reads the whole video.
+        self.bg_start.setEnabled(self.bg_method.isEnabled() and self.bg_uses_range())
+        self.bg_end.setEnabled(self.bg_method.isEnabled() and self.bg_uses_range())
+
+    def get_background_range(self):
+        """
+        Range of frames (start, end) of the sampled background methods, None for the whole video.
+        """
+        n_frames = self.mm.get_n_frames()
+        start = self.bg_start.value() - 1
+        end   = self.bg_end.value()
+        if (not self.bg_uses_range()) or ((start <= 0) and (end >= n_frames)):
+            return None
+        if end <= start:
+            start, end = end - 1, start + 1
+        return (start, end)
+
+    def get_background_params(self):
+        """
+        Parameters of the background extraction, used to address the cache.
+        """
+        return background_params(BG_METHODS[self.bg_method.currentText()], self.bg_samples.value(), self.get_background_range())
+
     def start_extract_background(self):
         src = self.mm.get_source_by_name(MEDIA_LAYER)
         src_path = src[0]
+        mode = BG_METHODS[self.bg_method.currentText()]
+
+        self.bg_key = self.bg_cache.make_key(src_path, self.get_background_params())
+        ref = self.bg_cache.get(self.bg_key)
+        if (ref is None) and (mode == "conversion"):
+            show_warning("No background was computed while converting this file, scanning it instead.")
+            mode = "segments"
+            self.bg_key = self.bg_cache.make_key(src_path, background_params(mode))
+            ref = self.bg_cache.get(self.bg_key)
+        if ref is not None:
+            self.set_background(ref)
+            self.logger.info("Background found in the cache.")
+            show_info("Background extracted (cached)!")
+            # Emitted from the event loop, as when the background is computed, so the callers can still connect to the signal.
+            QTimer.singleShot(0, self.background_ready.emit)
+            return
 
         self.set_active_ui(False)
         show_info("Extracting background...")
@@ -1049,13 +1298,32 @@ class MouseInOutWidget(QWidget):
         self.pbr = progress(total=0)
         self.pbr.set_description("Extracting background...")
         self.thread = QThread()
-        self.vmp = QtWorkerVMP(src_path, (self.mm.get_height(), self.mm.get_width()))
+        self.vmp = QtWorkerVMP(
+            src_path, 
+            (self.mm.get_height(), self.mm.get_width()),
+            mode=mode,
+            num_workers=max(1, os.cpu_count() or 1),
+            n_samples=int(self.bg_samples.value()),
+            frame_range=self.get_background_range()
+        )
         self.vmp.moveToThread(self.thread)
         self.vmp.bg_ready.connect(self.terminate_extract_background)
         self.thread.started.connect(self.vmp.run)
         self.thread.start()
     
     def terminate_extract_background(self, ref, src_path):
+        self.set_background(ref)
+        self.bg_cache.put(self.bg_key, ref)
+        self.logger.info("Background extracted.")
+        show_info("Background extracted!")
+        self.pbr.close()
+        self.thread.quit()
+        self.thread.wait()
+        self.thread.deleteLater()
+        self.set_active_ui(True)
+        self.background_ready.emit()
+
+    def set_background(self, ref):
         if BG_REF_LAYER in self.viewer.layers:
             self.viewer.layers[BG_REF_LAYER].data = ref
         else:
@@ -1066,16 +1334,7 @@ class MouseInOutWidget(QWidget):
             )
 
         tifffile.imwrite(os.path.join(self.temp_dir, "bg-ref.tif"), ref)
-
-        self.logger.info("Background extracted.")
         self.logger.info(f"Background reference saved in '{self.temp_dir}'")
-        show_info("Background extracted!")
-        self.pbr.close()
-        self.thread.quit()
-        self.thread.wait()
-        self.thread.deleteLater()
-        self.set_active_ui(True)
-        self.background_ready.emit()
         
     def extract_classes(self):
         classes = {}
@@ -1114,6 +1373,8 @@ class MouseInOutWidget(QWidget):
 
         if AREAS_LAYER in self.viewer.layers:
             self.viewer.layers[AREAS_LAYER].data = label_areas
+            # The mice labels are colored by the areas when they are decoded.
+            self.mm.set_process(MICE_LABELS_LAYER, self.labels_process())
         else:
             self.viewer.add_labels(
                 label_areas, 
@@ -1121,26 +1382,85 @@ class MouseInOutWidget(QWidget):
                 visible=False
             )
     
-    def launch_mask_processing(self):
-        # Acquiring the background reference.
+    def check_tracking_inputs(self):
+        """
+        Checks that everything required to build the mice labels is available.
+
+        Returns:
+            The path of the media, or None if something is missing.
+        """
         if BG_REF_LAYER not in self.viewer.layers:
             print("Couldn't find the background reference. Abort.")
-            return
-        bg_ref = self.viewer.layers[BG_REF_LAYER].data
-
-        # Checking that all the start frames are set.
+            return None
         if len(self.start) != len(self.boxes):
             print("Not all boxes have a start frame set.")
             show_error("Not all boxes have a start frame set.")
-            return
-
-        # Building the output path
+            return None
         if self.mm.get_n_sources() == 0:
             print("No media opened.")
+            return None
+        return self.mm.get_source_by_name(MEDIA_LAYER)[0]
+
+    def get_memory_budget(self):
+        """
+        Memory (in bytes) that the batches in flight of the tracking are allowed to use.
+        """
+        return self.memory_budget.value() * 1024**2
+
+    def launch_fused_processing(self):
+        """
+        Builds the mice labels and extracts the measures in a single pass over the video.
+        The mice labels are still saved to be displayed.
+        """
+        media_path = self.check_tracking_inputs()
+        if media_path is None:
             return
-        
-        media_path = self.mm.get_source_by_name(MEDIA_LAYER)[0]
-        file_name = "mask.avi"
+        bg_ref = self.viewer.layers[BG_REF_LAYER].data
+        self.mask_path = os.path.join(self.temp_dir, "mask.bin")
+
+        if TS_PREVIEW_LAYER in self.viewer.layers:
+            del self.viewer.layers[TS_PREVIEW_LAYER]
+
+        self.set_active_ui(False)
+        show_info("Building mice labels and extracting measures...")
+        self.logger.info("Single pass with threshold at: " + str(self.threshold.value()))
+        self.logger.info("Single pass from frame: " + str(self.start))
+        self.pbr = progress(total=0)
+        self.pbr.set_description("Building mice labels and extracting measures...")
+        self.thread = QThread()
+        self.mam = QtWorkerMAM(
+            media_path,
+            bg_ref,
+            self.threshold.value(),
+            self.start,
+            self.viewer.layers[AREAS_LAYER].data,
+            self.get_min_track_length_pxl(),
+            self.duration_to_frames(),
+            self.mask_path,
+            roi=True,
+            method="opencv",
+            memory_budget=self.get_memory_budget()
+        )
+        self.mam.moveToThread(self.thread)
+        self.mam.measures_ready.connect(self.terminate_fused_processing)
+        self.thread.started.connect(self.mam.run)
+        self.thread.start()
+
+    def terminate_fused_processing(self, visibility, centroids, sessions):
+        self.add_mice_labels(self.mask_path)
+        self.logger.info("Mice labels built.")
+        self.logger.info(f"Peak buffered batches: {self.mam.peak_buffered} (max in flight: {self.mam.max_in_flight})")
+        self.terminate_measures(visibility, centroids, sessions)
+
+    def launch_mask_processing(self):
+        # Checking the background reference, the start frames and the media.
+        media_path = self.check_tracking_inputs()
+        if media_path is None:
+            return
+        bg_ref = self.viewer.layers[BG_REF_LAYER].data
+
+        # Building the output path
+        file_name = "mask.bin"
         output_path = os.path.join(self.temp_dir, file_name)
 
         # Removing threshold previewer
@@ -1161,7 +1481,10 @@ class MouseInOutWidget(QWidget):
             bg_ref,
             self.threshold.value(),
             self.start,
-            self.viewer.layers[AREAS_LAYER].data
+            self.viewer.layers[AREAS_LAYER].data,
+            roi=True,
+            method="opencv",
+            memory_budget=self.get_memory_budget()
         )
         self.mfv.moveToThread(self.thread)
         self.mfv.mask_ready.connect(self.terminate_mask_processing)
@@ -1169,15 +1492,24 @@ class MouseInOutWidget(QWidget):
         self.thread.start()
         
 
-    def terminate_mask_processing(self, mask_path):
-
+    def labels_process(self):
+        """
+        Process function of the mice labels: each mouse takes the label of its box.
+        It runs in the decoding threads, so it works on a copy of the areas taken here, on the GUI thread.
+        """
+        areas = self.viewer.layers[AREAS_LAYER].data.copy()
         def bgr2rgb_tr(frame):
-            mask = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) > 127
+            mask = to_gray(frame) > 127
             canvas = np.zeros(mask.shape, np.uint8)
-            canvas[mask] = self.viewer.layers[AREAS_LAYER].data[mask]
+            canvas[mask] = areas[mask]
             return canvas
-        
-        self.mm.add_source(mask_path, MICE_LABELS_LAYER, "labels", bgr2rgb_tr)
+        return bgr2rgb_tr
+
+    def add_mice_labels(self, mask_path):
+        """
+        Opens the mask of the mice as a labels layer, in which each mouse takes the label of its box.
+        """
+        self.mm.add_source(mask_path, MICE_LABELS_LAYER, "labels", self.labels_process())
         apply_lut(
             self.viewer.layers[MICE_LABELS_LAYER], 
             self.boxes, 
@@ -1185,8 +1517,11 @@ class MouseInOutWidget(QWidget):
         )
         self.viewer.layers[MEDIA_LAYER].opacity = 0.3
 
+    def terminate_mask_processing(self, mask_path):
+        self.add_mice_labels(mask_path)
         self.set_active_ui(False)
         self.logger.info("Mice labels built.")
+        self.logger.info(f"Peak buffered batches: {self.mfv.peak_buffered} (max in flight: {self.mfv.max_in_flight})")
         show_info("Mice labels built!")
         self.pbr.close()
         self.thread.quit()
@@ -1237,7 +1572,10 @@ class MouseInOutWidget(QWidget):
             self.boxes, 
             self.extract_classes()
         )
-        self.launch_mask_processing()
+        if self.single_pass_checkbox.isChecked():
+            self.launch_fused_processing()
+        else:
+            self.launch_mask_processing()
 
 
 
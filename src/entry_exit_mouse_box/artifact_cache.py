@@ -0,0 +1,145 @@
+import os
+import json
+import hashlib
+import warnings
+import numpy as np
+
+# Default location of the cache, shared by all the sessions of the widget.
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "entry-exit-mouse-box")
+# Default maximal size of the cache (in bytes).
+CACHE_SIZE = 256 * 1024**2
+# Number and size (in bytes) of the chunks read to fingerprint a file.
+N_CHUNKS   = 16
+CHUNK_SIZE = 64 * 1024
+# Bumped when the content of the cached artifacts changes, to invalidate the old entries.
+CACHE_VERSION = 2
+
+
+def fingerprint_file(path, n_chunks=N_CHUNKS, chunk_size=CHUNK_SIZE):
+    """
+    Computes a fast fingerprint of a file's content: its size and a hash of chunks spread evenly over it.
+    The whole file is hashed if it is smaller than the chunks.
+    The modification time is deliberately not used: an identical file written again (e.g. converted again) keeps the same fingerprint.
+
+    Args:
+        path      : Path of the file.
+        n_chunks  : Number of chunks to read.
+        chunk_size: Size of each chunk in bytes.
+
+    Returns:
+        A hexadecimal string.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= n_chunks * chunk_size:
+            digest.update(f.read())
+        else:
+            for offset in np.linspace(0, size - chunk_size, n_chunks).astype(np.int64):
+                f.seek(int(offset))
+                digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+
+class ArtifactCache(object):
+    """
+    Cache of NumPy arrays (e.g. background references) addressed by the content of the file they were computed from and by the parameters used.
+    Each entry is a '.npy' file named after its key. Its modification time is refreshed when it is read, so the least recently used entries are removed first when the cache exceeds its maximal size.
+    The directory is only created when the first entry is stored. If it can't be, the cache is disabled with a warning: 'get' misses and 'put' does nothing.
+    """
+    def __init__(self, root=None, max_bytes=CACHE_SIZE):
+        self.root      = os.path.join(CACHE_DIR, "artifacts") if root is None else root
+        self.max_bytes = max_bytes
+        self.enabled   = True
+        self.ready     = False # The directory exists.
+
+    def disable(self, error):
+        self.enabled = False
+        warnings.warn(f"The cache can't be used in '{self.root}' ({error}), caching is disabled.", stacklevel=2)
+
+    def make_root(self):
+        """
+        Creates the directory of the cache if needed.
+
+        Returns:
+            True if the cache can be written.
+        """
+        if self.enabled and not self.ready:
+            try:
+                os.makedirs(self.root, exist_ok=True)
+                self.ready = True
+            except OSError as e:
+                self.disable(e)
+        return self.enabled
+
+    def make_key(self, file_path, params):
+        """
+        Builds the key of an artifact computed from a file with some parameters.
+
+        Args:
+            file_path: Path of the source file (e.g. the video).
+            params   : JSON-serializable dictionary of the parameters used to compute the artifact.
+        """
+        description = json.dumps({'version': CACHE_VERSION, 'file': fingerprint_file(file_path), 'params': params}, sort_keys=True)
+        return hashlib.blake2b(description.encode(), digest_size=20).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.root, key + ".npy")
+
+    def get(self, key):
+        """
+        Returns the array stored with this key, or None if it is not (or no longer) in the cache.
+        """
+        if not self.enabled:
+            return None
+        path = self.entry_path(key)
+        try:
+            data = np.load(path, allow_pickle=False)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def put(self, key, data):
+        """
+        Stores an array and removes the least recently used entries if the cache becomes too large.
+        The file is written under a temporary name first, so a partial entry is never read.
+        """
+        if not self.make_root():
+            return
+        path = self.entry_path(key)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, np.asarray(data), allow_pickle=False)
+            os.replace(tmp_path, path)
+            self.evict()
+        except OSError as e:
+            self.disable(e)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in 'max_bytes'.
+        """
+        entries = []
+        for item in os.listdir(self.root):
+            if not item.endswith(".npy"):
+                continue
+            path = os.path.join(self.root, item)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def clear(self):
+        if not os.path.isdir(self.root):
+            return
+        for item in os.listdir(self.root):
+            if item.endswith((".npy", ".tmp")):
+                os.remove(os.path.join(self.root, item))
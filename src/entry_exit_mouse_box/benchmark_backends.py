@@ -0,0 +1,212 @@
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from entry_exit_mouse_box.frame_source import BACKENDS, READERS, WRITERS, open_reader, open_writer
+
+try:
+    import resource
+except ImportError: # Not available on Windows.
+    resource = None
+
+# Compares the throughput of the video backends (see 'frame_source.BACKENDS') on the current host.
+# Each measure runs in a fresh process, so that the peak memory of a backend is not polluted by the others.
+
+
+def reset_peak_memory():
+    """
+    Resets the peak resident memory of the current process (Linux only).
+
+    Returns:
+        True if the peak could be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_memory_mb():
+    """
+    Peak resident memory of the current process in MB (None if it can't be measured on this platform).
+    On Linux, it is the peak since the last call to 'reset_peak_memory'.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def current_memory_mb():
+    """
+    Current resident memory of the current process in MB (Linux only, None elsewhere).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def make_test_video(path, n_frames=600, shape=(480, 640), fps=30, fourcc='XVID'):
+    """
+    Writes a synthetic video: a textured background scrolling horizontally, with a moving dark blob.
+    XVID is an inter-frame codec (a keyframe every 12 frames with OpenCV), so a random access has to decode from the previous keyframe, as with the camera files.
+    An intra-only codec (e.g. MJPG) would make the seek measure meaningless.
+    """
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 256, shape + (3,), dtype=np.uint8), (15, 15), 5)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, (shape[1], shape[0]))
+    for i in range(n_frames):
+        frame = np.roll(background, i, axis=1)
+        cv2.circle(frame, ((7 * i) % shape[1], shape[0] // 2), shape[0] // 10, (20, 20, 20), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def backend_name(obj, classes):
+    """
+    Name of the backend actually used by a reader or a writer, as 'open_reader' and 'open_writer' fall back to OpenCV.
+
+    Args:
+        obj    : The reader or the writer.
+        classes: READERS or WRITERS.
+    """
+    for name, cls in classes.items():
+        if type(obj) is cls:
+            return name
+    return type(obj).__name__
+
+
+def benchmark_reader(path, backend, gray=True, threads=0, n_seeks=20):
+    """
+    Measures a reader: sequential decoding speed, latency of a random access (seek + read) and peak memory.
+    The memory is the increase of the peak resident memory while the reader is used.
+
+    Returns:
+        A dictionary with the keys: requested, backend (the one actually used), gray, threads, fps, seek_ms, memory_mb.
+    """
+    baseline = current_memory_mb() if reset_peak_memory() else peak_memory_mb()
+    reader = open_reader(path, backend, gray, threads)
+    n_frames = 0
+    start = time.perf_counter()
+    while True:
+        ret, _ = reader.read()
+        if not ret:
+            break
+        n_frames += 1
+    sequential = time.perf_counter() - start
+
+    rng = np.random.default_rng(0)
+    indices = rng.integers(0, max(1, n_frames), n_seeks)
+    start = time.perf_counter()
+    for index in indices:
+        reader.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+        reader.read()
+    seeking = time.perf_counter() - start
+    used = backend_name(reader, READERS)
+    reader.release()
+
+    memory = peak_memory_mb()
+    return {
+        'requested': backend,
+        'backend'  : used,
+        'gray'     : gray,
+        'threads'  : threads,
+        'fps'      : n_frames / sequential if sequential > 0 else 0.0,
+        'seek_ms'  : 1000.0 * seeking / max(1, n_seeks),
+        'memory_mb': None if (memory is None) or (baseline is None) else memory - baseline
+    }
+
+
+def benchmark_writer(path, backend, n_frames=300, shape=(480, 640), threads=0):
+    """
+    Measures the encoding speed of a writer (MJPG, as used by the conversion to AVI).
+
+    Returns:
+        A dictionary with the keys: requested, backend (the one actually used), threads, fps.
+    """
+    rng = np.random.default_rng(0)
+    frame = cv2.GaussianBlur(rng.integers(0, 256, shape + (3,), dtype=np.uint8), (15, 15), 5)
+    writer = open_writer(path, 'MJPG', 30, (shape[1], shape[0]), True, backend, threads)
+    start = time.perf_counter()
+    for i in range(n_frames):
+        writer.write(np.roll(frame, i, axis=1))
+    writer.release()
+    duration = time.perf_counter() - start
+    used = backend_name(writer, WRITERS)
+    os.remove(path)
+    return {
+        'requested': backend,
+        'backend'  : used,
+        'threads'  : threads,
+        'fps'      : n_frames / duration if duration > 0 else 0.0
+    }
+
+
+def run_isolated(function, *args):
+    """
+    Runs a benchmark function in a new process and returns its result.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(function, *args).result()
+
+
+def run_benchmark(path=None, backends=BACKENDS, threads=(0, 1, 4)):
+    """
+    Benchmarks all the combinations of backends and thread counts, on the given video or on a synthetic one.
+    The measures of a backend that fell back to another one are dropped.
+
+    Returns:
+        A tuple (readers, writers) of lists of dictionaries (see 'benchmark_reader' and 'benchmark_writer').
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if path is None:
+            path = make_test_video(os.path.join(tmp_dir, "synthetic.avi"))
+        readers, writers = [], []
+        for backend in backends:
+            for n_threads in threads:
+                for gray in (True, False):
+                    readers.append(run_isolated(benchmark_reader, path, backend, gray, n_threads))
+                writers.append(run_isolated(benchmark_writer, os.path.join(tmp_dir, f"out-{backend}.avi"), backend, 300, (480, 640), n_threads))
+    for backend in sorted({r['requested'] for r in readers + writers if r['backend'] != r['requested']}):
+        print(f"The backend '{backend}' is not available, its measures are skipped.")
+    readers = [r for r in readers if r['backend'] == r['requested']]
+    writers = [w for w in writers if w['backend'] == w['requested']]
+    return readers, writers
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+if __name__ == "__main__":
+    # Usage: python -m entry_exit_mouse_box.benchmark_backends [video_path]
+    readers, writers = run_benchmark(sys.argv[1] if len(sys.argv) > 1 else None)
+
+    print(f"{'backend':<8} {'frames':<6} {'threads':>7} {'fps':>9} {'seek (ms)':>10} {'memory (MB)':>12}")
+    for r in readers:
+        memory = "---" if r['memory_mb'] is None else f"{r['memory_mb']:.1f}"
+        print(f"{r['backend']:<8} {'gray' if r['gray'] else 'bgr':<6} {r['threads']:>7} {r['fps']:>9.1f} {r['seek_ms']:>10.2f} {memory:>12}")
+
+    print("")
+    print(f"{'backend':<8} {'threads':>7} {'MJPG encoding fps':>18}")
+    for w in writers:
+        print(f"{w['backend']:<8} {w['threads']:>7} {w['fps']:>18.1f}")
@@ -1,39 +1,93 @@
 import cv2
 import os
+from entry_exit_mouse_box.frame_source import open_reader, open_writer, to_gray
+from entry_exit_mouse_box.video_mean_processor import RunningMean
+from entry_exit_mouse_box.raw_video import RawVideoWriter, RAW_EXTENSION, is_raw_video
+from entry_exit_mouse_box.frame_index import FrameIndex, save_frame_index
 
 from qtpy.QtCore import QObject, Signal
 
-# Worker to convert a file to AVI.
+# Intermediate formats that a video can be converted to, as (format, compression):
+#  - 'avi': MJPG encoded AVI, the smallest on disk but every later pass has to decode it again.
+#  - 'raw': Raw grayscale frames (see 'raw_video.RawVideo'), read without decoding and with true random access.
+INTERMEDIATE_FORMATS = {
+    "MJPG (AVI)"      : ("avi", None),
+    "Raw"             : ("raw", None),
+    "Raw (compressed)": ("raw", "zlib")
+}
+# The proxy is a downscaled copy of the video, displayed while scrubbing. It is a raw video, so every frame is directly accessible.
+# Its width and height are divided by PROXY_FACTOR (a quarter of the pixels with a factor of 2).
+PROXY_FACTOR = 2
+PROXY_SUFFIX = ".proxy" + RAW_EXTENSION
+
+
+def get_proxy_path(video_path):
+    """
+    Path of the proxy of a converted video ('video.avi' -> 'video.proxy.gray').
+    """
+    return os.path.splitext(video_path)[0] + PROXY_SUFFIX
+
+# Worker to convert a file to AVI (or to a raw video, with 'intermediate="raw"').
+# The path of the file actually written is emitted with 'file_ready': a raw video uses the RAW_EXTENSION extension instead of the original one.
+# With 'background=True', the mean background (as in the full scan of 'VideoMeanProcessor') is accumulated while the frames are converted.
+# It is emitted with 'file_ready', or None if it wasn't computed (e.g. the file had already been converted).
+# With 'proxy=True', a proxy is written next to the converted file (see 'get_proxy_path').
 
 class QtWorkerC2A(QObject):
 
-    file_ready = Signal(str)
+    file_ready = Signal(str, object)
 
-    def __init__(self, in_path, out_path):
+    def __init__(self, in_path, out_path, background=False, intermediate="avi", compression=None, proxy=False):
         super().__init__()
-        self.in_path   = in_path
-        self.out_path  = out_path
-        print(f"Converting {self.in_path} to AVI...")
+        if intermediate not in ("avi", "raw"):
+            raise ValueError(f"ERROR: Unknown intermediate format: {intermediate}.")
+        if intermediate == "raw":
+            out_path = os.path.splitext(out_path)[0] + RAW_EXTENSION
+        self.in_path      = in_path
+        self.out_path     = out_path
+        self.background   = background
+        self.intermediate = intermediate
+        self.compression  = compression
+        self.proxy        = proxy
+        self.mean         = None
+        print(f"Converting {self.in_path} to {intermediate.upper()}...")
         print(f"The file will be written at: {self.out_path}")
 
+    def is_converted(self):
+        # The sidecar of a raw video is written last: an interrupted conversion is done again.
+        if self.proxy and not is_raw_video(get_proxy_path(self.out_path)):
+            return False
+        if self.intermediate == "raw":
+            return is_raw_video(self.out_path)
+        return os.path.isfile(self.out_path)
+
+    def open_writer(self, fps, size):
+        if self.intermediate == "raw":
+            return RawVideoWriter(self.out_path, fps, size, self.compression)
+        return open_writer(self.out_path, 'MJPG', fps, size)
+
     def convert_to_avi(self):
-        if os.path.isfile(self.out_path):
+        if self.is_converted():
             print(f"File {self.out_path} already exists.")
             return
         
-        cap = cv2.VideoCapture(self.in_path)
+        # The raw videos take the grayscale frames as the other stages would read them from the original file.
+        cap = open_reader(self.in_path, gray=(self.intermediate == "raw"))
         if not cap.isOpened():
             return
 
         width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         fps    = round(cap.get(cv2.CAP_PROP_FPS))
-        codec  = 'MJPG'
 
-        fourcc = cv2.VideoWriter_fourcc(*codec)
-        out = cv2.VideoWriter(self.out_path, fourcc, fps, (width, height))
+        out = self.open_writer(fps, (width, height))
+        proxy, proxy_size = None, (max(1, width // PROXY_FACTOR), max(1, height // PROXY_FACTOR))
+        if self.proxy:
+            proxy = RawVideoWriter(get_proxy_path(self.out_path), fps, proxy_size)
         i = 0
         n_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.background:
+            self.mean = RunningMean((height, width))
 
         while cap.isOpened():
             ret, frame = cap.read()
@@ -43,11 +97,20 @@ class QtWorkerC2A(QObject):
                 print(f"{(i/n_frames)*100:.2f}%")
             i += 1
             out.write(frame)
+            if self.mean is not None:
+                self.mean.add(frame)
+            if proxy is not None:
+                proxy.write(cv2.resize(to_gray(frame), proxy_size, interpolation=cv2.INTER_AREA))
 
         cap.release()
         out.release()
+        if proxy is not None:
+            proxy.release()
+        # The number of frames written is exact, and all the frames of an MJPG video are keyframes: the index is known without scanning the file.
+        if self.intermediate == "avi":
+            save_frame_index(self.out_path, FrameIndex(i, "all"))
 
     def run(self):
-        if not os.path.isfile(self.out_path):
+        if not self.is_converted():
             self.convert_to_avi()
-        self.file_ready.emit(self.out_path)
+        self.file_ready.emit(self.out_path, None if self.mean is None else self.mean.result())
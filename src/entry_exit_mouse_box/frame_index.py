@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import threading
+import cv2
+import numpy as np
+from entry_exit_mouse_box.artifact_cache import CACHE_DIR, fingerprint_file
+
+# Exact index of the frames of a video, stored as a JSON file in the cache directory (nothing is written next to the user's videos).
+# The frame count and the seeking of the decoders are estimated from the container's metadata, which is unreliable for variable-GOP (or variable frame rate) MP4 files.
+# The index gives, once for all:
+#  - The exact number of frames.
+#  - The frames that are keyframes: a seek jumps to the previous keyframe and decodes forward, deterministically.
+#  - The presentation timestamp (PTS) of each frame, in the time base of the stream (when it is known).
+# The file is named after the fingerprint of the video (see 'artifact_cache.fingerprint_file'), so a stale index is never found.
+# Indexes are built explicitly: by the conversion (the index of the converted file is known without scanning it), or with 'python -m entry_exit_mouse_box.frame_index'.
+INDEX_DIR     = os.path.join(CACHE_DIR, "indexes")
+INDEX_SUFFIX  = ".index.json"
+INDEX_FORMAT  = "EEMBINDEX"
+INDEX_VERSION = 1
+# Build (and save) the index of a video the first time it is opened, when it can be done by demuxing (i.e. if PyAV is installed).
+# Off by default: opening a reader would demux the whole file, and write in the cache directory.
+AUTO_INDEX    = False
+
+# Indexes already loaded (or built) in this process, by (absolute path, fingerprint).
+_loaded      = {}
+_loaded_lock = threading.Lock()
+
+
+def index_path(fingerprint):
+    return os.path.join(INDEX_DIR, fingerprint + INDEX_SUFFIX)
+
+
+class FrameIndex(object):
+    """
+    Positions of the frames of a video.
+
+    Args:
+        n_frames : Exact number of frames.
+        keyframes: Sorted indices of the keyframes, None if unknown, or "all" for intra-only videos (e.g. MJPG).
+        pts      : Presentation timestamp of each frame (in presentation order), or None if unknown.
+        time_base: Time base of the timestamps as a (numerator, denominator) tuple.
+    """
+    def __init__(self, n_frames, keyframes=None, pts=None, time_base=None):
+        self.n_frames  = int(n_frames)
+        self.intra     = isinstance(keyframes, str) and (keyframes == "all")
+        self.keyframes = None if (keyframes is None or self.intra) else np.asarray(keyframes, np.int64)
+        self.pts       = None if pts is None else np.asarray(pts, np.int64)
+        self.time_base = None if time_base is None else tuple(int(t) for t in time_base)
+
+    def has_keyframes(self):
+        return self.intra or (self.keyframes is not None and len(self.keyframes) > 0)
+
+    def is_regular(self):
+        """
+        Checks that the frames are evenly spaced in time (constant frame rate), which is assumed if the timestamps are unknown.
+        """
+        if self.pts is None or len(self.pts) < 3:
+            return True
+        steps = np.diff(self.pts)
+        return int(steps.max() - steps.min()) <= 1
+
+    def keyframe_before(self, index):
+        """
+        Index of the last keyframe at or before the frame 'index' (0 if the keyframes are unknown).
+        """
+        if self.intra:
+            return int(index)
+        if self.keyframes is None or len(self.keyframes) == 0:
+            return 0
+        i = np.searchsorted(self.keyframes, index, side='right') - 1
+        return int(self.keyframes[max(0, i)])
+
+    def frame_at(self, pts):
+        """
+        Index of the frame presented at the timestamp 'pts' (the last frame starting at or before it).
+        """
+        i = np.searchsorted(self.pts, pts, side='right') - 1
+        return int(min(max(0, i), self.n_frames - 1))
+
+    def seconds(self, index):
+        """
+        Time of the frame 'index' from the first frame, in seconds (None if the timestamps are unknown).
+        """
+        if self.pts is None or self.time_base is None:
+            return None
+        return float((self.pts[index] - self.pts[0]) * self.time_base[0] / self.time_base[1])
+
+    def to_dict(self):
+        return {
+            'n_frames' : self.n_frames,
+            'keyframes': "all" if self.intra else (None if self.keyframes is None else self.keyframes.tolist()),
+            'pts'      : None if self.pts is None else self.pts.tolist(),
+            'time_base': None if self.time_base is None else list(self.time_base)
+        }
+
+
+def scan_with_pyav(video_path):
+    """
+    Builds the index from the packets of the video stream (demuxing only, nothing is decoded).
+
+    Raises:
+        ImportError: If PyAV is not installed.
+    """
+    import av
+    with av.open(video_path) as container:
+        stream = container.streams.video[0]
+        timestamps, keys = [], []
+        for packet in container.demux(stream):
+            if packet.size == 0: # Flushing packet.
+                continue
+            timestamp = packet.pts if packet.pts is not None else packet.dts
+            if timestamp is None:
+                raise IOError(f"ERROR: Packets without timestamps in {video_path}.")
+            timestamps.append(timestamp)
+            keys.append(packet.is_keyframe)
+        time_base = (stream.time_base.numerator, stream.time_base.denominator)
+    timestamps = np.asarray(timestamps, np.int64)
+    order      = np.argsort(timestamps, kind='stable') # Decoding order -> presentation order.
+    keyframes  = np.flatnonzero(np.asarray(keys, bool)[order])
+    return FrameIndex(len(timestamps), keyframes, timestamps[order], time_base)
+
+
+def scan_with_opencv(video_path):
+    """
+    Counts the frames by grabbing all of them. The keyframes and the timestamps are not available.
+    """
+    video = cv2.VideoCapture(video_path)
+    if not video.isOpened():
+        raise IOError(f"ERROR: Failed to open {video_path}.")
+    n_frames = 0
+    while video.grab():
+        n_frames += 1
+    video.release()
+    return FrameIndex(n_frames)
+
+
+def remember(video_path, fingerprint, index):
+    with _loaded_lock:
+        _loaded[(os.path.abspath(video_path), fingerprint)] = index
+    return index
+
+
+def save_frame_index(video_path, index, fingerprint=None):
+    """
+    Writes the index of a video in the cache directory. It is skipped (with a message) if this directory can't be written.
+
+    Returns:
+        True if the index was written.
+    """
+    fingerprint = fingerprint_file(video_path) if fingerprint is None else fingerprint
+    content = {
+        'format'     : INDEX_FORMAT,
+        'version'    : INDEX_VERSION,
+        'fingerprint': fingerprint
+    }
+    content.update(index.to_dict())
+    path = index_path(fingerprint)
+    # Several workers may open the same video at once: each one writes its own temporary file.
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(content, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"The frame index of {video_path} couldn't be saved ({e}).")
+        return False
+    remember(video_path, fingerprint, index)
+    return True
+
+
+def build_frame_index(video_path, save=True):
+    """
+    Scans a video to build its index, with PyAV if it is installed (exact keyframes and timestamps), or with OpenCV (exact frame count only).
+
+    Args:
+        video_path: Path of the video.
+        save      : Write the index in the cache directory.
+    """
+    try:
+        index = scan_with_pyav(video_path)
+    except ImportError:
+        index = scan_with_opencv(video_path)
+    if save:
+        save_frame_index(video_path, index)
+    return index
+
+
+def load_frame_index(video_path, fingerprint=None):
+    """
+    Reads the index of a video from the cache directory.
+
+    Returns:
+        A FrameIndex, or None if there is no valid index for the current content of the video.
+    """
+    try:
+        fingerprint = fingerprint_file(video_path) if fingerprint is None else fingerprint
+        with open(index_path(fingerprint), "r") as f:
+            content = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(content, dict) or content.get('format') != INDEX_FORMAT or content.get('version') != INDEX_VERSION:
+        return None
+    if content.get('fingerprint') != fingerprint:
+        return None
+    return FrameIndex(content['n_frames'], content['keyframes'], content['pts'], content['time_base'])
+
+
+def get_frame_index(video_path):
+    """
+    Returns the index of a video, from the memory of this process or from the cache directory.
+    If there is none, and if AUTO_INDEX is set and PyAV is installed, the index is built (and saved) first.
+    The video is fingerprinted at each call, so a modified video is indexed again.
+
+    Returns:
+        A FrameIndex, or None if no index is available.
+    """
+    try:
+        fingerprint = fingerprint_file(video_path)
+    except OSError:
+        return None
+    with _loaded_lock:
+        index = _loaded.get((os.path.abspath(video_path), fingerprint))
+    if index is not None:
+        return index
+    index = load_frame_index(video_path, fingerprint)
+    if index is not None:
+        return remember(video_path, fingerprint, index)
+    if not AUTO_INDEX:
+        return None
+    try:
+        import av
+    except ImportError:
+        return None
+    try:
+        index = scan_with_pyav(video_path)
+    except (av.error.FFmpegError, OSError, ValueError) as e:
+        print(f"The frame index of {video_path} couldn't be built ({e}).")
+        return None
+    if not save_frame_index(video_path, index, fingerprint):
+        remember(video_path, fingerprint, index)
+    return index
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+if __name__ == "__main__":
+    # Usage: python -m entry_exit_mouse_box.frame_index video_1.mp4 [video_2.mp4 ...]
+    for path in sys.argv[1:]:
+        index = build_frame_index(path)
+        n_keyframes = "all" if index.intra else ("unknown" if index.keyframes is None else len(index.keyframes))
+        print(f"{path}: {index.n_frames} frames, keyframes: {n_keyframes}")
@@ -0,0 +1,709 @@
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from functools import lru_cache
+from fractions import Fraction
+import cv2
+import numpy as np
+from entry_exit_mouse_box.mask_store import MaskCapture, is_mask_store
+from entry_exit_mouse_box.raw_video import RawCapture, is_raw_video
+from entry_exit_mouse_box.frame_index import get_frame_index
+
+# Libraries that can be used to decode and encode videos:
+#  - 'opencv': 'cv2.VideoCapture' and 'cv2.VideoWriter' (always available).
+#  - 'pyav'  : The 'av' package (optional dependency, 'pip install av').
+#  - 'ffmpeg': Raw frames piped from/to an ffmpeg process (requires the 'ffmpeg' executable in the PATH).
+# When a backend is not available, we fall back to OpenCV.
+BACKENDS = ("opencv", "pyav", "ffmpeg")
+# Backend used when none is specified. All the stages (background, masks, measures, display) use it, so their grayscale values stay consistent.
+DEFAULT_BACKEND = "opencv"
+# Number of threads used by the decoders and encoders (0 lets the library decide).
+CODEC_THREADS = 0
+# With OpenCV, get the grayscale frames from the Y plane of planar YUV streams rather than from a BGR decode followed by 'cv2.cvtColor'.
+LUMA_PLANE = True
+# Limited range ("TV", 16-235) Y planes are expanded to the full range of the BGR decode with this table.
+LIMITED_RANGE_LUT = np.clip(np.rint((np.arange(256) - 16) * 255 / 219), 0, 255).astype(np.uint8)
+# Below this standard deviation of its luma, the first frame can't tell a full range stream from a limited range one.
+RANGE_MIN_STD = 2.0
+# Path of the ffmpeg executable (None if it is not installed).
+FFMPEG = shutil.which("ffmpeg")
+# Number of characters kept from the end of the error output of ffmpeg in the error messages.
+STDERR_TAIL = 2000
+# Codecs used by PyAV and ffmpeg for the FourCC codes used with OpenCV.
+FOURCC_CODECS = {
+    'MJPG': 'mjpeg',
+    'XVID': 'mpeg4',
+    'mp4v': 'mpeg4',
+    'FFV1': 'ffv1',
+    'avc1': 'libx264'
+}
+
+
+def to_gray(frame, dst=None):
+    """
+    Converts a frame to a single channel uint8 image.
+    Frames that are already single channel (coming from a luma reader or a 'MaskCapture') are returned as they are.
+
+    Args:
+        frame: A BGR or a grayscale frame.
+        dst  : Optional uint8 buffer of the frame's shape in which the result is written.
+
+    Returns:
+        The grayscale frame ('dst' if it was provided).
+    """
+    if frame.ndim == 2:
+        if dst is None:
+            return frame
+        dst[...] = frame
+        return dst
+    if dst is None:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=dst)
+
+
+def luma_range(luma, gray):
+    """
+    Tells whether the Y plane of a frame is full range or limited range, by comparison with the grayscale of its BGR decode.
+    The slope of the grayscale values against the luma values is 1 in full range and 255/219 in limited range.
+
+    Args:
+        luma: The Y plane of the frame.
+        gray: The same frame, decoded in BGR and converted with 'to_gray'.
+
+    Returns:
+        "full", "limited", or None if it can't be told (e.g. uniform frame) or if the Y plane doesn't match the BGR decode.
+    """
+    y = luma.astype(np.float64).ravel()
+    g = gray.astype(np.float64).ravel()
+    if y.std() < RANGE_MIN_STD:
+        return None
+    slope = np.polyfit(y, g, 1)[0]
+    for name, expected, lut in (("full", 1.0, None), ("limited", 255 / 219, LIMITED_RANGE_LUT)):
+        if abs(slope - expected) > 0.06:
+            continue
+        expanded = luma if lut is None else cv2.LUT(luma, lut)
+        # The BGR decode of OpenCV differs slightly (about 1.5 levels below the standard expansion of limited range streams).
+        if np.abs(expanded.astype(np.int16) - gray).mean() <= 3.0:
+            return name
+    return None
+
+
+# OpenCV warns at each frame decoded without RGB conversion ("Unknown/unsupported picture format ... treated as 8UC1").
+# Its log level is raised to errors as long as such a capture is open.
+_quiet_lock  = threading.Lock()
+_quiet_count = 0
+_quiet_level = None
+
+
+def quiet_opencv_logs(enable):
+    """
+    Counts the captures needing the OpenCV warnings to be silenced, and restores the log level when there are none left.
+    """
+    global _quiet_count, _quiet_level
+    with _quiet_lock:
+        if enable:
+            if _quiet_count == 0:
+                _quiet_level = cv2.utils.logging.getLogLevel()
+                cv2.utils.logging.setLogLevel(cv2.utils.logging.LOG_LEVEL_ERROR)
+            _quiet_count += 1
+        elif _quiet_count > 0:
+            _quiet_count -= 1
+            if _quiet_count == 0:
+                cv2.utils.logging.setLogLevel(_quiet_level)
+
+
+def probe_video(path):
+    """
+    Reads the properties of a video with OpenCV.
+
+    Returns:
+        A dictionary with the keys: total_frames, fps, width, height (None if the file can't be opened).
+    """
+    video = cv2.VideoCapture(path)
+    if not video.isOpened():
+        return None
+    properties = {
+        'total_frames': int(video.get(cv2.CAP_PROP_FRAME_COUNT)),
+        'fps'         : video.get(cv2.CAP_PROP_FPS),
+        'width'       : int(video.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height'      : int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    }
+    video.release()
+    return properties
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#                              READERS                                #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# All the readers have the interface of 'cv2.VideoCapture' (isOpened, get, set, grab, read, release).
+# They deliver BGR frames, or single channel uint8 frames if they are created with 'gray=True'.
+# When the video has a frame index (see 'frame_index.FrameIndex'), they report its exact frame count and use it to seek.
+
+
+class OpenCVReader(object):
+    """
+    Reader based on 'cv2.VideoCapture'.
+    In gray mode, the RGB conversion is disabled when the decoder gives the Y plane directly (planar YUV streams).
+    Limited range Y planes are expanded, so the values are the same as the ones of the BGR decode followed by 'to_gray' (up to the rounding).
+    For other streams (packed or RGB formats, e.g. FFV1), or if the range can't be told from the first frame, the frames are decoded in BGR and converted.
+    With the keyframes of a frame index, a frame ahead of the current position in the same group of pictures is reached by decoding forward, without seeking.
+    The seeks themselves are OpenCV's, which estimates the positions from the frame rate: they are only exact for constant frame rate videos.
+    """
+    def __init__(self, path, gray=False, threads=0, index=None, luma_plane=LUMA_PLANE):
+        self.path       = path
+        self.gray       = gray
+        self.threads    = threads
+        self.index      = index
+        self.position   = 0
+        self.luma_plane = False
+        self.luma_lut   = None # Set for limited range Y planes.
+        self.quiet      = False
+        self.video      = self.open()
+        self.shape      = (int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        if gray and luma_plane:
+            self.open_luma_plane()
+
+    def open(self):
+        if self.threads > 0:
+            return cv2.VideoCapture(self.path, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, int(self.threads)])
+        return cv2.VideoCapture(self.path)
+
+    def open_luma_plane(self):
+        """
+        Disables the RGB conversion and checks, on the first frame, that the decoder actually gives a (height, width) plane.
+        The range of this plane is found by comparing it with the BGR decode of the same frame (see 'luma_range').
+        Otherwise, the BGR decode is restored.
+        """
+        if not self.video.isOpened():
+            return
+        # The RGB conversion can't be disabled once a frame is read: the BGR decode is done by another capture.
+        bgr = self.open()
+        ret, frame = bgr.read()
+        bgr.release()
+        if not ret:
+            return
+        gray = to_gray(frame)
+        quiet_opencv_logs(True)
+        self.quiet = True
+        if self.video.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            ret, frame = self.video.read()
+            if ret and (frame.dtype == np.uint8) and (frame.shape == gray.shape):
+                y_range = luma_range(frame, gray)
+                if y_range is not None:
+                    self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    self.luma_plane = True
+                    self.luma_lut   = LIMITED_RANGE_LUT if y_range == "limited" else None
+                    return
+        self.video.release()
+        self.unquiet()
+        self.video = self.open()
+
+    def unquiet(self):
+        if self.quiet:
+            quiet_opencv_logs(False)
+            self.quiet = False
+
+    def isOpened(self):
+        return self.video.isOpened()
+
+    def get(self, prop):
+        if self.index is not None:
+            if prop == cv2.CAP_PROP_FRAME_COUNT:
+                return float(self.index.n_frames)
+            if prop == cv2.CAP_PROP_POS_FRAMES:
+                return float(self.position)
+        return self.video.get(prop)
+
+    def seek(self, index):
+        if (self.index is not None) and self.index.has_keyframes() and (self.index.keyframe_before(index) <= self.position <= index):
+            while self.position < index:
+                if not self.grab():
+                    return False
+            return True
+        ret = self.video.set(cv2.CAP_PROP_POS_FRAMES, index)
+        self.position = index
+        return ret
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.seek(int(value))
+        return self.video.set(prop, value)
+
+    def grab(self):
+        if not self.video.grab():
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        ret, frame = self.video.read()
+        if not ret:
+            return False, None
+        self.position += 1
+        if self.gray and not self.luma_plane:
+            frame = to_gray(frame)
+        elif self.luma_lut is not None:
+            frame = cv2.LUT(frame, self.luma_lut, dst=frame)
+        return True, frame
+
+    def release(self):
+        self.video.release()
+        self.unquiet()
+
+
+class PyAVReader(object):
+    """
+    Reader based on PyAV (libav* bindings).
+    Frames are located by their timestamp: seeking jumps to the previous keyframe and decodes until the requested frame.
+    The timestamps are estimated from the frame rate, or read from the frame index when it has them.
+
+    Raises:
+        ImportError: If PyAV is not installed.
+    """
+    def __init__(self, path, gray=False, threads=0, index=None):
+        import av
+        self.av        = av
+        self.path      = path
+        self.format    = "gray" if gray else "bgr24"
+        self.container = av.open(path)
+        self.stream    = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        if threads > 0:
+            self.stream.codec_context.thread_count = int(threads)
+        rate           = self.stream.average_rate or self.stream.guessed_rate or Fraction(0)
+        self.fps       = float(rate)
+        self.time_base = self.stream.time_base
+        self.start_pts = self.stream.start_time or 0
+        self.width     = self.stream.codec_context.width
+        self.height    = self.stream.codec_context.height
+        self.n_frames  = self.stream.frames
+        if (self.n_frames == 0) and (self.stream.duration is not None):
+            self.n_frames = int(round(float(self.stream.duration * self.time_base) * self.fps))
+        self.index     = index if (index is not None) and (index.pts is not None) else None
+        if index is not None:
+            self.n_frames = index.n_frames
+        self.frames    = self.container.decode(self.stream)
+        self.pending   = None
+        self.position  = 0
+
+    def next_frame(self):
+        if self.pending is not None:
+            frame, self.pending = self.pending, None
+            return frame
+        try:
+            return next(self.frames)
+        except (StopIteration, self.av.error.EOFError):
+            return None
+
+    def frame_index(self, frame):
+        if self.index is not None:
+            return self.index.frame_at(frame.pts)
+        return int(round(float((frame.pts - self.start_pts) * self.time_base) * self.fps))
+
+    def seek(self, index):
+        if self.index is not None:
+            target = int(self.index.pts[self.index.keyframe_before(min(max(0, index), self.n_frames - 1))])
+        else:
+            target = self.start_pts + int(index / (self.fps * self.time_base))
+        self.container.seek(target, stream=self.stream, backward=True, any_frame=False)
+        self.frames  = self.container.decode(self.stream)
+        self.pending = None
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                break
+            if (frame.pts is None) or (self.frame_index(frame) >= index):
+                self.pending = frame
+                break
+        self.position = index
+
+    def isOpened(self):
+        return self.container is not None
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.n_frames)
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        return 0.0
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.seek(int(value))
+        return True
+
+    def grab(self):
+        if self.next_frame() is None:
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        frame = self.next_frame()
+        if frame is None:
+            return False, None
+        self.position += 1
+        return True, frame.to_ndarray(format=self.format)
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+        self.container = None
+
+
+@lru_cache(maxsize=None)
+def ffmpeg_version():
+    """
+    Version (major, minor) of the ffmpeg executable, None if it can't be read (e.g. development builds).
+    """
+    if FFMPEG is None:
+        return None
+    try:
+        output = subprocess.run([FFMPEG, "-version"], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"version\s+n?(\d+)\.(\d+)", output)
+    return None if match is None else (int(match.group(1)), int(match.group(2)))
+
+
+def passthrough_args():
+    """
+    Arguments making ffmpeg output the frames as they are (no frame dropped or duplicated to match a frame rate).
+    '-fps_mode' replaced '-vsync' in ffmpeg 5.1. Development builds are assumed to be recent.
+    """
+    version = ffmpeg_version()
+    if (version is not None) and (version < (5, 1)):
+        return ["-vsync", "passthrough"]
+    return ["-fps_mode", "passthrough"]
+
+
+class FFmpegReader(object):
+    """
+    Reader receiving raw frames ('gray' or 'bgr24') from the standard output of an ffmpeg process.
+    Seeking restarts the process at the timestamp of the requested frame (ffmpeg decodes from the previous keyframe and drops the frames before it).
+    The timestamp is estimated from the frame rate, or read from the frame index when it has them.
+    If ffmpeg fails before the last frame, its return code and its messages are printed and kept in 'error'.
+
+    Raises:
+        IOError: If ffmpeg is not installed or if the file can't be probed.
+    """
+    def __init__(self, path, gray=False, threads=0, index=None):
+        properties = probe_video(path)
+        if (FFMPEG is None) or (properties is None) or (properties['fps'] <= 0):
+            raise IOError(f"ERROR: ffmpeg can't be used to read {path}.")
+        if index is not None:
+            properties['total_frames'] = index.n_frames
+        self.index      = index if (index is not None) and (index.seconds(0) is not None) else None
+        self.path       = path
+        self.properties = properties
+        self.threads    = threads
+        self.pix_fmt    = "gray" if gray else "bgr24"
+        self.shape      = (properties['height'], properties['width']) if gray else (properties['height'], properties['width'], 3)
+        self.n_bytes    = int(np.prod(self.shape))
+        self.process    = None
+        self.stderr     = None
+        self.error      = None
+        self.position   = 0
+        self.start(0)
+
+    def start(self, index):
+        self.stop()
+        cmd = [FFMPEG, "-v", "error", "-nostdin", "-threads", str(self.threads)]
+        if index > 0:
+            cmd += ["-ss", f"{self.seek_time(index):.6f}"]
+        cmd += ["-i", self.path, "-map", "0:v:0"] + passthrough_args() + ["-f", "rawvideo", "-pix_fmt", self.pix_fmt, "-"]
+        # A file rather than a pipe: nobody reads the messages while the frames are decoded.
+        self.stderr   = tempfile.TemporaryFile()
+        self.process  = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=self.stderr, bufsize=4*self.n_bytes)
+        self.position = index
+        self.ended    = False
+
+    def seek_time(self, index):
+        if (self.index is None) or (index >= self.index.n_frames):
+            return index / self.properties['fps']
+        # Halfway from the previous frame, so that rounding can't drop the requested frame.
+        return 0.5 * (self.index.seconds(index - 1) + self.index.seconds(index))
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.process.stdout.close()
+        self.process.kill()
+        self.process.wait()
+        self.process = None
+        self.stderr.close()
+        self.stderr = None
+
+    def check_end(self):
+        """
+        Called when the frames run out: reports the failure of ffmpeg if it stopped before the last frame.
+        """
+        if self.ended or (self.position >= self.properties['total_frames']):
+            return
+        self.ended = True
+        code = self.process.wait()
+        self.stderr.seek(0)
+        message = self.stderr.read().decode(errors="replace").strip()
+        if (code != 0) or message:
+            self.error = f"ffmpeg stopped at frame {self.position}/{self.properties['total_frames']} of {self.path} (return code {code}): {message}"
+            print(f"ERROR: {self.error}")
+
+    def isOpened(self):
+        return self.process is not None
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.properties['total_frames'])
+        if prop == cv2.CAP_PROP_FPS:
+            return self.properties['fps']
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.properties['width'])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.properties['height'])
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        return 0.0
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.start(int(value))
+        return True
+
+    def grab(self):
+        return self.read()[0]
+
+    def read(self):
+        if self.process is None:
+            return False, None
+        data = self.process.stdout.read(self.n_bytes)
+        if len(data) < self.n_bytes:
+            self.check_end()
+            return False, None
+        self.position += 1
+        return True, np.frombuffer(data, np.uint8).reshape(self.shape)
+
+    def release(self):
+        self.stop()
+
+
+READERS = {
+    'opencv': OpenCVReader,
+    'pyav'  : PyAVReader,
+    'ffmpeg': FFmpegReader
+}
+
+
+def open_reader(file_path, backend=None, gray=False, threads=None):
+    """
+    Opens a video with the requested backend, or with OpenCV if this backend is not available.
+
+    Args:
+        file_path: Path of the video.
+        backend  : One of BACKENDS (DEFAULT_BACKEND if None).
+        gray     : Deliver single channel uint8 frames instead of BGR frames.
+        threads  : Number of decoding threads (CODEC_THREADS if None).
+
+    Returns:
+        A reader with the interface of 'cv2.VideoCapture'. Its class tells which backend was actually used.
+    """
+    backend = DEFAULT_BACKEND if backend is None else backend
+    threads = CODEC_THREADS if threads is None else threads
+    if backend not in READERS:
+        raise ValueError(f"ERROR: Unknown video backend: {backend}.")
+    index = get_frame_index(file_path) if os.path.isfile(file_path) else None
+    # OpenCV can't seek exactly in variable frame rate videos, PyAV can with the timestamps of the index.
+    if (backend == "opencv") and (index is not None) and (not index.is_regular()):
+        backend = "pyav"
+    try:
+        return READERS[backend](file_path, gray, threads, index)
+    except (ImportError, IOError) as e:
+        print(f"The backend '{backend}' can't be used ({e}), falling back to OpenCV.")
+        return OpenCVReader(file_path, gray, threads, index)
+
+
+def open_luma(file_path, backend=None, threads=None):
+    """
+    Opens a video file, a mask store (see 'mask_store.MaskStore') or a raw video (see 'raw_video.RawVideo') as a reader delivering single channel uint8 frames.
+    """
+    if is_mask_store(file_path):
+        return MaskCapture(file_path)
+    if is_raw_video(file_path):
+        return RawCapture(file_path)
+    return open_reader(file_path, backend, True, threads)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#                              WRITERS                                #
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+# All the writers have the interface of 'cv2.VideoWriter' (isOpened, write, release).
+# They take BGR frames, or single channel uint8 frames if they are created with 'is_color=False'.
+
+
+class OpenCVWriter(object):
+    """
+    Writer based on 'cv2.VideoWriter'.
+    The number of threads is only supported by OpenCV's built-in MJPEG encoder, it is ignored for the other codecs.
+    """
+    def __init__(self, path, fourcc, fps, size, is_color=True, threads=0):
+        params = [cv2.VIDEOWRITER_PROP_IS_COLOR, int(is_color)]
+        self.writer = None
+        if (threads > 0) and (fourcc == 'MJPG'):
+            self.writer = cv2.VideoWriter(path, cv2.CAP_OPENCV_MJPEG, cv2.VideoWriter_fourcc(*fourcc), fps, size, params + [cv2.VIDEOWRITER_PROP_NSTRIPES, int(threads)])
+        if (self.writer is None) or (not self.writer.isOpened()):
+            self.writer = cv2.VideoWriter(path, cv2.CAP_ANY, cv2.VideoWriter_fourcc(*fourcc), fps, size, params)
+
+    def isOpened(self):
+        return self.writer.isOpened()
+
+    def write(self, frame):
+        self.writer.write(frame)
+
+    def release(self):
+        self.writer.release()
+
+
+class PyAVWriter(object):
+    """
+    Writer based on PyAV. The quality is fixed (qscale) for the JPEG and MPEG-4 codecs.
+
+    Raises:
+        ImportError: If PyAV is not installed.
+    """
+    def __init__(self, path, fourcc, fps, size, is_color=True, threads=0):
+        import av
+        self.av        = av
+        self.format    = "bgr24" if is_color else "gray"
+        self.container = av.open(path, 'w')
+        codec          = FOURCC_CODECS.get(fourcc, 'mpeg4')
+        self.stream    = self.container.add_stream(codec, rate=Fraction(fps).limit_denominator(1001))
+        self.stream.width   = size[0]
+        self.stream.height  = size[1]
+        self.stream.pix_fmt = 'yuvj420p' if codec == 'mjpeg' else 'yuv420p'
+        self.stream.thread_type = "AUTO"
+        if threads > 0:
+            self.stream.codec_context.thread_count = int(threads)
+        if codec in ('mjpeg', 'mpeg4'):
+            self.stream.codec_context.qscale = 2
+
+    def isOpened(self):
+        return self.container is not None
+
+    def write(self, frame):
+        frame = self.av.VideoFrame.from_ndarray(np.ascontiguousarray(frame), format=self.format)
+        for packet in self.stream.encode(frame):
+            self.container.mux(packet)
+
+    def release(self):
+        if self.container is None:
+            return
+        for packet in self.stream.encode():
+            self.container.mux(packet)
+        self.container.close()
+        self.container = None
+
+
+class FFmpegWriter(object):
+    """
+    Writer sending raw frames to the standard input of an ffmpeg process.
+    The error output of ffmpeg is kept in a temporary file: if ffmpeg fails, its end is reported in the raised IOError.
+
+    Raises:
+        IOError: If ffmpeg is not installed.
+    """
+    def __init__(self, path, fourcc, fps, size, is_color=True, threads=0):
+        if FFMPEG is None:
+            raise IOError("ERROR: ffmpeg is not installed.")
+        codec = FOURCC_CODECS.get(fourcc, 'mpeg4')
+        cmd = [
+            FFMPEG, "-v", "error", "-y",
+            "-f", "rawvideo", "-pix_fmt", "bgr24" if is_color else "gray", "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", "-",
+            "-c:v", codec, "-threads", str(threads), "-pix_fmt", 'yuvj420p' if codec == 'mjpeg' else 'yuv420p'
+        ]
+        if codec in ('mjpeg', 'mpeg4'):
+            cmd += ["-q:v", "2"]
+        cmd += [path]
+        self.path    = path
+        self.stderr  = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=self.stderr)
+
+    def isOpened(self):
+        return self.process is not None
+
+    def write(self, frame):
+        """
+        Raises:
+            IOError: If ffmpeg stopped (the writer is released).
+        """
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).tobytes())
+        except BrokenPipeError as e:
+            self.release()
+            raise IOError(f"ERROR: ffmpeg stopped while writing {self.path}.") from e
+
+    def release(self):
+        """
+        Waits for ffmpeg to finish the file.
+
+        Raises:
+            IOError: If ffmpeg returned an error code, with the end of its error output.
+        """
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        code = self.process.wait()
+        self.process = None
+        self.stderr.seek(0)
+        message = self.stderr.read().decode(errors="replace").strip()
+        self.stderr.close()
+        if code != 0:
+            raise IOError(f"ERROR: ffmpeg failed to write {self.path} (return code {code}): {message[-STDERR_TAIL:]}")
+
+
+WRITERS = {
+    'opencv': OpenCVWriter,
+    'pyav'  : PyAVWriter,
+    'ffmpeg': FFmpegWriter
+}
+
+
+def open_writer(file_path, fourcc, fps, size, is_color=True, backend=None, threads=None):
+    """
+    Creates a video file with the requested backend, or with OpenCV if this backend is not available.
+
+    Args:
+        file_path: Path of the new video.
+        fourcc   : FourCC code of the codec, as used by OpenCV (e.g. 'MJPG', translated for the other backends).
+        fps      : Frame rate.
+        size     : (width, height) of the frames.
+        is_color : True for BGR frames, False for single channel frames.
+        backend  : One of BACKENDS (DEFAULT_BACKEND if None).
+        threads  : Number of encoding threads (CODEC_THREADS if None).
+
+    Returns:
+        A writer with the interface of 'cv2.VideoWriter'.
+    """
+    backend = DEFAULT_BACKEND if backend is None else backend
+    threads = CODEC_THREADS if threads is None else threads
+    if backend not in WRITERS:
+        raise ValueError(f"ERROR: Unknown video backend: {backend}.")
+    try:
+        return WRITERS[backend](file_path, fourcc, fps, size, is_color, threads)
+    except (ImportError, IOError) as e:
+        print(f"The backend '{backend}' can't be used ({e}), falling back to OpenCV.")
+        return OpenCVWriter(file_path, fourcc, fps, size, is_color, threads)
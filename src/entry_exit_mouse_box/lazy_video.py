@@ -0,0 +1,130 @@
+import threading
+import cv2
+import numpy as np
+
+# Lazy (T, Y, X) arrays over the frames of a video, a mask store or a raw video, given as is to napari layers.
+# napari only reads the frames it displays (the time index comes from its own dims slider), through '__getitem__'.
+# The frames are decoded by chunks of CHUNK_FRAMES consecutive frames, so a seek is followed by a sequential read rather than another seek.
+# The processed frames are kept in a 'media_manager.FrameCache', under the same keys as the frames pushed by 'MediaManager.set_frame'.
+CHUNK_FRAMES = 8
+
+
+class VideoArray(object):
+    """
+    Read-only array-like view of a video, with the attributes that napari expects from its data (shape, dtype, ndim, __getitem__).
+    Indexing along the first axis decodes the frames, the other axes are sliced in the decoded frames.
+    It can be read from several threads (e.g. by the asynchronous slicing of napari).
+    """
+    def __init__(self, capture, name, cache, process=None, chunk_frames=CHUNK_FRAMES):
+        """
+        Args:
+            capture     : Capture opened with 'media_manager.open_capture'. It is released with the array.
+            name        : Name of the layer, used to address the cache.
+            cache       : FrameCache in which the processed frames are kept.
+            process     : Function applied to each decoded frame. It must always return frames of the same shape and type.
+            chunk_frames: Number of consecutive frames decoded together.
+
+        Raises:
+            IOError: If the first frame can't be read.
+        """
+        self.capture      = capture
+        self.name         = name
+        self.cache        = cache
+        self.process      = process
+        self.chunk_frames = max(1, int(chunk_frames))
+        self.n_frames     = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.position     = -1 # Index of the next frame that the capture will read.
+        self.lock         = threading.Lock()
+        first = self.get_frame(0)
+        if first is None:
+            raise IOError("ERROR: Failed to read frame.")
+        self.shape = (self.n_frames,) + first.shape
+        self.dtype = first.dtype
+        self.ndim  = len(self.shape)
+
+    def __len__(self):
+        return self.n_frames
+
+    def __array__(self, dtype=None, copy=None):
+        # Converting the whole array would decode the whole video in memory: only slices can be read.
+        raise TypeError(f"ERROR: The video {self.name} ({self.n_frames} frames) can't be converted as a whole, index it instead.")
+
+    def read_chunk(self, index):
+        """
+        Decodes the chunk containing the frame 'index' into the cache. The frames that are already cached are only grabbed.
+
+        Returns:
+            The processed frame 'index' if it was decoded (even if the cache was discarded meanwhile), None otherwise.
+        """
+        start = index // self.chunk_frames * self.chunk_frames
+        end   = min(start + self.chunk_frames, self.n_frames)
+        generation = self.cache.generation
+        wanted = None
+        if self.position != start:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        for i in range(start, end):
+            if (self.name, i) in self.cache:
+                ret = self.capture.grab()
+            else:
+                ret, frame = self.capture.read()
+                if ret:
+                    if self.process is not None:
+                        frame = self.process(frame)
+                    self.cache.put((self.name, i), frame, generation)
+                    if i == index:
+                        wanted = frame
+            if not ret:
+                self.position = -1
+                return wanted
+            self.position = i + 1
+        return wanted
+
+    def get_frame(self, index):
+        """
+        Returns the processed frame 'index', or None if it can't be read.
+        """
+        frame = self.cache.get((self.name, index))
+        if frame is not None:
+            return frame
+        with self.lock:
+            # Another thread may have decoded it in the meantime.
+            frame = self.cache.get((self.name, index))
+            if (frame is None) and (self.capture is not None):
+                frame = self.read_chunk(index)
+                if frame is None:
+                    frame = self.cache.get((self.name, index))
+        return frame
+
+    def frame(self, index):
+        # A frame that can't be decoded is displayed as a black frame rather than interrupting napari.
+        frame = self.get_frame(index)
+        if frame is None:
+            print(f"ERROR: Failed to read frame {index} of {self.name}.")
+            return np.zeros(self.shape[1:], self.dtype)
+        return frame
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = next(i for i, k in enumerate(key) if k is Ellipsis)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i+1:]
+        time, rest = key[0], key[1:]
+
+        if isinstance(time, (int, np.integer)):
+            index = int(time) + (self.n_frames if time < 0 else 0)
+            if (index < 0) or (index >= self.n_frames):
+                raise IndexError(f"ERROR: Frame {time} out of range ({self.n_frames} frames).")
+            return self.frame(index)[rest]
+
+        indices = np.arange(self.n_frames)[time]
+        frames  = [self.frame(int(i)) for i in indices]
+        if len(frames) == 0:
+            return np.zeros((0,) + self.shape[1:], self.dtype)[(slice(None),) + rest]
+        return np.stack(frames)[(slice(None),) + rest]
+
+    def release(self):
+        with self.lock:
+            if self.capture is not None:
+                self.capture.release()
+            self.capture = None
@@ -0,0 +1,86 @@
+import os
+import time
+import numpy as np
+import tifffile
+from qtpy.QtCore import QObject, Signal
+from entry_exit_mouse_box.mask_from_video import MaskFromBackground, MEMORY_BUDGET
+from entry_exit_mouse_box.measures import MiceVisibilityProcessor, labels_centroids
+
+
+class MaskAndMeasures(MaskFromBackground):
+    """
+    Single pass version of 'MaskFromBackground' followed by 'MiceVisibilityProcessor'.
+    Each worker reduces its masks to the per-box visibility and centroids as soon as they are computed.
+    The masks are never encoded and decoded again, writing them to a mask store is optional.
+    In ROI mode, both the masks and the centroids are only processed in the bounding rectangle of each box.
+    """
+    def __init__(self, input_video_path, ref, tr, st, r, ma, duration, output_video_path=None, frame_count=64, roi=False, method="skimage", memory_budget=MEMORY_BUDGET):
+        super().__init__(input_video_path, output_video_path, ref, tr, st, r, frame_count, roi=roi, method=method, memory_budget=memory_budget)
+        self.measures = MiceVisibilityProcessor(None, self.regions, ma, st, duration, n_frames=self.ttl_frames, fps=self.fps)
+        self.n_labels = len(self.measures.box_ids)
+
+    def consume_masks(self, index, masks):
+        super().consume_masks(index, masks)
+        visibility, centroids = labels_centroids(np.array(masks, dtype=bool), self.regions, self.n_labels, self.rois)
+        self.measures.record_visibility(index, visibility, centroids)
+
+    def start_processing(self, num_workers=16):
+        """
+        Builds the masks and the measures.
+
+        Returns:
+            The same tuple as the payload of 'QtWorkerMVP.measures_ready': (visibility, centroids, sessions).
+        """
+        super().start_processing(num_workers)
+        self.measures.process_measures()
+        return self.measures.instant_visibility, self.measures.instant_centroids, self.measures.all_sessions
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+class QtWorkerMAM(QObject):
+
+    measures_ready = Signal(np.ndarray, np.ndarray, dict)
+
+    def __init__(self, in_path, ref, t, s, r, ma, duration, out_path=None, roi=False, method="skimage", memory_budget=MEMORY_BUDGET):
+        super().__init__()
+        self.in_path    = in_path
+        self.out_path   = out_path
+        self.ref        = ref
+        self.threshold  = t
+        self.start      = s
+        self.regions    = r
+        self.min_length = ma
+        self.duration   = duration
+        self.roi        = roi
+        self.method     = method
+        self.budget     = memory_budget
+        # Statistics of the last run, to be logged.
+        self.peak_buffered = 0
+        self.max_in_flight = 0
+
+    def run(self):
+        mam = MaskAndMeasures(self.in_path, self.ref, self.threshold, self.start, self.regions, self.min_length, self.duration, self.out_path, roi=self.roi, method=self.method, memory_budget=self.budget)
+        visibility, centroids, all_sessions = mam.start_processing()
+        mam.release_resources()
+        self.peak_buffered = mam.peak_buffered
+        self.max_in_flight = mam.max_in_flight
+        self.measures_ready.emit(visibility, centroids, all_sessions)
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+if __name__ == "__main__":
+    directory = "/home/benedetti/Documents/projects/25-entry-exit-mouse-monitor/data-samples/"
+    name      = "WIN_20210830_11_11_50_Pro.mp4"
+    full_path = os.path.join(directory, name)
+    ref       = tifffile.imread("/home/benedetti/Desktop/mean-test.tif")
+    areas     = tifffile.imread("/home/benedetti/Desktop/labeled-areas.tif")
+
+    start_time = time.time()
+    processor = MaskAndMeasures(full_path, ref, 75, {1: 820}, areas, 55, int(5*60*59.617))
+    processor.start_processing()
+    processor.release_resources()
+    print(f"The code block took {time.time() - start_time} seconds to execute.")
@@ -1,5 +1,6 @@
 
 import cv2
+import bisect
 import threading
 import os
 import tifffile
@@ -8,21 +9,55 @@ from concurrent.futures import ThreadPoolExecutor
 import time
 from skimage.morphology import opening, closing
 from qtpy.QtCore import QThread, QObject, QTimer, Qt, Signal, Slot
+from entry_exit_mouse_box.mask_store import MaskStore
+from entry_exit_mouse_box.frame_source import open_luma, open_writer, to_gray
+from entry_exit_mouse_box.utils import label_rois
+
+# A 3x3 opening followed by a 3x3 closing makes each pixel depend on its neighbors up to 4 pixels away.
+ROI_MARGIN = 4
+# Default amount of memory that the batches in flight (decoded frames + masks) are allowed to use.
+MEMORY_BUDGET = 2 * 1024**3
 
 class MaskFromBackground(object):
-    def __init__(self, input_video_path, output_video_path, ref, tr=75, st={}, r=None, frame_count=64):
+    """
+    Builds the mask of the mice (0=BG, 1=FG) by thresholding the difference between each frame and the background reference.
+    Masks are saved in a bit-packed mask store (see 'mask_store.MaskStore'), unless 'output_video_path' is None.
+    An AVI version of the masks can also be written for visual export, if 'export_path' is provided.
+    In ROI mode ('roi=True'), the frames are only processed in the bounding rectangle of each labeled area (with a margin).
+    As everything outside of the areas is discarded anyway, the result is the same.
+    The mice can be detected with scikit-image on float32 images ('method="skimage"') or with OpenCV on uint8 images ('method="opencv"').
+    Both give the same masks for a uint8 reference, but the OpenCV path releases the GIL so the workers actually run in parallel.
+    The batches are retired in order. A reader blocks as long as 'max_in_flight' batches are read but not retired yet.
+    By default, 'max_in_flight' is deduced from 'memory_budget' (in bytes).
+    """
+    def __init__(self, input_video_path, output_video_path, ref, tr=75, st={}, r=None, frame_count=64, export_path=None, roi=False, method="skimage", memory_budget=MEMORY_BUDGET, max_in_flight=None):
         self.input_video_path = input_video_path
         self.output_video_path = output_video_path
         self.frame_count = frame_count
         self.reference = ref
-        self.video = cv2.VideoCapture(input_video_path)
+        self.video = open_luma(input_video_path)
         self.ttl_frames = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
         fps = round(self.video.get(cv2.CAP_PROP_FPS))
         self.processed_frames = {}
         self.lock = threading.Lock()
         self.condition = threading.Condition(self.lock)
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        self.video_out = cv2.VideoWriter(output_video_path, fourcc, fps, (ref.shape[1], ref.shape[0]), isColor=False)
+        self.fps = fps
+        self.mask_store = None
+        if output_video_path is not None:
+            self.mask_store = MaskStore(output_video_path, 'w', self.ttl_frames, ref.shape[0:2], fps)
+        self.video_out = None
+        if export_path is not None:
+            self.video_out = open_writer(export_path, 'XVID', fps, (ref.shape[1], ref.shape[0]), is_color=False)
+        self.n_done = 0
+        self.exhausted = False
+        # The first frame gives the size of the decoded frames (single channel with a luma reader). It is kept for the first batch.
+        ret, frame = self.video.read()
+        self.first_frame = frame if ret else None
+        frame_bytes = frame.nbytes if ret else ref.shape[0] * ref.shape[1]
+        # A batch in flight holds its frames and its boolean masks.
+        batch_bytes = frame_count * (frame_bytes + ref.shape[0] * ref.shape[1])
+        self.max_in_flight = max(1, int(memory_budget // batch_bytes)) if max_in_flight is None else max(1, int(max_in_flight))
+        self.peak_buffered = 0
         self.threshold = tr
         self.expected_index = 0
         self.current_index = 0
@@ -30,6 +65,15 @@ class MaskFromBackground(object):
         self.start = st
         self.reader_pos = 0
         self.regions = np.zeros((ref.shape[0], ref.shape[1]), np.uint8) if r is None else r
+        self.rois = label_rois(self.regions, ROI_MARGIN) if roi else None
+        self.build_activation_schedule()
+        if method not in ("skimage", "opencv"):
+            raise ValueError(f"ERROR: Unknown detection method: {method}")
+        self.method = method
+        self.reference_u8 = ref if ref.dtype == np.uint8 else np.clip(np.rint(ref), 0, 255).astype(np.uint8)
+        self.kernel = np.ones((3, 3), np.uint8)
+        # Per-thread output buffers for the OpenCV path, indexed by shape.
+        self.buffers = threading.local()
 
     def read_frames(self):
         frames = []
@@ -37,9 +81,12 @@ class MaskFromBackground(object):
         p2 = p1 + self.frame_count
         self.reader_pos = p2
         for _ in range(self.frame_count):
-            ret, frame = self.video.read()
-            if not ret:
-                break
+            if self.first_frame is not None:
+                frame, self.first_frame = self.first_frame, None
+            else:
+                ret, frame = self.video.read()
+                if not ret:
+                    break
             frames.append(frame)
         return (p1, p2), frames
 
@@ -49,24 +96,103 @@ class MaskFromBackground(object):
             if batch[0] + i < self.start:
                 diff = np.zeros(self.reference.shape[0:2], bool)
             else:
-                processed_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).astype(np.float32)
+                processed_frame = to_gray(frame).astype(np.float32)
                 diff = np.abs(processed_frame - self.reference) > self.threshold
             buffer_out.append(diff)
         return buffer_out
     
+    def build_activation_schedule(self):
+        """
+        Precomputes everything needed to know which areas are active at a given frame.
+        'schedule' contains the sorted frames at which the set of active areas changes.
+        For each span between two frames of the schedule, we keep the union of the active areas (full frame mode) or the list of active labels (ROI mode).
+        """
+        self.schedule = sorted(set(self.start.values()))
+        self.active_labels = [[]]
+        for frame in self.schedule:
+            self.active_labels.append(sorted(lbl for lbl, start in self.start.items() if start <= frame))
+
+        if self.rois is not None:
+            self.roi_masks = {lbl: self.regions[y0:y1, x0:x1] == lbl for lbl, (y0, y1, x0, x1) in self.rois.items()}
+            return
+
+        region_masks = {lbl: self.regions == lbl for lbl in self.start.keys()}
+        self.active_masks = []
+        for labels in self.active_labels:
+            mask = np.zeros(self.reference.shape[0:2], bool)
+            for lbl in labels:
+                mask |= region_masks[lbl]
+            self.active_masks.append(mask)
+
+    def get_schedule_index(self, pos):
+        """
+        Returns the index, in 'active_labels' and 'active_masks', of the areas active at the frame 'pos'.
+        """
+        return bisect.bisect_right(self.schedule, pos)
+
+    def detect_mice(self, frame, y0=0, y1=None, x0=0, x1=None):
+        """
+        Thresholds the difference between a single channel (luma) frame, as read by 'open_luma', and the background reference, and cleans it with an opening and a closing.
+        A BGR frame is also accepted, it is converted to grayscale first.
+        Works the same way on the full frame or on the crop [y0:y1, x0:x1] of the frame.
+
+        Returns:
+            A mask (bool or uint8) in which the non-zero pixels are the mice.
+            With the OpenCV path, the mask is a buffer reused by the next call of the same thread.
+        """
+        frame = frame[y0:y1, x0:x1]
+        if self.method == "opencv":
+            return self.detect_mice_cv2(frame, self.reference_u8[y0:y1, x0:x1])
+        return self.detect_mice_skimage(frame, self.reference[y0:y1, x0:x1])
+
+    def get_buffers(self, shape):
+        """
+        Returns three uint8 buffers of the given shape, allocated once per thread.
+        """
+        if not hasattr(self.buffers, 'by_shape'):
+            self.buffers.by_shape = {}
+        if shape not in self.buffers.by_shape:
+            self.buffers.by_shape[shape] = tuple(np.empty(shape, np.uint8) for _ in range(3))
+        return self.buffers.by_shape[shape]
+
+    def detect_mice_cv2(self, frame, reference):
+        gray, diff, mice = self.get_buffers(frame.shape[0:2])
+        # Luma frames are used directly, without any copy.
+        gray = frame if frame.ndim == 2 else to_gray(frame, gray)
+        cv2.absdiff(gray, reference, dst=diff)
+        cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY, dst=mice)
+        cv2.morphologyEx(mice, cv2.MORPH_OPEN, self.kernel, dst=diff)
+        cv2.morphologyEx(diff, cv2.MORPH_CLOSE, self.kernel, dst=mice)
+        return mice
+
+    def detect_mice_skimage(self, frame, reference):
+        bw_frame = to_gray(frame).astype(np.float32)
+        mice = np.abs(bw_frame - reference) > self.threshold
+        mice  = opening(mice, np.ones((3, 3), np.uint8))
+        mice  = closing(mice, np.ones((3, 3), np.uint8))
+        return mice > 0
+
     def process_frames(self, batch, frames):
+        if self.rois is not None:
+            return self.process_frames_roi(batch, frames)
         buffer_out = []
         for i, frame in enumerate(frames):
-            bw_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).astype(np.float32)
-            mask = np.zeros(bw_frame.shape, bool)
-            pos = batch[0] + i
-            for lbl, start in self.start.items():
-                if pos >= start:
-                    mask[self.regions == lbl] = True
-            mice = np.abs(bw_frame - self.reference) > self.threshold
-            mice  = opening(mice, np.ones((3, 3), np.uint8))
-            mice  = closing(mice, np.ones((3, 3), np.uint8))
-            diff = np.logical_and(mice > 0, mask)
+            mask = self.active_masks[self.get_schedule_index(batch[0] + i)]
+            mice = self.detect_mice(frame)
+            diff = np.logical_and(mice, mask)
+            buffer_out.append(diff)
+        return buffer_out
+
+    def process_frames_roi(self, batch, frames):
+        buffer_out = []
+        for i, frame in enumerate(frames):
+            diff = np.zeros(self.reference.shape[0:2], bool)
+            for lbl in self.active_labels[self.get_schedule_index(batch[0] + i)]:
+                if lbl not in self.rois:
+                    continue
+                y0, y1, x0, x1 = self.rois[lbl]
+                mice = self.detect_mice(frame, y0, y1, x0, x1)
+                diff[y0:y1, x0:x1] |= np.logical_and(mice, self.roi_masks[lbl])
             buffer_out.append(diff)
         return buffer_out
 
@@ -75,24 +201,49 @@ class MaskFromBackground(object):
             frames = None
             launch_index = 0
 
-            with self.lock:
+            with self.condition:
+                # Backpressure: we don't read further than 'max_in_flight' batches ahead of the last retired one.
+                while (not self.exhausted) and (self.current_index - self.expected_index >= self.max_in_flight):
+                    self.condition.wait()
+                if self.exhausted:
+                    break
                 batch, frames = self.read_frames()
+                if not frames:
+                    self.exhausted = True
+                    self.condition.notify_all()
+                    break
                 launch_index = self.current_index
                 self.current_index += 1
-            
-            if not frames:
-                break
 
             processed_frames = self.process_frames(batch, frames)
+            self.consume_masks(batch[0], processed_frames)
 
             with self.condition:
-                self.processed_frames[launch_index] = processed_frames
-                while self.processed_frames.get(self.expected_index):
-                        print(f"{self.expected_index+1}/{self.total}")
-                        self.add_frames_to_video(self.processed_frames.pop(self.expected_index))
-                        self.expected_index += 1
+                self.n_done += 1
+                print(f"{self.n_done}/{self.total}")
+                # The batches are retired in order: a batch finished early stays buffered until the previous ones are done.
+                # The AVI export requires the frames to be written in order, the masks are only kept if they have to be exported.
+                self.processed_frames[launch_index] = processed_frames if self.video_out is not None else None
+                self.peak_buffered = max(self.peak_buffered, len(self.processed_frames))
+                while self.expected_index in self.processed_frames:
+                    frames_out = self.processed_frames.pop(self.expected_index)
+                    if frames_out is not None:
+                        self.add_frames_to_video(frames_out)
+                    self.expected_index += 1
                 self.condition.notify_all()
 
+    def consume_masks(self, index, masks):
+        """
+        Called by the workers with each batch of masks, in any order.
+        Each batch has its own place in the store, no need to wait for the previous ones.
+
+        Args:
+            index: Index of the first frame of the batch.
+            masks: List of boolean masks.
+        """
+        if self.mask_store is not None:
+            self.mask_store.write(index, masks)
+
     def add_frames_to_video(self, frames):
         for frame in frames:
             self.video_out.write(np.uint8(frame * 255))
@@ -102,10 +253,14 @@ class MaskFromBackground(object):
             futures = [executor.submit(self.worker) for _ in range(num_workers)]
             for future in futures:
                 future.result()
+        print(f"Peak buffered batches: {self.peak_buffered} (max in flight: {self.max_in_flight})")
 
     def release_resources(self):
         self.video.release()
-        self.video_out.release()
+        if self.mask_store is not None:
+            self.mask_store.release()
+        if self.video_out is not None:
+            self.video_out.release()
         
 
 
@@ -116,18 +271,28 @@ class QtWorkerMFV(QObject):
 
     mask_ready = Signal(str)
 
-    def __init__(self, in_path, out_path, ref, t, s, r):
+    def __init__(self, in_path, out_path, ref, t, s, r, export_path=None, roi=False, method="skimage", memory_budget=MEMORY_BUDGET):
         super().__init__()
-        self.in_path   = in_path
-        self.out_path  = out_path
-        self.ref       = ref
-        self.threshold = t
-        self.start     = s
-        self.regions   = r
+        self.in_path     = in_path
+        self.out_path    = out_path
+        self.ref         = ref
+        self.threshold   = t
+        self.start       = s
+        self.regions     = r
+        self.export_path = export_path
+        self.roi         = roi
+        self.method      = method
+        self.budget      = memory_budget
+        # Statistics of the last run, to be logged.
+        self.peak_buffered = 0
+        self.max_in_flight = 0
 
     def run(self):
-        mfb = MaskFromBackground(self.in_path, self.out_path, self.ref, self.threshold, self.start, self.regions)
+        mfb = MaskFromBackground(self.in_path, self.out_path, self.ref, self.threshold, self.start, self.regions, export_path=self.export_path, roi=self.roi, method=self.method, memory_budget=self.budget)
         mfb.start_processing()
+        mfb.release_resources()
+        self.peak_buffered = mfb.peak_buffered
+        self.max_in_flight = mfb.max_in_flight
         self.mask_ready.emit(self.out_path)
 
 
@@ -138,12 +303,13 @@ if __name__ == "__main__":
     directory = "/home/benedetti/Documents/projects/25-entry-exit-mouse-monitor/data-samples/"
     name      = "WIN_20210830_11_11_50_Pro.mp4"
     full_path = os.path.join(directory, name)
-    out_path  = os.path.join(directory, "test-mask-2.avi")
+    out_path  = os.path.join(directory, "test-mask-2.bin")
     ref = tifffile.imread("/home/benedetti/Desktop/mean-test.tif")
     
     start_time = time.time()
     processor = MaskFromBackground(full_path, out_path, ref)
     processor.start_processing()
+    processor.release_resources()
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"The code block took {elapsed_time} seconds to execute.")
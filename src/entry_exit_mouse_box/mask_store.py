@@ -0,0 +1,274 @@
+import os
+import sys
+import cv2
+import numpy as np
+import tifffile
+
+# Header written at the beginning of a mask store, followed by the packed frames.
+HEADER_DTYPE = np.dtype([
+    ('magic'   , 'S8'),
+    ('version' , '<u4'),
+    ('n_frames', '<u4'),
+    ('height'  , '<u4'),
+    ('width'   , '<u4'),
+    ('fps'     , '<f8')
+])
+HEADER_SIZE = 64
+MAGIC       = b"EEMBMASK"
+VERSION     = 1
+# The previous versions saved the masks as a video ('mask.avi', 0=BG, 255=FG), or as a TIFF stack.
+# These files are still accepted by every reader (the frames are thresholded), and 'import_legacy_mask' converts them to a mask store.
+LEGACY_THRESHOLD = 127
+# Number of legacy masks converted at once by 'import_legacy_mask'.
+IMPORT_BATCH = 64
+
+
+def is_mask_store(path):
+    """
+    Checks whether a file is a mask store by reading its magic number.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class MaskStore(object):
+    """
+    Stores a sequence of binary masks in a memory-mapped file, with 1 bit per pixel.
+    Each row of each frame is packed with 'np.packbits', so the storage is exact (no compression artifact) and any frame can be accessed without decoding.
+    The file starts with a small header (see HEADER_DTYPE) giving the number of frames, the shape of the frames and the FPS.
+    Different threads can write different frames at the same time.
+    """
+    def __init__(self, path, mode='r', n_frames=0, shape=(0, 0), fps=0.0):
+        """
+        Opens (mode='r') or creates (mode='w') a mask store.
+
+        Args:
+            path    : Path of the file.
+            mode    : 'r' to read an existing store, 'r+' to edit it, 'w' to create a new one.
+            n_frames: Number of frames of the new store (only used with mode='w').
+            shape   : (height, width) of the frames of the new store (only used with mode='w').
+            fps     : Frame rate of the new store (only used with mode='w').
+
+        Raises:
+            IOError: If the file is not a mask store.
+        """
+        self.path = path
+        if mode == 'w':
+            header = np.zeros(1, HEADER_DTYPE)
+            header['magic']    = MAGIC
+            header['version']  = VERSION
+            header['n_frames'] = int(n_frames)
+            header['height']   = int(shape[0])
+            header['width']    = int(shape[1])
+            header['fps']      = float(fps)
+            n_bytes = int(n_frames) * int(shape[0]) * ((int(shape[1]) + 7) // 8)
+            with open(path, "wb") as f:
+                f.write(header.tobytes().ljust(HEADER_SIZE, b'\0'))
+                f.truncate(HEADER_SIZE + n_bytes)
+        else:
+            header = np.fromfile(path, HEADER_DTYPE, count=1)
+            if len(header) == 0 or header['magic'][0] != MAGIC:
+                raise IOError(f"ERROR: {path} is not a mask store.")
+            if int(header['version'][0]) != VERSION:
+                raise IOError(f"ERROR: Unsupported mask store version: {int(header['version'][0])}.")
+
+        self.n_frames = int(header['n_frames'][0])
+        self.height   = int(header['height'][0])
+        self.width    = int(header['width'][0])
+        self.fps      = float(header['fps'][0])
+        self.shape    = (self.height, self.width)
+        packed_shape  = (self.n_frames, self.height, (self.width + 7) // 8)
+        if self.n_frames == 0:
+            self.data = np.zeros(packed_shape, np.uint8)
+        else:
+            self.data = np.memmap(path, np.uint8, 'r' if mode == 'r' else 'r+', HEADER_SIZE, packed_shape)
+
+    def __len__(self):
+        return self.n_frames
+
+    def write(self, index, masks):
+        """
+        Writes a batch of masks starting at the frame 'index'.
+        Frames beyond the end of the store are ignored.
+
+        Args:
+            index: Index of the first frame to write.
+            masks: Boolean array of shape (n, height, width) or a single (height, width) mask.
+        """
+        masks = np.asarray(masks, dtype=bool)
+        if masks.ndim == 2:
+            masks = masks[np.newaxis]
+        count = max(0, min(len(masks), self.n_frames - index))
+        if count == 0:
+            return
+        self.data[index:index+count] = np.packbits(masks[:count], axis=-1)
+
+    def read(self, index, count=None):
+        """
+        Reads masks from the store.
+
+        Args:
+            index: Index of the first frame to read.
+            count: Number of frames to read. If None, a single (height, width) mask is returned.
+
+        Returns:
+            A boolean array of shape (count, height, width), or (height, width) if count is None.
+        """
+        if count is None:
+            return np.unpackbits(self.data[index], axis=-1, count=self.width).astype(bool)
+        return np.unpackbits(self.data[index:index+count], axis=-1, count=self.width).astype(bool)
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+    def release(self):
+        self.flush()
+        self.data = None
+
+
+class MaskCapture(object):
+    """
+    Read-only view of a mask store imitating the interface of 'cv2.VideoCapture'.
+    It allows the MediaManager to use a mask store as any other video source.
+    Frames are returned as single channel uint8 images (0=BG, 255=FG).
+    """
+    def __init__(self, path):
+        self.store    = MaskStore(path, 'r')
+        self.position = 0
+
+    def isOpened(self):
+        return self.store is not None
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.store.n_frames)
+        if prop == cv2.CAP_PROP_FPS:
+            return self.store.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.store.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.store.height)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        return 0.0
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.position = int(value)
+        return True
+
+    def grab(self):
+        if self.position < 0 or self.position >= self.store.n_frames:
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        if self.position < 0 or self.position >= self.store.n_frames:
+            return False, None
+        frame = self.store.read(self.position).astype(np.uint8) * 255
+        self.position += 1
+        return True, frame
+
+    def release(self):
+        if self.store is not None:
+            self.store.release()
+        self.store = None
+
+
+def legacy_mask_size(path):
+    """
+    Counts the frames of a mask saved as a video or as a TIFF stack by the previous versions, without decoding them.
+    The frame count in the header of a video can't be trusted, the frames are grabbed once to count them.
+
+    Returns:
+        A tuple (n_frames, (height, width)).
+    """
+    if path.lower().endswith((".tif", ".tiff")):
+        with tifffile.TiffFile(path) as tif:
+            shape = tif.series[0].shape
+        return (1 if len(shape) == 2 else shape[0]), tuple(shape[-2:])
+    video = cv2.VideoCapture(path)
+    if not video.isOpened():
+        raise IOError(f"ERROR: Failed to open {path}.")
+    shape = (int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(video.get(cv2.CAP_PROP_FRAME_WIDTH)))
+    n_frames = 0
+    while video.grab():
+        n_frames += 1
+    video.release()
+    return n_frames, shape
+
+
+def read_legacy_masks(path):
+    """
+    Yields the boolean masks of a mask saved as a video or as a TIFF stack by the previous versions, one frame at a time.
+    """
+    if path.lower().endswith((".tif", ".tiff")):
+        with tifffile.TiffFile(path) as tif:
+            # A page can hold several planes (a small stack may be saved as one page with separate samples).
+            for page in tif.pages:
+                planes = page.asarray()
+                for frame in (planes if planes.ndim == 3 else planes[np.newaxis]):
+                    yield frame > LEGACY_THRESHOLD
+        return
+    video = cv2.VideoCapture(path)
+    if not video.isOpened():
+        raise IOError(f"ERROR: Failed to open {path}.")
+    while True:
+        ret, frame = video.read()
+        if not ret:
+            break
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        yield frame > LEGACY_THRESHOLD
+    video.release()
+
+
+def import_legacy_mask(path, store_path=None, fps=None, batch_size=IMPORT_BATCH):
+    """
+    Converts a mask saved as a video or as a TIFF stack ('mask.avi', 'mask.tif') to a mask store.
+    The store is sized by a first counting pass, the masks are then written by batches: the legacy mask is never fully loaded.
+
+    Args:
+        path      : Path of the legacy mask.
+        store_path: Path of the new mask store, next to the legacy mask by default ('mask.avi' -> 'mask.bin').
+        fps       : Frame rate of the store. By default, the one of the video (0 for a TIFF stack).
+        batch_size: Number of masks written at once.
+
+    Returns:
+        The path of the mask store.
+    """
+    if store_path is None:
+        store_path = os.path.splitext(path)[0] + ".bin"
+    if fps is None:
+        video = cv2.VideoCapture(path)
+        fps = video.get(cv2.CAP_PROP_FPS) if video.isOpened() else 0.0
+        video.release()
+    n_frames, shape = legacy_mask_size(path)
+    if n_frames == 0:
+        raise IOError(f"ERROR: No mask found in {path}.")
+    store = MaskStore(store_path, 'w', n_frames, shape, fps)
+    index, batch = 0, []
+    for mask in read_legacy_masks(path):
+        batch.append(mask)
+        if len(batch) == batch_size:
+            store.write(index, batch)
+            index += len(batch)
+            batch = []
+    if batch:
+        store.write(index, batch)
+    store.release()
+    return store_path
+
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+
+if __name__ == "__main__":
+    # Usage: python -m entry_exit_mouse_box.mask_store mask_1.avi [mask_2.tif ...]
+    for path in sys.argv[1:]:
+        print(f"{path} -> {import_legacy_mask(path)}")
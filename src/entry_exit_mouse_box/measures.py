@@ -4,31 +4,126 @@ import cv2
 import numpy as np
 import time
 import os
-from skimage.measure import regionprops
+from entry_exit_mouse_box.utils import masked_moving_average, label_rois, split_frame_ranges
+from entry_exit_mouse_box.mask_store import MaskStore, is_mask_store
+from entry_exit_mouse_box.frame_source import open_luma, to_gray
 
-N_THREADS = int(min(4, os.cpu_count() // 2))
+# At least one thread, even on a single core machine.
+N_THREADS = max(1, int(min(4, (os.cpu_count() or 1) // 2)))
+BATCH_SIZE = 64
 print(f"Using {N_THREADS} threads.")
 
+
+def labels_centroids(masks, labels, n_labels, rois=None):
+    """
+    Computes, for a batch of masks, in which labeled areas some foreground is present and the centroid of this foreground.
+    It gives the same results as running `regionprops` on `masks * labels` for each frame, but with a few `np.bincount` calls for the whole batch.
+
+    Args:
+        masks   : Boolean array of shape (n_frames, height, width) (or a single (height, width) frame).
+        labels  : Array of shape (height, width) containing one value per box (0=BG).
+        n_labels: Number of labels (boxes). Labels are expected to range from 1 to n_labels.
+        rois    : Optional bounding rectangles of the labels, as produced by 'utils.label_rois'.
+                  If provided, only the pixels inside these rectangles are processed.
+
+    Returns:
+        A tuple (visibility, centroids):
+            - visibility: Boolean array of shape (n_frames, n_labels), True if the label contains foreground.
+            - centroids : Float array of shape (n_frames, n_labels, 2) containing the (y, x) centroids, -1 where there is no foreground.
+    """
+    masks = np.asarray(masks, dtype=bool)
+    if masks.ndim == 2:
+        masks = masks[np.newaxis]
+    n_frames = masks.shape[0]
+    if rois is not None:
+        return labels_centroids_roi(masks, labels, n_labels, rois)
+    n_bins = n_frames * (n_labels + 1)
+
+    # Labels above 'n_labels' are ignored, as in the ROI mode.
+    frames, ys, xs = np.nonzero(np.logical_and(masks, np.logical_and(labels > 0, labels <= n_labels)))
+    keys = frames * (n_labels + 1) + labels[ys, xs].astype(np.intp)
+
+    counts = np.bincount(keys, minlength=n_bins).reshape(n_frames, n_labels + 1)[:, 1:]
+    sum_y  = np.bincount(keys, weights=ys, minlength=n_bins).reshape(n_frames, n_labels + 1)[:, 1:]
+    sum_x  = np.bincount(keys, weights=xs, minlength=n_bins).reshape(n_frames, n_labels + 1)[:, 1:]
+
+    visibility = counts > 0
+    centroids  = np.full((n_frames, n_labels, 2), -1.0)
+    centroids[visibility, 0] = sum_y[visibility] / counts[visibility]
+    centroids[visibility, 1] = sum_x[visibility] / counts[visibility]
+    return visibility, centroids
+
+
+def labels_centroids_roi(masks, labels, n_labels, rois):
+    """
+    Same as 'labels_centroids' but each label is only searched in its bounding rectangle.
+    """
+    n_frames   = masks.shape[0]
+    visibility = np.zeros((n_frames, n_labels), bool)
+    centroids  = np.full((n_frames, n_labels, 2), -1.0)
+    for lbl, (y0, y1, x0, x1) in rois.items():
+        if lbl < 1 or lbl > n_labels:
+            continue
+        crop   = np.logical_and(masks[:, y0:y1, x0:x1], labels[y0:y1, x0:x1] == lbl)
+        counts = crop.sum(axis=(1, 2))
+        sum_y  = crop.sum(axis=2) @ np.arange(y0, y1)
+        sum_x  = crop.sum(axis=1) @ np.arange(x0, x1)
+        found  = counts > 0
+        visibility[:, lbl-1] = found
+        centroids[found, lbl-1, 0] = sum_y[found] / counts[found]
+        centroids[found, lbl-1, 1] = sum_x[found] / counts[found]
+    return visibility, centroids
+
+
+def run_length_encode(values):
+    """
+    Run-length encodes a 1D array (ex: the visibility timeline of a box).
+
+    Args:
+        values: 1D array.
+
+    Returns:
+        A tuple (starts, lengths, states) of arrays, one element per run:
+            - starts : Index of the first element of the run.
+            - lengths: Number of elements in the run.
+            - states : Value shared by all the elements of the run.
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.zeros(0, np.intp), np.zeros(0, np.intp), values[:0].copy()
+    starts  = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+    lengths = np.diff(np.append(starts, len(values)))
+    return starts, lengths, values[starts]
+
+
 class MiceVisibilityProcessor(object):
     """
     Calculates an array indicating for each box (designated by the labels in 'areas') if a mouse is inside or not.
     The process is realized on several threads.
-    The input video was saved as a mask (0=BG, 255=FG) but it requires thresholding anyway due to compression.
+    The input is a mask store (see 'mask_store.MaskStore') read without any decoding.
+    A mask saved as a video (0=BG, 255=FG) is also accepted, but it requires thresholding due to compression.
     The areas are a grayscale image with one value per box (0=BG).
     To process the presence of a mouse, we use the length of the ellipse fitted to the mouse's label.
     It requires the input image to be calibrated.
     The process doesn't start from the frame 0 but from the frame 'start'.
     We don't need a control structure to write in the buffer as the threads are not writing in the same place.
+    If 'mask_path' is None, no mask is read: the visibility and centroids are provided by the caller through 'record_visibility'.
+    In this case, 'n_frames' and 'fps' must be provided.
+    In ROI mode ('roi=True'), the masks are only processed in the bounding rectangle of each box.
     """
-    def __init__(self, mask_path, areas, ma, start, duration):
+    def __init__(self, mask_path, areas, ma, start, duration, n_frames=None, fps=None, roi=False):
         self.video_path      = mask_path
         self.track_duration  = int(duration)
-        self.video_stream    = cv2.VideoCapture(mask_path)
+        self.mask_store      = MaskStore(mask_path, 'r') if (mask_path is not None and is_mask_store(mask_path)) else None
+        self.video_stream    = None
+        if mask_path is not None:
+            self.video_stream = open_luma(mask_path)
         self.lock            = threading.Lock()
         self.labeled_boxes   = areas
-        self.n_frames        = int(self.video_stream.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.fps             = round(self.video_stream.get(cv2.CAP_PROP_FPS))
+        self.n_frames        = int(self.video_stream.get(cv2.CAP_PROP_FRAME_COUNT)) if n_frames is None else int(n_frames)
+        self.fps             = round(self.video_stream.get(cv2.CAP_PROP_FPS)) if fps is None else round(fps)
         self.box_ids         = set([int(i) for i in np.unique(self.labeled_boxes) if int(i) != 0])
+        self.rois            = label_rois(self.labeled_boxes) if roi else None
         self.current_frame   = 0
         self.min_trk_length  = ma
         self.starting_frames = {k: v+1 for k, v in start.items()}
@@ -42,114 +137,157 @@ class MiceVisibilityProcessor(object):
         self.instant_visibility = np.zeros((len(self.box_ids), self.n_frames), np.int8)
         self.instant_centroids  = np.zeros((self.n_frames, len(self.box_ids), 2), float)
         self.all_sessions       = None
+        # Run-length encoded visibility, for each box: {box_rank: (starts, lengths, states)}
+        self.visibility_runs    = None
+        # Cumulative distance traveled along the centroids, for each box. [nBoxes, totalFrames] -> float
+        self.path_lengths       = None
+        # Cumulative number of undefined (NaN) steps along the centroids, for each box. [nBoxes, totalFrames] -> int
+        self.nan_steps          = None
 
         self.instant_centroids.fill(-1.0)
-        self.video_stream.release()
+        if self.video_stream is not None:
+            self.video_stream.release()
         self.video_stream = None
 
+    def read_masks(self, video_stream, b_start, b_end):
+        """
+        Reads the masks of the frames [b_start, b_end[ as a boolean array.
+        Masks are directly read from the mask store if there is one, otherwise they are decoded from the video stream.
+        """
+        if self.mask_store is not None:
+            return self.mask_store.read(b_start, b_end - b_start)
+        masks = []
+        for _ in range(b_end - b_start):
+            ret, frame = video_stream.read()
+            if not ret:
+                break
+            masks.append(to_gray(frame) > 127)
+        return np.array(masks, dtype=bool)
+
     def process_visibility_pos(self, interval):
-        video_stream = cv2.VideoCapture(self.video_path)
-        video_stream.set(cv2.CAP_PROP_POS_FRAMES, interval[0])
-        for i in range(interval[1] - interval[0]):
-            _, frame = video_stream.read()
-            mask  = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) > 127
-            mask  = mask.astype(np.float32)
-            mask *= self.labeled_boxes
-            mask  = mask.astype(np.uint8)
-            all_props = regionprops(mask)
-            for p in all_props:
-                if p.label == 0:
-                    continue
-                l = int(p.label)
-                y = int(p.centroid[0])
-                x = int(p.centroid[1])
-                self.instant_visibility[l-1, interval[0] + i] = 1
-                self.instant_centroids[interval[0] + i, l-1]  = (y, x)
-                # Export both arrays on the disk
-        video_stream.release()
+        video_stream = None
+        if self.mask_store is None:
+            video_stream = open_luma(self.video_path)
+            video_stream.set(cv2.CAP_PROP_POS_FRAMES, interval[0])
+        n_labels = len(self.box_ids)
+        for b_start in range(interval[0], interval[1], BATCH_SIZE):
+            b_end = min(b_start + BATCH_SIZE, interval[1])
+            masks = self.read_masks(video_stream, b_start, b_end)
+            if len(masks) == 0:
+                break
+            self.record_visibility(b_start, *labels_centroids(masks, self.labeled_boxes, n_labels, self.rois))
+        if video_stream is not None:
+            video_stream.release()
+
+    def record_visibility(self, index, visibility, centroids):
+        """
+        Saves the visibility and centroids (as produced by 'labels_centroids') of a batch of frames starting at 'index'.
+        Centroids are truncated to integer coordinates.
+        """
+        b_end = min(index + len(visibility), self.n_frames)
+        visibility = visibility[:b_end-index]
+        centroids  = centroids[:b_end-index]
+        self.instant_visibility[:, index:b_end] = visibility.T
+        self.instant_centroids[index:b_end][visibility] = np.trunc(centroids[visibility])
 
     def worker(self, thread_id):
         self.process_visibility_pos(self.ranges[thread_id])
 
+    def compute_path_lengths(self):
+        """
+        Builds, for each box, the cumulative distance traveled along the centroids (prefix sums).
+        'path_lengths[box, i]' is the distance traveled between the frames 0 and i, so the length of any session is the difference of two values.
+        Must be called again each time the centroids are modified.
+        """
+        centroids = self.instant_centroids.astype(np.float64)
+        steps = np.linalg.norm(np.diff(centroids, axis=0), axis=2).T
+        undefined = np.isnan(steps)
+        steps[undefined] = 0.0
+        self.path_lengths = np.zeros((len(self.box_ids), self.n_frames), np.float64)
+        self.nan_steps    = np.zeros((len(self.box_ids), self.n_frames), np.int64)
+        np.cumsum(steps, axis=1, out=self.path_lengths[:, 1:])
+        np.cumsum(undefined, axis=1, out=self.nan_steps[:, 1:])
+
     def get_session_length(self, box_rank, i1, i2):
         """
         Returns the distance traveled by the mouse during the session.
-        Uses the sum of the distances between consecutive centroids.
+        Uses the sum of the distances between consecutive centroids in [i1, i2[, read from the prefix sums.
         """
-        if i1 == i2:
+        if self.path_lengths is None:
+            self.compute_path_lengths()
+        # Same bounds as the slice 'instant_centroids[i1:i2]'
+        i1, i2, _ = slice(i1, i2).indices(self.n_frames)
+        if i2 - i1 < 2:
             return 0.0
-        points = self.instant_centroids[i1:i2, box_rank]
-        distance = 0.0
-        for i in range(len(points)-1):
-            distance += np.linalg.norm(points[i+1] - points[i])
-        return distance
+        if self.nan_steps[box_rank, i2-1] != self.nan_steps[box_rank, i1]:
+            return float('nan')
+        return float(self.path_lengths[box_rank, i2-1] - self.path_lengths[box_rank, i1])
 
     def smooth_centroids(self, window_size=5):
-        smoothed = np.full_like(self.instant_centroids, np.nan, dtype=np.float32)
-        N = self.instant_centroids.shape[0]
-        for box_rank in range(len(self.box_ids)):
-            half_w = window_size // 2
-            for i in range(N):
-                start = max(0, i - half_w)
-                end = min(N, i + half_w + 1)
-                window = self.instant_centroids[start:end, box_rank]
-                valid = (window >= 0).all(axis=1)
-                if valid.any():
-                    smoothed[i, box_rank] = window[valid].mean(axis=0)
-                else:
-                    smoothed[i, box_rank] = self.instant_centroids[i, box_rank]
-        self.instant_centroids = smoothed
+        """
+        Replaces each centroid by the mean of the valid centroids (not -1) in a window centered on it.
+        Centroids having no valid neighbor are kept as they are.
+        """
+        valid = (self.instant_centroids >= 0).all(axis=2)
+        averages, counts = masked_moving_average(self.instant_centroids, window_size, valid)
+        smoothed = np.where((counts > 0)[..., np.newaxis], averages, self.instant_centroids)
+        self.instant_centroids = smoothed.astype(np.float32)
 
     def filter_visibility(self):
+        """
+        Removes the visible/hidden sessions that are too short (in distance) to be trusted.
+        The unstable sessions are merged as 'hidden' as soon as a long enough session is found.
+        The frames before the start (resp. after the end) of the track are marked -1 (resp. -2).
+        The transitions are read from the runs of the visibility timeline, so we iterate over sessions rather than frames.
+        """
+        # The centroids edited in the loop are never part of a later query, the prefix sums stay valid.
+        self.compute_path_lengths()
+        last_index = self.n_frames - 1 # The last frame is never a transition.
         for box_rank in range(len(self.box_ids)):
-            swaps = []
+            visibility = self.instant_visibility[box_rank]
             first_frame = self.starting_frames[box_rank+1] - 1
             last_frame_idx = min(first_frame + self.track_duration, self.n_frames)
-            for f in range(self.n_frames-1):
-                if f < first_frame:
-                    self.instant_visibility[box_rank, f] = -1
-                    self.instant_centroids[f, box_rank] = (-1.0, -1.0)
-                    continue
-                if f >= last_frame_idx:
-                    self.instant_visibility[box_rank, f] = -2
-                    self.instant_centroids[f, box_rank] = (-1.0, -1.0)
+            # A state transition happens on the last frame of each run, the next session starts at (f+1)
+            starts, lengths, _ = run_length_encode(visibility[first_frame:last_frame_idx])
+            transitions = first_frame + starts + lengths - 1
+            swaps = []
+            for f in transitions[transitions < last_index]:
+                # First transition: we don't care about the duration of the session
+                if len(swaps) == 0:
+                    swaps = [f+1, f+1]
                     continue
-                # State transition, the next session starts at (f+1)
-                if (self.instant_visibility[box_rank, f] != self.instant_visibility[box_rank, f+1]) or (f == last_frame_idx-1):
-                    # First transition: we don't care about the duration of the session
-                    if len(swaps) == 0:
-                        swaps.append(f+1)
-                        continue
-                    # We are in an unstable state.
-                    if (self.get_session_length(box_rank, swaps[-1], f) < self.min_trk_length):
-                        swaps.append(f+1)
-                    else:
-                        for i in range(swaps[0], swaps[-1]):
-                            self.instant_visibility[box_rank, i] = 0
-                            self.instant_centroids[i, box_rank] = (-1.0, -1.0)
-                        swaps = [f+1]
+                # We are in an unstable state.
+                if (self.get_session_length(box_rank, swaps[-1], f) < self.min_trk_length):
+                    swaps[-1] = f+1
+                else:
+                    visibility[swaps[0]:swaps[-1]] = 0
+                    self.instant_centroids[swaps[0]:swaps[-1], box_rank] = (-1.0, -1.0)
+                    swaps = [f+1, f+1]
+            before = min(first_frame, last_index)
+            visibility[:before] = -1
+            self.instant_centroids[:before, box_rank] = (-1.0, -1.0)
+            visibility[last_frame_idx:last_index] = -2
+            self.instant_centroids[last_frame_idx:last_index, box_rank] = (-1.0, -1.0)
         np.save("/tmp/visibility-02.npy", self.instant_visibility)
         np.save("/tmp/centroids-02.npy", self.instant_centroids)
 
     def split_frame_ranges(self, n_threads, n_frames):
-        ranges = []
-        base = n_frames // n_threads
-        remainder = n_frames % n_threads
-
-        start = 0
-        for i in range(n_threads):
-            end = start + base + (1 if i < remainder else 0)
-            ranges.append((start, end))
-            start = end
-
-        return ranges
+        return split_frame_ranges(n_frames, n_threads)
 
     def start_processing(self, num_workers=N_THREADS):
         print("(1/3) Processing visibility...")
+        # One range per worker, whatever the number of threads the ranges were first split for.
+        self.ranges = self.split_frame_ranges(num_workers, self.n_frames)
         with ThreadPoolExecutor(max_workers=num_workers) as executor:
             futures = [executor.submit(self.worker, i) for i in range(num_workers)]
             for future in futures:
                 future.result()
+        self.process_measures()
+
+    def process_measures(self):
+        """
+        Turns the raw visibility and centroids into filtered visibility and sessions.
+        """
         print("(2/3) Processing number of in/out...")
         self.smooth_centroids()
         self.filter_visibility()
@@ -164,16 +302,19 @@ class MiceVisibilityProcessor(object):
         For each box, a video is a succession of sessions, alternating between hidden and visible.
         During a session, the mouse is either hidden or visible.
         A session is defined by a duration (in seconds) and a distance (in pixels).
+        Sessions are read from the runs of the visibility timeline, also exposed in 'visibility_runs'.
         """
+        self.compute_path_lengths()
         self.all_sessions = {}
+        self.visibility_runs = self.get_visibility_runs()
         for box in range(len(self.box_ids)):
             sessions = []
             count    = 0
             start    = 0
-            for f in range(self.n_frames-1):
-                state = (self.instant_visibility[box, f], self.instant_visibility[box, f+1])
-                if (state[0] == state[1]):
-                    continue
+            starts, lengths, states = self.visibility_runs[box]
+            for k in range(len(starts)-1):
+                f = int(starts[k] + lengths[k] - 1)
+                state = (states[k], states[k+1])
                 # cases: (-1, 0), (-1, 1), (0, 1), (1, 0), (1, -2), (0, -2)
                 if state[0] == -1: # Track's starting
                     start = f+2
@@ -194,6 +335,15 @@ class MiceVisibilityProcessor(object):
                     }
                     break
 
+    def get_visibility_runs(self):
+        """
+        Returns the run-length encoded visibility timeline of each box.
+
+        Returns:
+            A dictionary {box_rank: (starts, lengths, states)}, see 'run_length_encode'.
+        """
+        return {box: run_length_encode(self.instant_visibility[box]) for box in range(len(self.box_ids))}
+
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
@@ -205,16 +355,17 @@ class QtWorkerMVP(QObject):
 
     measures_ready = Signal(np.ndarray, np.ndarray, dict)
 
-    def __init__(self, mask_path, areas, ma, start, duration):
+    def __init__(self, mask_path, areas, ma, start, duration, roi=False):
         super().__init__()
         self.mask_path  = mask_path
         self.areas      = areas
         self.min_length = ma
         self.start      = start
         self.duration   = duration
+        self.roi        = roi
 
     def run(self):
-        mvp = MiceVisibilityProcessor(self.mask_path, self.areas, self.min_length, self.start, self.duration)
+        mvp = MiceVisibilityProcessor(self.mask_path, self.areas, self.min_length, self.start, self.duration, roi=self.roi)
         mvp.start_processing()
 
         visibility = mvp.instant_visibility
@@ -231,7 +382,7 @@ class QtWorkerMVP(QObject):
 if __name__ == "__main__":
     import tifffile
 
-    mask_path = "/media/benedetti/5B0AAEC37149070F/mice-videos/2084-2086-2104-2106-T0.tmp/mask.avi"
+    mask_path = "/media/benedetti/5B0AAEC37149070F/mice-videos/2084-2086-2104-2106-T0.tmp/mask.bin"
     start_f   = {
         1: 820
     }
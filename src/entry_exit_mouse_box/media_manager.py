@@ -1,6 +1,22 @@
 import cv2
 import os
+import time
+import numpy as np
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 import tifffile
+from entry_exit_mouse_box.frame_source import open_luma
+from entry_exit_mouse_box.lazy_video import VideoArray
+
+# Maximal size (in bytes) of the decoded frames kept in memory, shared by all the sources.
+FRAME_CACHE_SIZE = 512 * 1024**2
+# Number of frames decoded in advance in the scrubbing direction, and in the opposite direction.
+PREFETCH_AHEAD   = 24
+PREFETCH_BEHIND  = 8
+# Number of threads decoding the frames of the different sources at the same time in 'MediaManager.set_frame'.
+FETCH_WORKERS    = 4
 
 
 def properties_match(p1, p2):
@@ -16,14 +32,238 @@ def properties_match(p1, p2):
     return True
 
 
+def open_capture(file_path):
+    """
+    Opens a video file, a mask store (see 'mask_store.MaskStore') or a raw video (see 'raw_video.RawVideo') with the interface of 'cv2.VideoCapture'.
+    The frames are delivered as single channel uint8 images (see 'frame_source.open_luma').
+    """
+    return open_luma(file_path)
+
+
+class FrameCache(object):
+    """
+    Least recently used cache of frames, addressed by (layer_name, frame_index), and bounded by a size in bytes.
+    It can be used from several threads.
+    Each call to 'discard' increments 'generation': a thread decoding a frame reads it first, so that a frame processed before the discard is not put back.
+    """
+    def __init__(self, max_bytes=FRAME_CACHE_SIZE):
+        self.max_bytes  = max_bytes
+        self.n_bytes    = 0
+        self.frames     = OrderedDict()
+        self.generation = 0
+        self.lock       = threading.Lock()
+        self.added      = threading.Condition(self.lock)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.frames
+
+    def get(self, key):
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+            return frame
+
+    def put(self, key, frame, generation=None):
+        """
+        Args:
+            key       : Key of the frame.
+            frame     : Processed frame.
+            generation: Value of 'generation' read before decoding the frame. The frame is dropped if the cache was discarded since.
+
+        Returns:
+            True if the frame was stored.
+        """
+        with self.lock:
+            if (generation is not None) and (generation != self.generation):
+                return False
+            if key in self.frames:
+                self.n_bytes -= self.frames.pop(key).nbytes
+            self.frames[key] = frame
+            self.n_bytes += frame.nbytes
+            while (self.n_bytes > self.max_bytes) and (len(self.frames) > 1):
+                _, oldest = self.frames.popitem(last=False)
+                self.n_bytes -= oldest.nbytes
+            self.added.notify_all()
+            return True
+
+    def wait_for(self, key, is_pending, timeout=1.0):
+        """
+        Waits for a frame that another thread is decoding.
+
+        Args:
+            key       : Key of the frame.
+            is_pending: Function telling whether the frame is still expected.
+            timeout   : Maximal waiting time in seconds.
+
+        Returns:
+            The frame, or None if it didn't arrive.
+        """
+        with self.lock:
+            remaining = timeout
+            while (key not in self.frames) and is_pending() and (remaining > 0):
+                self.added.wait(min(remaining, 0.05))
+                remaining -= 0.05
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+            return frame
+
+    def discard(self, layer_name=None):
+        """
+        Removes the frames of a layer (or all the frames if layer_name is None).
+        """
+        with self.lock:
+            self.generation += 1
+            for key in [k for k in self.frames if (layer_name is None) or (k[0] == layer_name)]:
+                self.n_bytes -= self.frames.pop(key).nbytes
+
+
+class FramePrefetcher(threading.Thread):
+    """
+    Background thread decoding the frames around the current position into a FrameCache.
+    It has its own capture for each source, so it never moves the position of the captures used by the MediaManager.
+    The frames ahead (in the scrubbing direction) are decoded first, then the ones behind. Both are read as sequential runs, so only one seek is needed per run.
+    Backward, the runs are aligned on blocks of 'ahead' frames, so that stepping back doesn't require a seek for each new frame.
+    The process function of the sources is called from this thread.
+    """
+    def __init__(self, cache, ahead=PREFETCH_AHEAD, behind=PREFETCH_BEHIND):
+        super().__init__(daemon=True)
+        self.cache      = cache
+        self.ahead      = ahead
+        self.behind     = behind
+        self.sources    = {} # layer_name -> [capture, process, position, n_frames]
+        self.target     = -1
+        self.direction  = 1
+        self.generation = 0
+        self.pending    = set() # Frames that the current run will decode.
+        self.running    = True
+        self.lock       = threading.Lock()
+        self.condition  = threading.Condition(self.lock)
+        self.decoding   = threading.Lock() # Held while a frame is decoded, so a source is not released meanwhile.
+
+    def add_source(self, file_path, layer_name, process):
+        capture = open_capture(file_path)
+        with self.decoding:
+            self.remove_source(layer_name, locked=True)
+            self.sources[layer_name] = [capture, process, -1, int(capture.get(cv2.CAP_PROP_FRAME_COUNT))]
+
+    def set_process(self, layer_name, process):
+        with self.decoding:
+            source = self.sources.get(layer_name)
+            if source is not None:
+                source[1] = process
+
+    def remove_source(self, layer_name, locked=False):
+        if not locked:
+            with self.decoding:
+                return self.remove_source(layer_name, True)
+        source = self.sources.pop(layer_name, None)
+        if source is not None:
+            source[0].release()
+
+    def start(self):
+        super().start()
+        # A decoder must not be running while the interpreter exits.
+        atexit.register(self.stop)
+
+    def request(self, frame_index, direction):
+        with self.condition:
+            self.target     = frame_index
+            self.direction  = 1 if direction >= 0 else -1
+            self.generation += 1
+            self.condition.notify_all()
+
+    def stop(self):
+        atexit.unregister(self.stop)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.join()
+        with self.decoding:
+            for layer_name in list(self.sources.keys()):
+                self.remove_source(layer_name, True)
+
+    def plan(self, target, direction):
+        """
+        Frames to decode around 'target', by order of priority.
+        """
+        if direction > 0:
+            first  = range(target + 1, target + 1 + self.ahead)
+            second = range(target - self.behind, target)
+        else:
+            block  = (target - 1) // self.ahead * self.ahead
+            first  = list(range(block, target)) + list(range(block - self.ahead, block))
+            second = range(target + 1, target + 1 + self.behind)
+        return [i for i in list(first) + list(second) if i >= 0]
+
+    def decode(self, layer_name, index):
+        source = self.sources.get(layer_name)
+        if (source is None) or (index >= source[3]):
+            return
+        capture, process, position, _ = source
+        generation = self.cache.generation
+        if position != index:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+        ret, frame = capture.read()
+        if not ret:
+            source[2] = -1
+            return
+        source[2] = index + 1
+        if process is not None:
+            frame = process(frame)
+        self.cache.put((layer_name, index), frame, generation)
+
+    def is_pending(self, layer_name, index):
+        return (layer_name, index) in self.pending
+
+    def run(self):
+        done = -1
+        while True:
+            with self.condition:
+                while self.running and (self.generation == done):
+                    self.condition.wait()
+                if not self.running:
+                    return
+                target, direction, generation = self.target, self.direction, self.generation
+            plan = self.plan(target, direction)
+            self.pending = {(layer_name, index) for index in plan for layer_name in list(self.sources.keys())}
+            for index in plan:
+                if (self.generation != generation) or (not self.running):
+                    break
+                with self.decoding:
+                    for layer_name in list(self.sources.keys()):
+                        if (layer_name, index) not in self.cache:
+                            self.decode(layer_name, index)
+                        self.pending.discard((layer_name, index))
+            self.pending = set()
+            done = generation
+
+
+# With 'lazy=True', each source is displayed as a (T, Y, X) layer backed by a 'lazy_video.VideoArray', instead of a 2D layer whose data is replaced at each frame.
+# The frame displayed is then the current step of the first axis of napari's dims, which 'set_frame' moves (and that the user can move with napari's own slider).
+# napari reads the frames on demand, by chunks, so the prefetcher is not used. The proxies are not used either.
+
 class MediaManager:
-    def __init__(self, viewer):
+    def __init__(self, viewer, cache_size=FRAME_CACHE_SIZE, prefetch=True, lazy=False):
         self.sources       = [] # (file_path, capture_instance, layer_name, process_function, image_category)
         self.properties    = [] # Available keys: total_frames, fps, width, height
         self.current_frame = -1 # True index, not the displayed index (starts at 0)
         self.viewer        = viewer # Instance of the Napari viewer
         self.logger        = None
         self.active        = False
+        self.cache         = FrameCache(cache_size) # Processed frames, so the process functions run once per frame.
+        self.positions     = {} # layer_name -> index of the next frame that the capture of this layer will read.
+        self.lazy          = lazy
+        self.arrays        = {} # layer_name -> VideoArray displayed in this layer (only with lazy=True).
+        self.use_prefetch  = prefetch
+        self.prefetch      = prefetch and not lazy
+        self.prefetcher    = None
+        self.proxies       = {} # layer_name -> {'capture', 'factor': (y, x), 'shown': bool}, downscaled copies displayed while scrubbing.
+        self.pool          = None # Threads fetching the frames of the sources in parallel (created with the second source).
+        self.timings       = {} # layer_name -> [last, total, count], time (in seconds) taken to fetch the frames of each source.
+        self.viewer.dims.events.current_step.connect(self.on_dims_change)
 
     def __del__(self):
         self.release()
@@ -33,13 +273,79 @@ class MediaManager:
 
     def release(self):
         self.active = False
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
         for source in self.sources:
-            _, capture, _, _, _ = source
-            capture.release()
+            _, capture, target_layer, _, _ = source
+            self.release_proxy(target_layer)
+            self.release_capture(target_layer, capture)
         self.sources.clear()
         self.properties.clear()
+        self.positions.clear()
+        self.timings.clear()
+        self.cache.discard()
         self.current_frame = -1
 
+    def invalidate_cache(self, layer_name=None):
+        """
+        Forgets the frames of a layer (or of all the layers), for example if its process function depends on a state that changed.
+        """
+        self.cache.discard(layer_name)
+        # napari has to read the current frame again.
+        for target_layer in self.arrays.keys():
+            if ((layer_name is None) or (target_layer == layer_name)) and (target_layer in self.viewer.layers):
+                self.viewer.layers[target_layer].refresh()
+
+    def set_process(self, layer_name, process):
+        """
+        Replaces the process function of a source, and forgets the frames processed by the previous one.
+        """
+        for idx, source in enumerate(self.sources):
+            if source[2] == layer_name:
+                self.sources[idx] = source[:3] + (process,) + source[4:]
+        if layer_name in self.arrays:
+            self.arrays[layer_name].process = process
+        if self.prefetcher is not None:
+            self.prefetcher.set_process(layer_name, process)
+        self.invalidate_cache(layer_name)
+
+    def release_capture(self, target_layer, capture):
+        array = self.arrays.pop(target_layer, None)
+        if array is not None:
+            array.release() # The array owns the capture.
+        else:
+            capture.release()
+
+    def set_lazy(self, lazy):
+        """
+        Switches between (T, Y, X) layers and 2D layers (see 'lazy' in the constructor).
+
+        Raises:
+            RuntimeError: If some sources are open, as their layers would have to be rebuilt.
+        """
+        if len(self.sources) > 0:
+            raise RuntimeError("ERROR: The layers can't be switched while sources are open.")
+        self.lazy     = lazy
+        self.prefetch = self.use_prefetch and not lazy
+
+    def on_dims_change(self, event=None):
+        # The first axis of the dims is the time as soon as a source is opened.
+        if (not self.lazy) or (len(self.sources) == 0) or (self.viewer.dims.ndim < 3):
+            return
+        self.current_frame = int(self.viewer.dims.current_step[0])
+
+    def get_frame(self, layer_name):
+        """
+        Returns the frame currently displayed in the layer of a source, as a 2D image (with or without 'lazy').
+        """
+        if layer_name in self.arrays:
+            return self.arrays[layer_name][self.current_frame]
+        return self.viewer.layers[layer_name].data
+
     def get_source_by_index(self, index):
         if index < 0 or index >= len(self.sources):
             raise ValueError("ERROR: Index out of range.")
@@ -78,15 +384,73 @@ class MediaManager:
     def release_source(self, index):
         if index < 0 or index >= len(self.sources):
             raise ValueError("ERROR: Index out of range.")
-        _, capture, _, _, _ = self.sources[index]
-        capture.release()
+        _, capture, target_layer, _, _ = self.sources[index]
+        if self.prefetcher is not None:
+            self.prefetcher.remove_source(target_layer)
+        self.release_proxy(target_layer)
+        self.cache.discard(target_layer)
+        self.positions.pop(target_layer, None)
+        self.timings.pop(target_layer, None)
+        self.release_capture(target_layer, capture)
         self.sources.pop(index)
         self.properties.pop(index)
         if index == 0:
             self.current_frame = -1
         return None
 
-    def add_source(self, file_path, target_layer, img_type, process=None):
+    def add_proxy(self, proxy_path, target_layer, properties):
+        """
+        Opens the proxy of a source (see 'convert_format.get_proxy_path'). It is ignored if it doesn't have the same number of frames.
+        """
+        capture = open_capture(proxy_path)
+        n_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if n_frames != properties['total_frames']:
+            print(f"The proxy {proxy_path} doesn't match the video ({n_frames} frames instead of {properties['total_frames']}).")
+            capture.release()
+            return
+        factor = (
+            properties['height'] / capture.get(cv2.CAP_PROP_FRAME_HEIGHT), 
+            properties['width'] / capture.get(cv2.CAP_PROP_FRAME_WIDTH)
+        )
+        self.proxies[target_layer] = {'capture': capture, 'factor': factor, 'shown': False}
+
+    def release_proxy(self, target_layer):
+        if target_layer not in self.proxies:
+            return
+        if target_layer in self.viewer.layers:
+            self.set_proxy_shown(target_layer, False)
+        self.proxies.pop(target_layer)['capture'].release()
+
+    def set_proxy_shown(self, target_layer, shown):
+        """
+        Adjusts the scale of a layer when it switches between the proxy and the full resolution frames.
+        The proxy is stretched over the full resolution frame, so the boxes and the calibration stay in full resolution coordinates.
+        """
+        proxy = self.proxies[target_layer]
+        if proxy['shown'] == shown:
+            return
+        layer  = self.viewer.layers[target_layer]
+        factor = np.array(proxy['factor'])
+        scale  = np.array(layer.scale, dtype=float)
+        full   = scale if shown else scale / factor
+        # The center of a proxy pixel is in the middle of the block of full resolution pixels it covers.
+        offset = 0.5 * (factor - 1) * full
+        if shown:
+            layer.scale     = full * factor
+            layer.translate = np.array(layer.translate) + offset
+        else:
+            layer.translate = np.array(layer.translate) - offset
+            layer.scale     = full
+        proxy['shown'] = shown
+
+    def show_full_resolution(self):
+        """
+        Replaces the proxies on display by the full resolution frames.
+        """
+        if any(proxy['shown'] for proxy in self.proxies.values()):
+            self.set_frame(self.current_frame)
+
+    def add_source(self, file_path, target_layer, img_type, process=None, proxy_path=None):
         """
         Add a new video source to the manager.
 
@@ -94,7 +458,8 @@ class MediaManager:
             file_path   : Path of the video file to be opened.
             target_layer: Name of the layer to which each frame of the video will be loaded.
             img_type    : Type of the image to be loaded ('image' or 'labels').
-            process     : Function to be applied to each frame of the video before displaying it.
+            process     : Function to be applied to each frame of the video before displaying it (also to the frames of the proxy).
+            proxy_path  : Optional downscaled copy of the video, displayed while scrubbing (see 'set_frame').
 
         Raises:
             FileNotFoundError: If the file is not found at the specified path.
@@ -114,7 +479,7 @@ class MediaManager:
             if source[2] == target_layer:
                 self.release_source(idx)
 
-        capture = cv2.VideoCapture(file_path)
+        capture = open_capture(file_path)
         if not capture.isOpened():
             raise IOError("ERROR: Failed to open video file.")
 
@@ -140,18 +505,29 @@ class MediaManager:
 
         self.sources.append((file_path, capture, target_layer, process, img_type))
         self.properties.append(properties)
-
         if self.current_frame == -1:
             self.current_frame = 0
+        if self.lazy:
+            return self.add_lazy_source(capture, target_layer, img_type, process, properties)
+
+        if proxy_path is not None:
+            self.add_proxy(proxy_path, target_layer, properties)
+        if self.prefetch:
+            if self.prefetcher is None:
+                self.prefetcher = FramePrefetcher(self.cache)
+                self.prefetcher.start()
+            self.prefetcher.add_source(file_path, target_layer, process)
 
         # Set the correct frame index and extract the given frame
         capture.set(cv2.CAP_PROP_POS_FRAMES, self.current_frame)
         ret, frame = capture.read()
 
-        if process is not None:
-            frame = process(frame)
         if not ret:
             raise IOError("ERROR: Failed to read frame.")
+        if process is not None:
+            frame = process(frame)
+        self.cache.put((target_layer, self.current_frame), frame)
+        self.positions[target_layer] = self.current_frame + 1
 
         if target_layer in self.viewer.layers:
             layer = self.viewer.layers[target_layer]
@@ -170,11 +546,137 @@ class MediaManager:
                 )
             else:
                 raise ValueError("ERROR: The image type is not recognized.")
+
+        if self.prefetcher is not None:
+            self.prefetcher.request(self.current_frame, 1)
         
         return properties
 
 
-    def set_frame(self, frame_target):
+    def add_lazy_source(self, capture, target_layer, img_type, process, properties):
+        """
+        Displays a source as a (T, Y, X) layer (see 'lazy_video.VideoArray'), on the current frame.
+        """
+        array = VideoArray(capture, target_layer, self.cache, process)
+        frame_number = self.current_frame # Adding a layer resets the dims of napari.
+        self.arrays[target_layer] = array
+        if (target_layer in self.viewer.layers) and (self.viewer.layers[target_layer].ndim != array.ndim):
+            self.viewer.layers.remove(target_layer)
+
+        if target_layer in self.viewer.layers:
+            self.viewer.layers[target_layer].data = array
+        elif img_type == "image":
+            # Known contrast limits, so that napari doesn't read the whole video to estimate them.
+            self.viewer.add_image(
+                array, 
+                name=target_layer, 
+                contrast_limits=(0, 255)
+            )
+        elif img_type == "labels":
+            self.viewer.add_labels(
+                array, 
+                name=target_layer,
+                blending="additive"
+            )
+        else:
+            raise ValueError("ERROR: The image type is not recognized.")
+
+        self.viewer.dims.set_current_step(0, frame_number)
+        return properties
+
+    def read_frame(self, source, frame_number):
+        """
+        Returns the processed frame of a source, from the cache or decoded (None if it can't be read).
+        """
+        _, capture, target_layer, process, _ = source
+        frame = self.cache.get((target_layer, frame_number))
+        # Rather than decoding the same frame twice, wait for the prefetcher if it is on its way.
+        if (frame is None) and (self.prefetcher is not None):
+            frame = self.cache.wait_for(
+                (target_layer, frame_number), 
+                lambda: self.prefetcher.is_pending(target_layer, frame_number)
+            )
+        if frame is not None:
+            return frame
+
+        generation = self.cache.generation
+        # Sequential fast path: the capture is already on the requested frame (e.g. during playback), no seek is needed.
+        if self.positions.get(target_layer) != frame_number:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        ret, frame = capture.read()
+        if not ret:
+            self.positions.pop(target_layer, None)
+            return None
+        self.positions[target_layer] = frame_number + 1
+        if process is not None:
+            frame = process(frame)
+        self.cache.put((target_layer, frame_number), frame, generation)
+        return frame
+
+    def fetch_frame(self, source, frame_number, preview):
+        """
+        Frame of a source to display (see 'set_frame'). It can be called from the threads of the pool.
+
+        Returns:
+            (frame, shown): The frame (None if it can't be read) and whether it comes from the proxy.
+        """
+        start = time.perf_counter()
+        target_layer = source[2]
+        frame, shown = None, False
+        if preview and (target_layer in self.proxies):
+            frame = self.cache.get((target_layer, frame_number))
+            if frame is None:
+                frame = self.read_proxy(source, frame_number)
+                shown = frame is not None
+        if frame is None:
+            frame = self.read_frame(source, frame_number)
+        timing = self.timings.setdefault(target_layer, [0.0, 0.0, 0])
+        timing[0] = time.perf_counter() - start
+        timing[1] += timing[0]
+        timing[2] += 1
+        return frame, shown
+
+    def fetch_frames(self, frame_number, preview):
+        """
+        Fetches the frame of every source. With several sources, they are decoded in parallel, so the latency is the one of the slowest source.
+        """
+        if (len(self.sources) < 2) or (FETCH_WORKERS < 2):
+            return [self.fetch_frame(source, frame_number, preview) for source in self.sources]
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+        futures = [self.pool.submit(self.fetch_frame, source, frame_number, preview) for source in self.sources]
+        return [future.result() for future in futures]
+
+    def get_timings(self):
+        """
+        Time taken to fetch the frames of each source by 'set_frame', to find the one slowing the scrubbing down.
+
+        Returns:
+            A dictionary {layer_name: {'last': ms, 'mean': ms, 'count': n}}.
+        """
+        return {
+            layer_name: {'last': 1000 * last, 'mean': 1000 * total / max(1, count), 'count': count}
+            for layer_name, (last, total, count) in self.timings.items()
+        }
+
+    def read_proxy(self, source, frame_number):
+        _, _, target_layer, process, _ = source
+        capture = self.proxies[target_layer]['capture']
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        ret, frame = capture.read()
+        if not ret:
+            return None
+        return frame if process is None else process(frame)
+
+    def set_frame(self, frame_target, preview=False):
+        """
+        Displays a frame of every source.
+
+        Args:
+            frame_target: Index of the frame (clipped to the range of the media).
+            preview     : If True, the sources having a proxy show it when the full resolution frame is not cached yet (e.g. while the slider is dragged).
+                          Calling 'set_frame' again without preview replaces the proxies by the full resolution frames.
+        """
         if len(self.sources) == 0:
             if self.active:
                 raise ValueError("ERROR: No media opened.")
@@ -185,25 +687,30 @@ class MediaManager:
         frame_number = max(0, frame_number)
         frame_number = min(frame_number, self.properties[0]['total_frames']-1)
 
-        if frame_number == self.current_frame:
+        proxy_shown = any(proxy['shown'] for proxy in self.proxies.values())
+        if (frame_number == self.current_frame) and (preview or not proxy_shown):
             return self.current_frame
 
+        direction = frame_number - self.current_frame
         self.current_frame = frame_number
+        if self.lazy:
+            # napari reads the frame itself.
+            self.viewer.dims.set_current_step(0, frame_number)
+            return self.current_frame
 
-        for source in self.sources:
-            _, capture, target_layer, process, img_type = source
-            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            ret, frame = capture.read()
-
-            if process is not None:
-                frame = process(frame)
-            if not ret:
-                print("ERROR: Failed to read frame.")
-                return None
-            
+        # All the frames are fetched before any layer is updated, so the layers change together (on the GUI thread).
+        frames = self.fetch_frames(frame_number, preview)
+        if any(frame is None for frame, _ in frames):
+            print("ERROR: Failed to read frame.")
+            return None
+
+        for source, (frame, shown) in zip(self.sources, frames):
+            _, _, target_layer, _, img_type = source
             if target_layer in self.viewer.layers:
                 layer = self.viewer.layers[target_layer]
                 layer.data = frame
+                if target_layer in self.proxies:
+                    self.set_proxy_shown(target_layer, shown)
             else:
                 if img_type == "image":
                     self.viewer.add_image(
@@ -217,6 +724,9 @@ class MediaManager:
                     )
                 else:
                     raise ValueError("ERROR: The image type is not recognized.")
+
+        if self.prefetcher is not None:
+            self.prefetcher.request(frame_number, direction)
     
     def get_video_properties(self):
         return self.properties
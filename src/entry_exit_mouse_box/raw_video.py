@@ -0,0 +1,261 @@
+import os
+import json
+import zlib
+import cv2
+import numpy as np
+
+# Intermediate format for the converted videos: the grayscale frames are stored as raw uint8 pixels, so they can be read without any decoding.
+# The data file ('video.gray') is accompanied by a JSON sidecar ('video.gray.json') giving the number of frames, their shape and the FPS.
+#  - Without compression, the data file is a (n_frames, height, width) array, memory-mapped by the readers (zero-copy, true random access).
+#  - With compression ('zlib'), the frames are compressed by chunks of 'chunk_frames' frames, whose offsets are listed in the sidecar.
+#    Reading a frame then decompresses its whole chunk, which is kept until another chunk is requested.
+RAW_EXTENSION = ".gray"
+FORMAT        = "EEMBGRAY"
+VERSION       = 1
+COMPRESSIONS  = (None, "zlib")
+# Number of frames per compressed chunk.
+CHUNK_FRAMES  = 16
+# zlib compression level (1 = fastest).
+ZLIB_LEVEL    = 1
+
+
+def sidecar_path(path):
+    return path + ".json"
+
+
+def read_sidecar(path):
+    """
+    Reads the sidecar of a raw video.
+
+    Returns:
+        The dictionary stored in the sidecar, or None if 'path' is not a raw video.
+    """
+    try:
+        with open(sidecar_path(path), "r") as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        return None
+    return header
+
+
+def is_raw_video(path):
+    """
+    Checks whether a file is a complete raw video (its sidecar is only written once all the frames are).
+    """
+    return os.path.isfile(path) and (read_sidecar(path) is not None)
+
+
+class RawVideoWriter(object):
+    """
+    Writes frames to a raw video, with the interface of 'cv2.VideoWriter' (isOpened, write, release).
+    BGR frames are converted to grayscale.
+    The number of frames doesn't have to be known in advance: the sidecar is written by 'release'.
+    """
+    def __init__(self, path, fps, size, compression=None, chunk_frames=CHUNK_FRAMES):
+        """
+        Args:
+            path        : Path of the data file (the sidecar is written next to it).
+            fps         : Frame rate of the video.
+            size        : (width, height) of the frames, as for 'cv2.VideoWriter'.
+            compression : One of COMPRESSIONS.
+            chunk_frames: Number of frames per compressed chunk (only used with compression).
+
+        Raises:
+            ValueError: If the compression is unknown.
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"ERROR: Unknown compression: {compression}.")
+        self.path         = path
+        self.fps          = float(fps)
+        self.shape        = (int(size[1]), int(size[0]))
+        self.compression  = compression
+        self.chunk_frames = int(chunk_frames) if compression is not None else 1
+        self.n_frames     = 0
+        self.offsets      = [0]
+        self.chunk        = []
+        if os.path.isfile(sidecar_path(path)):
+            os.remove(sidecar_path(path))
+        self.file         = open(path, "wb")
+
+    def isOpened(self):
+        return self.file is not None
+
+    def write(self, frame):
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if frame.shape != self.shape:
+            raise ValueError(f"ERROR: Frame of shape {frame.shape} written in a video of shape {self.shape}.")
+        self.n_frames += 1
+        if self.compression is None:
+            self.file.write(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+            return
+        self.chunk.append(np.asarray(frame, dtype=np.uint8))
+        if len(self.chunk) == self.chunk_frames:
+            self.flush_chunk()
+
+    def flush_chunk(self):
+        if len(self.chunk) == 0:
+            return
+        data = zlib.compress(np.stack(self.chunk).tobytes(), ZLIB_LEVEL)
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        self.chunk = []
+
+    def release(self):
+        if self.file is None:
+            return
+        self.flush_chunk()
+        self.file.close()
+        self.file = None
+        header = {
+            'format'      : FORMAT,
+            'version'     : VERSION,
+            'n_frames'    : self.n_frames,
+            'height'      : self.shape[0],
+            'width'       : self.shape[1],
+            'fps'         : self.fps,
+            'dtype'       : "uint8",
+            'compression' : self.compression,
+            'chunk_frames': self.chunk_frames,
+            'offsets'     : self.offsets if self.compression is not None else None
+        }
+        tmp_path = sidecar_path(self.path) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(header, f)
+        os.replace(tmp_path, sidecar_path(self.path))
+
+
+class RawVideo(object):
+    """
+    Read-only access to the frames of a raw video.
+    Without compression, the frames returned are views of a memory-map and must not be modified.
+    """
+    def __init__(self, path):
+        """
+        Raises:
+            IOError: If the file is not a raw video, or if its version is not supported.
+        """
+        header = read_sidecar(path)
+        if header is None:
+            raise IOError(f"ERROR: {path} is not a raw video.")
+        if int(header['version']) != VERSION:
+            raise IOError(f"ERROR: Unsupported raw video version: {header['version']}.")
+        self.path         = path
+        self.n_frames     = int(header['n_frames'])
+        self.height       = int(header['height'])
+        self.width        = int(header['width'])
+        self.fps          = float(header['fps'])
+        self.shape        = (self.height, self.width)
+        self.compression  = header['compression']
+        self.chunk_frames = int(header['chunk_frames'])
+        self.offsets      = header['offsets']
+        self.chunk_index  = -1
+        self.chunk        = None
+        self.file         = None
+        if self.n_frames == 0:
+            self.data = np.zeros((0,) + self.shape, np.uint8)
+        elif self.compression is None:
+            self.data = np.memmap(path, np.uint8, 'r', 0, (self.n_frames,) + self.shape)
+        else:
+            self.data = None
+            self.file = open(path, "rb")
+
+    def __len__(self):
+        return self.n_frames
+
+    def load_chunk(self, chunk_index):
+        if chunk_index != self.chunk_index:
+            start, end = self.offsets[chunk_index], self.offsets[chunk_index+1]
+            self.file.seek(start)
+            buffer = zlib.decompress(self.file.read(end - start))
+            self.chunk = np.frombuffer(buffer, np.uint8).reshape((-1,) + self.shape)
+            self.chunk_index = chunk_index
+        return self.chunk
+
+    def read(self, index, count=None):
+        """
+        Reads frames from the raw video.
+
+        Args:
+            index: Index of the first frame to read.
+            count: Number of frames to read. If None, a single (height, width) frame is returned.
+
+        Returns:
+            A uint8 array of shape (count, height, width), or (height, width) if count is None.
+        """
+        if self.data is not None:
+            if count is None:
+                return self.data[index]
+            return self.data[index:index+count]
+        if count is None:
+            return self.load_chunk(index // self.chunk_frames)[index % self.chunk_frames]
+        end = min(index + count, self.n_frames)
+        frames = []
+        while index < end:
+            chunk = self.load_chunk(index // self.chunk_frames)
+            first = index % self.chunk_frames
+            last = min(len(chunk), first + end - index)
+            frames.append(chunk[first:last])
+            index += last - first
+        if len(frames) == 0:
+            return np.zeros((0,) + self.shape, np.uint8)
+        return np.concatenate(frames)
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+        self.file  = None
+        self.data  = None
+        self.chunk = None
+
+
+class RawCapture(object):
+    """
+    Raw video imitating the interface of 'cv2.VideoCapture' (see 'mask_store.MaskCapture').
+    Frames are returned as single channel uint8 images.
+    """
+    def __init__(self, path):
+        self.video    = RawVideo(path)
+        self.position = 0
+
+    def isOpened(self):
+        return self.video is not None
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.video.n_frames)
+        if prop == cv2.CAP_PROP_FPS:
+            return self.video.fps
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.video.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.video.height)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.position)
+        return 0.0
+
+    def set(self, prop, value):
+        if prop != cv2.CAP_PROP_POS_FRAMES:
+            return False
+        self.position = int(value)
+        return True
+
+    def grab(self):
+        if self.position < 0 or self.position >= self.video.n_frames:
+            return False
+        self.position += 1
+        return True
+
+    def read(self):
+        if self.position < 0 or self.position >= self.video.n_frames:
+            return False, None
+        frame = self.video.read(self.position)
+        self.position += 1
+        return True, frame
+
+    def release(self):
+        if self.video is not None:
+            self.video.release()
+        self.video = None
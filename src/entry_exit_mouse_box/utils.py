@@ -89,6 +89,97 @@ def merge_close_points(path, min_distance, dot_threshold=-0.7):
     return np.array(merged_path)
 
 
+def label_rois(labels, margin=0):
+    """
+    Computes the bounding rectangle of each label of a labeled image.
+
+    Parameters:
+    - labels: A 2D NumPy array containing one value per area (0=BG).
+    - margin: Number of pixels added on each side of the rectangles (clipped to the image).
+
+    Returns:
+    - A dictionary {label: (y0, y1, x0, x1)}, to be used as labels[y0:y1, x0:x1].
+    """
+    rois = {}
+    height, width = labels.shape[0:2]
+    for lbl in np.unique(labels):
+        if lbl == 0:
+            continue
+        rows = np.flatnonzero((labels == lbl).any(axis=1))
+        cols = np.flatnonzero((labels == lbl).any(axis=0))
+        rois[int(lbl)] = (
+            max(0, int(rows[0]) - margin),
+            min(height, int(rows[-1]) + 1 + margin),
+            max(0, int(cols[0]) - margin),
+            min(width, int(cols[-1]) + 1 + margin)
+        )
+    return rois
+
+
+def split_frame_ranges(n_frames, n_parts, align=1):
+    """
+    Splits [0, n_frames[ into contiguous ranges of similar sizes.
+
+    Parameters:
+    - n_frames: Total number of frames.
+    - n_parts: Number of ranges to produce (at least 1).
+    - align: The ranges start on multiples of this value (e.g., the size of a batch). The last range takes the remainder.
+
+    Returns:
+    - A list of n_parts tuples (start, end), some of them possibly empty if there are fewer blocks than parts.
+    """
+    n_parts = max(1, int(n_parts))
+    n_blocks = (n_frames + align - 1) // align
+    base = n_blocks // n_parts
+    remainder = n_blocks % n_parts
+
+    ranges = []
+    start = 0
+    for i in range(n_parts):
+        end = start + base + (1 if i < remainder else 0)
+        ranges.append((min(start * align, n_frames), min(end * align, n_frames)))
+        start = end
+
+    return ranges
+
+
+def masked_moving_average(values, window_size, valid=None):
+    """
+    Centered moving average along the first axis, ignoring the invalid values.
+    The windows are clipped at the borders, and the sums are read from cumulative sums of the valid values and of their count.
+
+    Parameters:
+    - values: A NumPy array of shape (n_points, ...) (e.g., the centroids of shape (n_frames, n_boxes, 2)).
+    - window_size: The size of the sliding window. The half-width used is window_size // 2.
+    - valid: Optional boolean array matching the first dimensions of values (e.g., (n_frames, n_boxes)). All values are valid by default.
+
+    Returns:
+    - A tuple (averages, counts): the averaged values (NaN where the window contains no valid value) and the number of valid values in each window.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_points = len(values)
+    half_w = window_size // 2
+    if valid is None:
+        valid = np.ones(values.shape, bool)
+    valid = np.asarray(valid, dtype=bool)
+    expanded = valid.reshape(valid.shape + (1,) * (values.ndim - valid.ndim))
+
+    sums = np.zeros((n_points + 1,) + values.shape[1:], np.float64)
+    counts = np.zeros((n_points + 1,) + valid.shape[1:], np.int64)
+    np.cumsum(np.where(expanded, values, 0.0), axis=0, out=sums[1:])
+    np.cumsum(valid, axis=0, out=counts[1:])
+
+    indices = np.arange(n_points)
+    lower = np.maximum(indices - half_w, 0)
+    upper = np.minimum(indices + half_w + 1, n_points)
+    window_sums = sums[upper] - sums[lower]
+    window_counts = counts[upper] - counts[lower]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        averages = window_sums / window_counts.reshape(expanded.shape)
+    return averages, window_counts
+
+
 def smooth_path_2d(points, window_size=3):
     """
     Smooth a path of 2D points using a simple moving average with a sliding window.
@@ -110,11 +201,9 @@ def smooth_path_2d(points, window_size=3):
     padded_points = np.pad(points, ((pad_width, pad_width), (0, 0)), mode='edge')
 
     smoothed_points = np.zeros_like(points)
-
-    for i in range(len(points)):
-        start_index = i
-        end_index = i + window_size
-        smoothed_points[i] = np.mean(padded_points[start_index:end_index], axis=0)
+    # Inside the padding, every window is complete: no value needs to be masked.
+    averages, _ = masked_moving_average(padded_points, window_size, np.ones(len(padded_points), bool))
+    smoothed_points[:] = averages[pad_width:pad_width+len(points)]
 
     return smoothed_points
 
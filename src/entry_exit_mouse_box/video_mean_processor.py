@@ -6,59 +6,315 @@ import os
 import tifffile
 import time
 from qtpy.QtCore import QThread, QObject, QTimer, Qt, Signal, Slot
+from entry_exit_mouse_box.utils import split_frame_ranges
+from entry_exit_mouse_box import frame_source
+from entry_exit_mouse_box.frame_source import open_luma, to_gray
 
+# Number of frames read by a worker at once.
+BATCH_SIZE = 32
+# In the full scan modes, only one frame out of SKIP is decoded, and held for the next ones.
+SKIP = 3
+# Default number of frames decoded in the 'sampled' mode.
+SAMPLES_BUDGET = 300
+# Below this gap (in frames) between two samples, grabbing the frames in between is cheaper than seeking.
+SEEK_GAP = 16
+# Default peak memory (in bytes) of the 'median' mode: 3/4 for the reservoir of frames, 1/4 for the tiles being sorted.
+MEDIAN_MEMORY = 512 * 1024**2
 
-class VideoMeanProcessor(object):
 
-    def __init__(self, video_path, shape):
+def background_params(mode, n_samples=SAMPLES_BUDGET, frame_range=None):
+    """
+    Parameters identifying a background reference, used to address it in the cache (see 'artifact_cache.ArtifactCache').
+    The video backend is included as it affects the grayscale values.
+
+    Args:
+        mode       : Mode of 'VideoMeanProcessor'. The 'shared' and 'segments' modes give the same result.
+                     "conversion" is the mean accumulated while the video was converted (see 'RunningMean').
+        n_samples  : Number of samples, only used by the 'sampled' and 'median' modes.
+        frame_range: Range of frames (start, end) sampled by the 'sampled' and 'median' modes (None for the whole video).
+    """
+    params = {
+        'mode'      : "segments" if mode == "shared" else mode,
+        'backend'   : frame_source.DEFAULT_BACKEND,
+        'luma_plane': frame_source.LUMA_PLANE
+    }
+    if mode in ("sampled", "median"):
+        params['n_samples'] = int(n_samples)
+        if frame_range is not None:
+            params['frame_range'] = [int(frame_range[0]), int(frame_range[1])]
+    return params
+
+
+class RunningMean(object):
+    """
+    Mean of a stream of frames (e.g. while they are converted), equal to the one of the full scan modes of 'VideoMeanProcessor'.
+    The frames are processed by batches of BATCH_SIZE, in which only one frame out of SKIP is converted to grayscale and held for the next ones.
+    """
+    def __init__(self, shape):
+        self.shape     = tuple(shape)
+        self.sum       = np.zeros(self.shape, np.uint64)
+        self.stack     = np.empty((BATCH_SIZE,) + self.shape, np.uint8)
+        self.n_stacked = 0
+        self.n_frames  = 0
+
+    def add(self, frame):
+        i = self.n_stacked
+        if i % SKIP == 0:
+            to_gray(frame, self.stack[i])
+        else:
+            self.stack[i] = self.stack[i-1]
+        self.n_stacked += 1
+        self.n_frames += 1
+        if self.n_stacked == BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.n_stacked > 0:
+            self.sum += self.stack[:self.n_stacked].sum(axis=0, dtype=np.uint32)
+        self.n_stacked = 0
+
+    def result(self):
+        """
+        Returns the mean as a uint8 image (None if no frame was added).
+        """
+        self.flush()
+        if self.n_frames == 0:
+            return None
+        return (self.sum // self.n_frames).astype(np.uint8)
+
+
+class VideoMeanProcessor(object):
+    """
+    Computes the mean grayscale frame of a video, used as the background reference.
+    In the 'shared' mode, all the workers read from the same capture, one batch at a time.
+    In the 'segments' mode, the video is split into contiguous segments (aligned on batches), and each worker opens its own capture.
+    The partial sums are added at the end, so the decoding itself runs in parallel.
+    Both modes sample the frames the same way.
+    In the 'sampled' mode, only 'n_samples' frames, evenly spread over the video (or over 'frame_range'), are decoded.
+    Each worker seeks to its own samples, so the processing time doesn't depend on the length of the video anymore.
+    The 'median' mode reads the same samples, but computes a per-pixel percentile (the median by default) instead of a mean.
+    The mice sitting still for a long time don't leave ghosts in it.
+    The samples are kept in a reservoir (a single preallocated uint8 array) whose size is bounded by 'memory_budget'.
+    When there are more samples than slots, the reservoir holds a uniform random subset of them.
+    """
+    def __init__(self, video_path, shape, mode="shared", n_samples=SAMPLES_BUDGET, frame_range=None, percentile=50, memory_budget=MEDIAN_MEMORY):
         # Absolute path of the video file.
         self.video_path = video_path
         # Capture object to read the video file.
-        self.video      = cv2.VideoCapture(video_path)
+        self.video      = open_luma(video_path)
         # Lock to read the file from the workers.
         self.lock       = threading.Lock()
         # Shape of the video frames.
         self.shape      = shape
-        # Buffer in which the mean is stored.
+        # Buffer in which the result (mean or percentile) is stored.
         self.buffer     = np.zeros(self.shape, np.float32)
+        # Exact running sum of the grayscale frames of the mean modes.
+        self.sum        = np.zeros(self.shape, np.uint64)
         # Total number of frames in the video.
         self.ttl_frames = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+        # 'shared' (one capture for all the workers), 'segments' (one capture per worker) or 'sampled' (seek to a few frames).
+        self.mode       = mode
+        # Number of frames to use in the 'sampled' mode.
+        self.n_samples  = max(1, int(n_samples))
+        # Range [start, end[ of frames to sample from (the whole video if None).
+        self.frame_range = (0, self.ttl_frames) if frame_range is None else frame_range
+        # Number of frames actually consumed, the mean is divided by this value (and not by the frame count of the container).
+        self.n_read     = 0
+        # Percentile computed in the 'median' mode.
+        self.percentile = percentile
+        # Peak memory of the 'median' mode (in bytes).
+        self.memory_budget = memory_budget
+        # Reservoir of grayscale frames of the 'median' mode, allocated when the processing starts.
+        self.reservoir  = None
+        # Random generator used to replace the frames of the reservoir.
+        self.rng        = np.random.default_rng(0)
 
-    def read_frames(self, frames_count=32):
+    def read_batch(self, video, frames_count=BATCH_SIZE):
+        """
+        Reads a batch of frames from a capture.
+        Only one frame out of 'skip' is decoded, the previous decoded frame is repeated for the others.
+        """
         frames = []
-        skip = 3
-        with self.lock: 
-            for i in range(frames_count):
-                if i % skip != 0:
-                    ret = self.video.grab()
-                else:
-                    ret, frame = self.video.read()
-                if not ret:
-                    break
-                frames.append(frame)
+        for i in range(frames_count):
+            if i % SKIP != 0:
+                ret = video.grab()
+            else:
+                ret, frame = video.read()
+            if not ret:
+                break
+            frames.append(frame)
         return frames
 
-    def process_frames(self, frames):
-        acc = np.zeros(self.shape)
+    def read_frames(self, frames_count=BATCH_SIZE):
+        with self.lock: 
+            return self.read_batch(self.video, frames_count)
+
+    def accumulate(self, frames, stack=None):
+        """
+        Sums a batch of frames in grayscale.
+        The frames are converted into a stack of uint8 images, summed in uint32 (exact as long as a batch has less than 2^24 frames).
+        A frame repeated in the batch (see 'read_batch') is converted only once.
+
+        Args:
+            frames: List of BGR frames.
+            stack: Optional uint8 buffer of shape (n, height, width) with n >= len(frames), reused between batches.
+
+        Returns:
+            The uint32 sum of the batch.
+        """
+        if (stack is None) or (len(stack) < len(frames)):
+            stack = np.empty((len(frames),) + tuple(self.shape), np.uint8)
         for i in range(len(frames)):
-            t = cv2.cvtColor(frames[i], cv2.COLOR_BGR2GRAY).astype(np.float32) / float(self.ttl_frames)
-            acc += t
+            if (i > 0) and (frames[i] is frames[i-1]):
+                stack[i] = stack[i-1]
+            else:
+                to_gray(frames[i], stack[i])
+        return stack[:len(frames)].sum(axis=0, dtype=np.uint32)
 
+    def process_frames(self, frames, stack=None):
+        acc = self.accumulate(frames, stack)
         with self.lock: 
-            self.buffer += acc
+            self.sum += acc
+            self.n_read += len(frames)
 
     def worker(self):
+        stack = np.empty((BATCH_SIZE,) + tuple(self.shape), np.uint8)
         while True:
             frames = self.read_frames()
             if not frames:
                 break  
-            self.process_frames(frames)
+            self.process_frames(frames, stack)
+
+    def segment_worker(self, frame_range):
+        """
+        Accumulates the frames of the range [start, end[ with a dedicated capture.
+        The start is a multiple of BATCH_SIZE, so the frames are sampled as in the 'shared' mode.
+        If 'end' is None, the frames are read until the end of the file (the frame count of the container may be wrong).
+        """
+        start, end = frame_range
+        if (end is not None) and (start >= end):
+            return
+        video = open_luma(self.video_path)
+        video.set(cv2.CAP_PROP_POS_FRAMES, start)
+        stack = np.empty((BATCH_SIZE,) + tuple(self.shape), np.uint8)
+        acc = np.zeros(self.shape, np.uint64)
+        count = 0
+        b_start = start
+        while (end is None) or (b_start < end):
+            frames = self.read_batch(video, BATCH_SIZE if end is None else min(BATCH_SIZE, end - b_start))
+            if not frames:
+                break
+            acc += self.accumulate(frames, stack)
+            count += len(frames)
+            b_start += BATCH_SIZE
+        video.release()
+        with self.lock: 
+            self.sum += acc
+            self.n_read += count
+
+    def get_sample_indices(self):
+        """
+        Indices of the frames used in the 'sampled' mode, evenly spread over 'frame_range'.
+        """
+        start = max(0, int(self.frame_range[0]))
+        end   = min(self.ttl_frames, int(self.frame_range[1]))
+        if end <= start:
+            return np.array([], np.int64)
+        return np.unique(np.linspace(start, end - 1, min(self.n_samples, end - start)).round().astype(np.int64))
+
+    def read_samples(self, indices):
+        """
+        Generator reading the frames at the given (sorted) indices with a dedicated capture.
+        Close samples are reached by grabbing the frames in between, far ones by seeking.
+        The frames that can't be read are skipped.
+        """
+        if len(indices) == 0:
+            return
+        video = open_luma(self.video_path)
+        position = 0
+        for index in indices:
+            gap = index - position
+            if (gap < 0) or (gap > SEEK_GAP):
+                video.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+            else:
+                for _ in range(gap):
+                    video.grab()
+            ret, frame = video.read()
+            position = index + 1
+            if ret:
+                yield frame
+        video.release()
+
+    def sample_worker(self, indices):
+        acc = np.zeros(self.shape, np.uint64)
+        count = 0
+        for frame in self.read_samples(indices):
+            acc += to_gray(frame)
+            count += 1
+        with self.lock: 
+            self.sum += acc
+            self.n_read += count
+
+    def allocate_reservoir(self, n_samples):
+        """
+        Allocates the reservoir, with 3/4 of the memory budget (but no more slots than samples).
+        """
+        frame_bytes = self.shape[0] * self.shape[1]
+        n_slots = max(1, min(n_samples, (self.memory_budget * 3 // 4) // frame_bytes))
+        self.reservoir = np.empty((n_slots,) + tuple(self.shape), np.uint8)
+
+    def median_worker(self, indices):
+        """
+        Adds the frames at the given indices to the reservoir (Algorithm R).
+        The i-th frame seen replaces a random slot with a probability n_slots/i.
+        """
+        n_slots = len(self.reservoir)
+        for frame in self.read_samples(indices):
+            with self.lock:
+                self.n_read += 1
+                slot = self.n_read - 1 if self.n_read <= n_slots else int(self.rng.integers(self.n_read))
+                if slot < n_slots:
+                    to_gray(frame, self.reservoir[slot])
+
+    def reduce_reservoir(self):
+        """
+        Computes the percentile of the reservoir, by tiles of rows fitting in 1/4 of the memory budget.
+        """
+        samples = self.reservoir[:min(self.n_read, len(self.reservoir))]
+        if len(samples) == 0:
+            return
+        height, width = self.shape[0], self.shape[1]
+        tile_rows = max(1, (self.memory_budget // 4) // (len(samples) * width))
+        for y0 in range(0, height, tile_rows):
+            tile = np.percentile(samples[:, y0:y0+tile_rows], self.percentile, axis=0)
+            self.buffer[y0:y0+tile_rows] = np.round(tile)
 
     def start_processing(self, num_workers=16):
         with ThreadPoolExecutor(max_workers=num_workers) as executor:
-            futures = [executor.submit(self.worker) for _ in range(num_workers)]
+            if self.mode == "segments":
+                ranges  = split_frame_ranges(self.ttl_frames, num_workers, BATCH_SIZE)
+                ranges  = [r for r in ranges if r[0] < r[1]] or [(0, 0)]
+                ranges[-1] = (ranges[-1][0], None)
+                futures = [executor.submit(self.segment_worker, r) for r in ranges]
+            elif self.mode == "sampled":
+                indices = self.get_sample_indices()
+                ranges  = split_frame_ranges(len(indices), num_workers)
+                futures = [executor.submit(self.sample_worker, indices[s:e]) for (s, e) in ranges]
+            elif self.mode == "median":
+                indices = self.get_sample_indices()
+                ranges  = split_frame_ranges(len(indices), num_workers)
+                self.allocate_reservoir(len(indices))
+                futures = [executor.submit(self.median_worker, indices[s:e]) for (s, e) in ranges]
+            else:
+                futures = [executor.submit(self.worker) for _ in range(num_workers)]
             for future in futures:
                 future.result()
+        if self.mode == "median":
+            self.reduce_reservoir()
+            self.reservoir = None
+        else:
+            # Single (integer) division, by the number of frames actually consumed.
+            self.buffer[:] = self.sum // max(1, self.n_read)
         return self.release_resources()
 
     def release_resources(self):
@@ -73,14 +329,20 @@ class QtWorkerVMP(QObject):
 
     bg_ready = Signal(np.ndarray, str)
 
-    def __init__(self, video_path, shape):
+    def __init__(self, video_path, shape, mode="shared", num_workers=16, n_samples=SAMPLES_BUDGET, frame_range=None, percentile=50, memory_budget=MEDIAN_MEMORY):
         super().__init__()
-        self.video_path = video_path
-        self.shape      = shape
+        self.video_path  = video_path
+        self.shape       = shape
+        self.mode        = mode
+        self.num_workers = num_workers
+        self.n_samples   = n_samples
+        self.frame_range = frame_range
+        self.percentile  = percentile
+        self.budget      = memory_budget
 
     def run(self):
-        vmp = VideoMeanProcessor(self.video_path, self.shape)
-        ref = vmp.start_processing()
+        vmp = VideoMeanProcessor(self.video_path, self.shape, self.mode, self.n_samples, self.frame_range, self.percentile, self.budget)
+        ref = vmp.start_processing(self.num_workers)
         self.bg_ready.emit(ref, self.video_path)
 
 
@@ -88,10 +350,10 @@ if __name__ == "__main__":
     directory = "/home/benedetti/Documents/projects/25-entry-exit-mouse-monitor/data-samples/"
     name      = "WIN_20210830_11_11_50_Pro.mp4"
     full_path = os.path.join(directory, name)
-    processor = VideoMeanProcessor(full_path, (480, 640))
+    processor = VideoMeanProcessor(full_path, (480, 640), mode="segments")
 
     start_time = time.time()
-    m = processor.start_processing()
+    m = processor.start_processing(os.cpu_count())
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"The code block took {elapsed_time} seconds to execute.")